@@ -4,35 +4,65 @@
 # pip install pandas tkcalendar reportlab
 
 from __future__ import annotations
+import sys
+import time
+# Início da abertura (relatório com --profile-startup)
+_STARTUP_T0 = time.perf_counter()
+_STARTUP_MARKS = []
 import os
 import io
+import multiprocessing
+import re
 import json
 import base64
+import codecs
+import csv
+import difflib
+import getpass
+import gzip
+import hashlib
+import socket
+import sqlite3
 import traceback
+from array import array
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from contextlib import contextmanager
 from datetime import datetime, timedelta, date
 from typing import Dict, Any, List, Optional, Tuple
 import unicodedata
 
+def startup_mark(label: str):
+    """Registra o fim de uma etapa da abertura do programa."""
+    _STARTUP_MARKS.append((label, time.perf_counter()))
+
+startup_mark("bibliotecas padrão")
+
 # GUI
 from tkinter import (
     Tk, Toplevel, Frame, Label, Entry, Button, StringVar, BooleanVar, Spinbox, Canvas, Listbox,
     ttk, filedialog, messagebox, LEFT, RIGHT, X, Y, BOTH, NSEW, RIDGE, SUNKEN, FLAT, WORD, Text, Scrollbar, END, DISABLED, NORMAL, EXTENDED
 )
-from tkcalendar import DateEntry
+startup_mark("tkinter")
 
-# PDF
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.colors import black # Adicionado para uso na grade/linhas
+# Bibliotecas pesadas são importadas só quando usadas, para a janela abrir rápido:
+# reportlab ao gerar PDF, pandas/openpyxl ao importar ou exportar planilhas,
+# tkcalendar quando abre um campo de data.
+DEFERRED_MODULES = ("tkcalendar", "reportlab.pdfgen.canvas", "pandas", "openpyxl")
 
 # ---------------------------
 # CONFIGURAÇÕES E CONSTANTES
 # ---------------------------
 DATA_STORE = "escalas_store.json"
+# Arquivo morto do store: entradas de funcionários que saíram do quadro (JSON Lines + gzip)
+STORE_ARCHIVE = "escalas_store_arquivo.jsonl.gz"
 LOGO_B64_PATH = "logo.txt"
 OUTPUT_FOLDER = "Pontos Gerados"
+# Escalas congeladas dos períodos fechados (assinados)
+SNAPSHOT_DB = "fechamentos.sqlite3"
+# Log de auditoria (segmentos gzip só de acréscimo + índice por funcionário)
+AUDIT_FOLDER = "auditoria"
+# Planilhas já convertidas (evita reprocessar o mesmo arquivo)
+IMPORT_CACHE_FOLDER = "cache_importacao"
 
 WEEKDAY_PT_SHORT = {0: "SEG", 1: "TER", 2: "QUA", 3: "QUI", 4: "SEX", 5: "SÁB", 6: "DOM"}
 
@@ -52,6 +82,18 @@ SCALE_TYPES = {
     "12X36": {"cycle": [0, 1]}, # 1 Folga, 1 Trabalha (inicia com Folga, alinhando com a 1ª Folga)
 }
 
+# Ocorrências manuais por dia (emp_faltas_atestados): tipo gravado -> texto no PDF/tela
+OCCURRENCE_TYPES = ("FOLGA", "FERIADO", "FERIAS", "ATESTADO")
+OCCURRENCE_LABELS = {"FOLGA": "FOLGA", "FERIADO": "FERIADO", "FERIAS": "FÉRIAS", "ATESTADO": "ATESTADO"}
+# Cor de fundo de cada tipo nos calendários da tela
+OCCURRENCE_COLORS = {"FOLGA": "#27ae60", "FERIADO": "#e67e22", "FERIAS": "#3498db", "ATESTADO": "#c0392b"}
+# Cor e legenda de cada tipo de dia da agenda calculada (prévia da escala)
+SCHEDULE_COLORS = dict(OCCURRENCE_COLORS, TRABALHADO="#ffffff", FOLGA_DOMINGO_EXTRA="#16a085", ANTES_ADMISSAO="#bdc3c7")
+SCHEDULE_LEGEND = (
+    ("TRABALHADO", "TRABALHA"), ("FOLGA", "FOLGA"), ("FOLGA_DOMINGO_EXTRA", "FOLGA DOMINGO"),
+    ("FERIADO", "FERIADO"), ("FERIAS", "FÉRIAS"), ("ATESTADO", "ATESTADO"), ("ANTES_ADMISSAO", "ANTES DA ADMISSÃO"),
+)
+
 # DEFAULT_WEEKLY_TEMPLATE removido - não mais necessário após remoção de horários automáticos
 
 # ---------------------------
@@ -61,6 +103,9 @@ def normalize_text(s: str) -> str:
     """Remove acentos e coloca em minúsculas para comparação flexível."""
     if s is None:
         s = ""
+    s = str(s)
+    if s.isascii():
+        return s.casefold()  # nada a decompor
     # NFD decompõe acentos; removemos letras da categoria Mn (marcas)
     decomposed = unicodedata.normalize('NFD', str(s))
     no_accents = ''.join(c for c in decomposed if unicodedata.category(c) != 'Mn')
@@ -84,21 +129,272 @@ def safe_path_name(name: str) -> str:
     safe = safe.strip().replace(" ", "_").replace("__", "_").upper()
     return safe or "SEM_POSTO"
 
-def load_store() -> dict:
-    if os.path.exists(DATA_STORE):
+def _json_default(obj):
+    """Serializa tipos que o json não conhece (datas de admissão)."""
+    if isinstance(obj, (date, datetime)):
+        return obj.strftime("%Y-%m-%d")
+    if isinstance(obj, set):
+        return sorted(obj)
+    raise TypeError(f"TIPO NÃO SERIALIZÁVEL: {type(obj).__name__}")
+
+# ---------------------------
+# ACESSO AO STORE (VÁRIAS ESTAÇÕES NA MESMA PASTA)
+# ---------------------------
+# O store pode ficar numa pasta compartilhada usada por várias estações ao
+# mesmo tempo. Cada gravação:
+#   1) pega o lock consultivo (arquivo .lock criado com O_EXCL);
+#   2) relê o arquivo do disco e compara o "_version" com a versão que esta
+#      estação leu por último (base);
+#   3) se outra estação gravou no meio tempo, faz merge em 3 vias
+#      (base x nosso x disco) por seção e, nos dicionários, por chave;
+#   4) grava num arquivo temporário e troca atomicamente (os.replace).
+STORE_LOCK_SUFFIX = ".lock"
+STORE_LOCK_TIMEOUT = 15.0        # segundos esperando o lock antes de desistir
+STORE_LOCK_STALE_SECONDS = 60.0  # lock mais velho que isso é de processo que morreu
+STORE_READ_RETRIES = 20          # releituras (50 ms) de um store que existe mas não abriu/parseou
+
+# Último conteúdo sincronizado com o disco por este processo (base do merge)
+_store_base: Dict[str, Any] = {}
+# Callback chamado após um merge com dados de outra estação: fn(store, conflitos)
+_store_merge_listener = None
+# Motivo da última falha de save_store (mostrado ao operador)
+_store_last_error = ""
+
+class StoreLockTimeout(Exception):
+    pass
+
+class StoreReadError(Exception):
+    """O store existe mas não pôde ser lido (travado, meio gravado, JSON inválido)."""
+    pass
+
+class StoreLock:
+    """Lock consultivo baseado em arquivo, válido entre máquinas numa pasta de rede."""
+
+    def __init__(self, path: str = DATA_STORE, timeout: float = STORE_LOCK_TIMEOUT):
+        self.lock_path = path + STORE_LOCK_SUFFIX
+        self.timeout = timeout
+        self.fd = None
+
+    def _server_now(self) -> float:
+        """
+        Hora do servidor de arquivos: mtime de um arquivo recém-criado ao lado do lock.
+        A idade do lock é medida no mesmo relógio que carimbou o lock, então
+        diferença de relógio entre estações não derruba um lock vivo.
+        """
+        probe = f"{self.lock_path}.{socket.gethostname()}.{os.getpid()}.clock"
+        with open(probe, "w") as f:
+            f.write("")
         try:
-            with open(DATA_STORE, "r", encoding="utf-8") as f:
+            return os.path.getmtime(probe)
+        finally:
+            os.remove(probe)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        next_stale_check = 0.0
+        while True:
+            try:
+                self.fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(self.fd, f"{socket.gethostname()} {os.getpid()} {now_str()}".encode("utf-8"))
+                return self
+            except FileExistsError:
+                if time.monotonic() >= next_stale_check:
+                    next_stale_check = time.monotonic() + 1.0
+                    try:
+                        if self._server_now() - os.path.getmtime(self.lock_path) > STORE_LOCK_STALE_SECONDS:
+                            os.remove(self.lock_path)
+                            continue
+                    except FileNotFoundError:
+                        continue  # lock sumiu entre as chamadas; tenta de novo
+                    except OSError:
+                        pass
+                if time.monotonic() > deadline:
+                    raise StoreLockTimeout(f"STORE EM USO POR OUTRA ESTAÇÃO ({self.lock_path})")
+                time.sleep(0.1)
+
+    def release(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            finally:
+                self.fd = None
+                try:
+                    os.remove(self.lock_path)
+                except OSError:
+                    pass
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+def _jsonable(obj):
+    """Cópia do objeto na forma em que ele fica no JSON (datas -> texto, sets -> listas)."""
+    return json.loads(json.dumps(obj, ensure_ascii=False, default=_json_default))
+
+def _read_store_file(path: str = DATA_STORE) -> dict:
+    """
+    Store do disco; {} só quando o arquivo não existe.
+    Arquivo que existe mas não abre/parseia (travado pelo antivírus ou por outra
+    estação, gravação pela metade) é relido algumas vezes e então gera
+    StoreReadError: tratá-lo como vazio faria o merge apagar as seções dos outros.
+    """
+    for attempt in range(STORE_READ_RETRIES):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
-        except Exception:
+        except FileNotFoundError:
             return {}
+        except (OSError, ValueError) as e:
+            if attempt == STORE_READ_RETRIES - 1:
+                raise StoreReadError(f"NÃO FOI POSSÍVEL LER {path}: {e}") from e
+            time.sleep(0.05)
     return {}
 
-def save_store(store: dict):
+def _write_store_file(store: dict, path: str = DATA_STORE):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False, indent=2, default=_json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    # No Windows o replace falha se alguém estiver lendo o arquivo neste instante
+    for attempt in range(20):
+        try:
+            os.replace(tmp, path)
+            return
+        except PermissionError:
+            if attempt == 19:
+                raise
+            time.sleep(0.05)
+
+_ABSENT = object()
+
+def _merge3(base, mine, theirs, path: Tuple[str, ...], conflicts: List[Tuple[str, ...]]):
+    """Merge em 3 vias de um valor. Quem mudou vence; se os dois mudaram, nosso vence."""
+    if mine == base:
+        return theirs
+    if theirs == base or theirs == mine:
+        return mine
+    # Os dois lados mudaram: dicionários de primeiro nível são mesclados por chave
+    if len(path) == 1 and all(isinstance(x, dict) for x in (mine, theirs)):
+        b = base if isinstance(base, dict) else {}
+        merged = {}
+        for k in list(mine.keys()) + [k for k in theirs if k not in mine]:
+            v = _merge3(b.get(k, _ABSENT), mine.get(k, _ABSENT), theirs.get(k, _ABSENT),
+                        path + (k,), conflicts)
+            if v is not _ABSENT:
+                merged[k] = v
+        return merged
+    # Lista de textos (ex.: histórico de postos): união
+    if all(isinstance(x, list) and all(isinstance(i, str) for i in x) for x in (mine, theirs)):
+        return sorted(set(mine) | set(theirs))
+    conflicts.append(path)
+    return mine
+
+def merge_store(base: dict, mine: dict, theirs: dict) -> Tuple[dict, List[Tuple[str, ...]]]:
+    """
+    Merge em 3 vias do store inteiro (todas as entradas na forma JSON).
+    Retorna (store_mesclado, conflitos); cada conflito é (seção,) ou (seção, chave).
+    """
+    conflicts: List[Tuple[str, ...]] = []
+    merged = {}
+    sections = list(mine.keys()) + [k for k in theirs if k not in mine]
+    for sec in sections:
+        if sec == "_version":
+            continue
+        v = _merge3(base.get(sec, _ABSENT), mine.get(sec, _ABSENT), theirs.get(sec, _ABSENT),
+                    (sec,), conflicts)
+        if v is not _ABSENT:
+            merged[sec] = v
+    return merged, conflicts
+
+def _apply_merged(store: dict, merged: dict):
+    """
+    Copia o resultado do merge para dentro do store existente, preservando a
+    identidade dos dicionários/listas (a interface guarda referências a eles).
+    """
+    for sec in [k for k in store if k not in merged and k != "_version"]:
+        del store[sec]
+    for sec, val in merged.items():
+        cur = store.get(sec, _ABSENT)
+        if cur is not _ABSENT and _jsonable(cur) == val:
+            continue
+        if isinstance(cur, dict) and isinstance(val, dict):
+            cur.clear()
+            cur.update(val)
+        elif isinstance(cur, list) and isinstance(val, list):
+            cur[:] = val
+        else:
+            store[sec] = val
+
+def set_store_merge_listener(fn):
+    global _store_merge_listener
+    _store_merge_listener = fn
+
+def read_store_snapshot() -> dict:
+    """Leitura avulsa do store (não altera a base usada no merge)."""
+    return _read_store_file()
+
+def load_store() -> dict:
+    global _store_base
+    store = _read_store_file()
+    _store_base = _jsonable(store)
+    return store
+
+def save_store(store: dict) -> bool:
+    """Grava o store (lock + merge). False = nada foi gravado; motivo em store_last_error()."""
+    global _store_base, _store_last_error
+    _store_last_error = ""
     try:
-        with open(DATA_STORE, "w", encoding="utf-8") as f:
-            json.dump(store, f, ensure_ascii=False, indent=2)
+        with StoreLock():
+            disk = _read_store_file()
+            disk_version = int(disk.get("_version", 0) or 0)
+            base_version = int(_store_base.get("_version", 0) or 0)
+            conflicts: List[Tuple[str, ...]] = []
+            mine = _jsonable(store)
+            # O que ESTA estação alterou desde a última sincronização (vai para a auditoria)
+            audit_records = diff_audited_sections(_store_base, mine)
+            merged_from_disk = disk_version != base_version
+            if merged_from_disk:
+                # Outra estação gravou depois da nossa última leitura
+                merged, conflicts = merge_store(_store_base, mine, disk)
+                _apply_merged(store, merged)
+            store["_version"] = max(disk_version, base_version) + 1
+            _write_store_file(store)
+            _store_base = _jsonable(store)
+            if audit_records:
+                try:
+                    AuditLog().append(audit_records)
+                except Exception as e:
+                    print("ERRO AO GRAVAR AUDITORIA:", e)
+        if merged_from_disk:
+            print(f"[{now_str()}] STORE MESCLADO COM ALTERAÇÕES DE OUTRA ESTAÇÃO ({len(conflicts)} CONFLITOS)")
+            if _store_merge_listener:
+                _store_merge_listener(store, conflicts)
+        return True
     except Exception as e:
         print("ERRO AO SALVAR STORE:", e)
+        _store_last_error = str(e) or type(e).__name__
+        return False
+
+def store_last_error() -> str:
+    return _store_last_error
+
+@contextmanager
+def store_transaction():
+    """
+    Leitura-alteração-gravação atômica do store, para rotinas sem interface
+    (ex.: geração em lote agendada):
+
+        with store_transaction() as st:
+            st.setdefault("emp_revisado", {})["M:123"] = True
+    """
+    with StoreLock():
+        store = _read_store_file()
+        yield store
+        store["_version"] = int(store.get("_version", 0) or 0) + 1
+        _write_store_file(store)
 
 def safe_remove_file(path: str) -> bool:
     if not os.path.exists(path):
@@ -183,15 +479,50 @@ def daterange(start_date: date, end_date: date):
         yield cur
         cur += timedelta(days=1)
 
+def month_starts(start_date: date, end_date: date) -> List[date]:
+    """Primeiro dia de cada mês tocado pelo período (um item por página do calendário)."""
+    months = []
+    y, m = start_date.year, start_date.month
+    while (y, m) <= (end_date.year, end_date.month):
+        months.append(date(y, m, 1))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+def month_grid_dates(year: int, month: int) -> List[date]:
+    """As 42 datas (6 semanas, domingo a sábado) da folha do mês, com sobras dos meses vizinhos."""
+    first = date(year, month, 1)
+    grid_start = first - timedelta(days=(first.weekday() + 1) % 7)
+    return [grid_start + timedelta(days=i) for i in range(42)]
+
+# filial -> (assinatura do store/logo.txt, ImageReader ou None)
+_LOGO_CACHE: Dict[str, Tuple[Any, Any]] = {}
+
+def _file_signature(path: str):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
 def load_logo_image(filial=None):
     """
     Carrega logo do store.
     Se filial for fornecida, busca logo específico da filial em logos_filiais.
     Caso contrário, usa logo_base64 global como fallback.
     Retorna ImageReader ou None.
+    Resultado fica em cache até o store ou o logo.txt mudarem no disco.
     """
+    sig = (_file_signature(DATA_STORE), _file_signature(LOGO_B64_PATH))
+    cached = _LOGO_CACHE.get(filial or "")
+    if cached and cached[0] == sig:
+        return cached[1]
+    logo = _load_logo_image(filial)
+    _LOGO_CACHE[filial or ""] = (sig, logo)
+    return logo
+
+def _load_logo_image(filial=None):
     try:
-        store = load_store()
+        store = read_store_snapshot()
         b64 = None
         
         # Tenta carregar logo específico da filial
@@ -211,6 +542,7 @@ def load_logo_image(filial=None):
         if not b64:
             return None
         
+        from reportlab.lib.utils import ImageReader
         data = base64.b64decode(b64)
         return ImageReader(io.BytesIO(data))
     
@@ -218,6 +550,1416 @@ def load_logo_image(filial=None):
         print("ERRO AO CARREGAR LOGO:", e)
         return None
 
+# ---------------------------
+# ÍNDICE DE FUNCIONÁRIOS (CHAVE ESTÁVEL)
+# ---------------------------
+# Versão do formato do store: 2 = estado por funcionário indexado pela chave estável
+STORE_SCHEMA_VERSION = 2
+
+# Seções do store com estado por funcionário (todas indexadas pela chave estável)
+EMP_STATE_SECTIONS = (
+    "emp_scale_choice", "emp_first_off", "emp_faltas_atestados",
+    "emp_revisado", "emp_trabalha_feriado", "emp_personal_hols",
+)
+
+# Prefixos da chave: M = matrícula, C = CPF, N = nome (último recurso)
+EMP_KEY_PREFIXES = ("M:", "C:", "N:")
+
+def only_digits(s) -> str:
+    return "".join(ch for ch in str(s or "") if ch.isdigit())
+
+def normalize_matricula(mat) -> str:
+    """Normaliza a matrícula para comparação: '00123', '123' e '123.0' viram '123'."""
+    m = str(mat or "").strip().upper()
+    if m.endswith(".0") and m[:-2].isdigit():
+        m = m[:-2]  # número lido do Excel como float
+    if m.isdigit():
+        m = m.lstrip("0") or "0"
+    return m
+
+def employee_key(emp: dict) -> str:
+    """
+    Chave estável do funcionário: matrícula; na falta dela, CPF (só dígitos);
+    em último caso o nome em maiúsculas.
+    """
+    mat = normalize_matricula(emp.get("matricula"))
+    if mat:
+        return f"M:{mat}"
+    cpf = only_digits(emp.get("cpf"))
+    if cpf:
+        return f"C:{cpf}"
+    return f"N:{str(emp.get('nome', '') or '').strip().upper()}"
+
+def is_employee_key(k: str) -> bool:
+    return isinstance(k, str) and k.startswith(EMP_KEY_PREFIXES)
+
+def coerce_employee_record(emp: dict) -> dict:
+    """Garante 'admissao' como date (o store em JSON guarda como AAAA-MM-DD)."""
+    adm = emp.get("admissao")
+    if isinstance(adm, str):
+        try:
+            emp["admissao"] = datetime.strptime(adm.strip()[:10], "%Y-%m-%d").date()
+        except Exception:
+            emp["admissao"] = None
+    return emp
+
+class EmployeeIndex:
+    """
+    Índice em memória do quadro de funcionários.
+    - by_key: chave estável -> registro (O(1))
+    - índices secundários por nome, posto e filial (-> chaves, em ordem de inserção;
+      dict usado como conjunto ordenado para remover em O(1))
+    Cada registro recebe o campo 'id' com sua chave. Matrículas repetidas na
+    mesma planilha recebem sufixo (#2, #3...) para não colidirem.
+    """
+
+    def __init__(self, funcionarios: Optional[List[Dict[str, Any]]] = None):
+        self.by_key: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Dict[str, None]] = {}
+        self.by_posto: Dict[str, Dict[str, None]] = {}
+        self.by_filial: Dict[str, Dict[str, None]] = {}
+        self.rebuild(funcionarios or [])
+
+    def rebuild(self, funcionarios: List[Dict[str, Any]]):
+        self.by_key = {}
+        self.by_name = {}
+        self.by_posto = {}
+        self.by_filial = {}
+        assign_employee_keys(funcionarios)
+        for emp in funcionarios:
+            self._add(emp["id"], emp)
+
+    def _secondary(self, emp: Dict[str, Any]):
+        return (
+            (self.by_name, (emp.get("nome", "") or "").strip().upper()),
+            (self.by_posto, emp.get("posto", "") or ""),
+            (self.by_filial, (emp.get("filial", "") or "").strip().upper()),
+        )
+
+    def _add(self, key: str, emp: Dict[str, Any]):
+        self.by_key[key] = emp
+        for idx, value in self._secondary(emp):
+            idx.setdefault(value, {})[key] = None
+
+    def remove(self, key: str):
+        emp = self.by_key.pop(key, None)
+        if emp is None:
+            return
+        for idx, value in self._secondary(emp):
+            keys = idx.get(value)
+            if keys and key in keys:
+                del keys[key]
+                if not keys:
+                    del idx[value]
+
+    def update(self, key: str, changes: Dict[str, Any]):
+        """Altera campos de um registro mantendo os índices secundários em dia."""
+        emp = self.by_key[key]
+        self.remove(key)
+        emp.update(changes)
+        self._add(key, emp)
+
+    def __len__(self) -> int:
+        return len(self.by_key)
+
+    def __contains__(self, key) -> bool:
+        return key in self.by_key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.by_key.get(key)
+
+    def keys_for_name(self, nome: str) -> List[str]:
+        return list(self.by_name.get((nome or "").strip().upper(), ()))
+
+    def keys_for_posto(self, posto: str) -> List[str]:
+        return list(self.by_posto.get(posto or "", ()))
+
+    def keys_for_filial(self, filial: str) -> List[str]:
+        return list(self.by_filial.get((filial or "").strip().upper(), ()))
+
+    def postos(self) -> List[str]:
+        return sorted(p for p in self.by_posto if p)
+
+    def filiais(self) -> List[str]:
+        return sorted(f for f in self.by_filial if f)
+
+def assign_employee_keys(funcionarios: List[Dict[str, Any]]) -> List[str]:
+    """Grava em cada registro o campo 'id' (chave estável, com #2, #3... para repetidas)."""
+    seen = set()
+    keys = []
+    for emp in funcionarios:
+        base = employee_key(emp)
+        key = base
+        n = 2
+        while key in seen:
+            key = f"{base}#{n}"
+            n += 1
+        seen.add(key)
+        emp["id"] = key
+        keys.append(key)
+    return keys
+
+# Campos do cadastro comparados na importação incremental
+ROSTER_FIELDS = ("nome", "matricula", "admissao", "funcao", "filial", "cnpj",
+                 "endereco", "cidade", "cpf", "posto")
+
+def diff_roster(index: EmployeeIndex, incoming: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compara a planilha nova com o quadro atual pela chave estável.
+    Retorna {"new": [registro], "changed": [(chave, {campo: valor novo})],
+    "unchanged": int, "departed": [chave]}.
+    """
+    new, changed, unchanged = [], [], 0
+    seen = set()
+    for rec in incoming:
+        key = rec["id"]
+        seen.add(key)
+        cur = index.get(key)
+        if cur is None:
+            new.append(rec)
+            continue
+        delta = {f: rec.get(f) for f in ROSTER_FIELDS if cur.get(f) != rec.get(f)}
+        if delta:
+            changed.append((key, delta))
+        else:
+            unchanged += 1
+    departed = [k for k in index.by_key if k not in seen]
+    return {"new": new, "changed": changed, "unchanged": unchanged, "departed": departed}
+
+def apply_roster_diff(funcionarios: List[Dict[str, Any]], index: EmployeeIndex, diff: Dict[str, Any]):
+    """Aplica só as diferenças ao quadro (lista alterada no lugar) e ao índice."""
+    for key, delta in diff["changed"]:
+        index.update(key, delta)
+    if diff["departed"]:
+        gone = set(diff["departed"])
+        for key in gone:
+            index.remove(key)
+        funcionarios[:] = [e for e in funcionarios if e.get("id") not in gone]
+    for rec in diff["new"]:
+        funcionarios.append(rec)
+        index._add(rec["id"], rec)
+
+# Campos pesquisáveis na busca da tela principal
+SEARCH_FIELDS = ("nome", "matricula", "cpf", "posto", "funcao")
+
+def search_tokens(text) -> List[str]:
+    """Palavras comparáveis: sem acentos, minúsculas, só letras/dígitos."""
+    return re.findall(r"[0-9a-z]+", normalize_text(text))
+
+class EmployeeSearchIndex:
+    """
+    Índice da busca: cada termo da consulta precisa aparecer (como trecho)
+    em alguma palavra do nome, matrícula, CPF, posto ou função.
+    - hay[linha]: palavras normalizadas do funcionário, separadas por espaço
+    - grams: trigrama -> ids das palavras do vocabulário que o contêm
+    Termos de 3+ letras consultam só as palavras da menor lista entre os seus
+    trigramas; termos curtos (ou quando já restam poucos candidatos) são
+    conferidos direto no texto dos candidatos.
+    """
+    SCAN_LIMIT = 2000  # com até essa quantidade de candidatos, conferir direto é mais barato
+
+    def __init__(self, funcionarios: List[Dict[str, Any]]):
+        self.keys: List[str] = [emp.get("id") or employee_key(emp) for emp in funcionarios]
+        self.hay: List[str] = []
+        self.tokens: List[str] = []
+        self.token_rows: List[List[int]] = []
+        token_ids: Dict[str, int] = {}
+        for row, emp in enumerate(funcionarios):
+            text = " ".join(str(emp.get(f) or "") for f in SEARCH_FIELDS)
+            words = set(search_tokens(text))
+            cpf_digits = only_digits(emp.get("cpf"))
+            if cpf_digits:
+                words.add(cpf_digits)  # CPF digitado sem pontuação
+            self.hay.append(" ".join(words))
+            for w in words:
+                tid = token_ids.get(w)
+                if tid is None:
+                    tid = token_ids[w] = len(self.tokens)
+                    self.tokens.append(w)
+                    self.token_rows.append([])
+                self.token_rows[tid].append(row)
+        grams: Dict[str, array] = {}
+        for tid, w in enumerate(self.tokens):
+            for g in {w[i:i + 3] for i in range(len(w) - 2)}:
+                posting = grams.get(g)
+                if posting is None:
+                    posting = grams[g] = array("I")
+                posting.append(tid)
+        self.grams = grams
+        self._cache: Dict[str, set] = {}
+
+    def _rows_for_term(self, term: str) -> set:
+        cached = self._cache.get(term)
+        if cached is not None:
+            return cached
+        best = None
+        for i in range(len(term) - 2):
+            posting = self.grams.get(term[i:i + 3])
+            if posting is None:
+                best = ()
+                break
+            if best is None or len(posting) < len(best):
+                best = posting
+        rows = set()
+        for tid in best or ():
+            if term in self.tokens[tid]:
+                rows.update(self.token_rows[tid])
+        if len(self._cache) > 256:
+            self._cache.clear()
+        self._cache[term] = rows
+        return rows
+
+    def search(self, query: str) -> Optional[List[str]]:
+        """Chaves que atendem a todos os termos, na ordem do quadro (None = sem filtro)."""
+        terms = sorted(set(search_tokens(query)), key=len, reverse=True)
+        if not terms:
+            return None
+        result: Optional[set] = None
+        for term in terms:
+            if len(term) >= 3 and (result is None or len(result) > self.SCAN_LIMIT):
+                rows = self._rows_for_term(term)
+                result = set(rows) if result is None else result & rows
+            else:
+                candidates = range(len(self.hay)) if result is None else result
+                hay = self.hay
+                result = {r for r in candidates if term in hay[r]}
+            if not result:
+                return []
+        return [self.keys[r] for r in sorted(result)]
+
+def migrate_employee_state(store: dict, index: EmployeeIndex) -> int:
+    """
+    Migra o estado por funcionário ainda indexado pelo NOME (formato antigo)
+    para a chave estável. Homônimos herdam o mesmo valor antigo.
+    Entradas cujo nome não existe no quadro atual ficam como estão.
+    Retorna a quantidade de entradas migradas.
+    """
+    moved = 0
+    for section in EMP_STATE_SECTIONS:
+        data = store.get(section)
+        if not isinstance(data, dict) or not data:
+            continue
+        legacy = [k for k in data if not is_employee_key(k)]
+        for old_key in legacy:
+            keys = index.keys_for_name(old_key)
+            if not keys:
+                continue
+            value = data.pop(old_key)
+            for k in keys:
+                # Valor já gravado pela chave nova tem prioridade
+                data.setdefault(k, value.copy() if isinstance(value, (dict, list)) else value)
+            moved += 1
+    store["store_schema"] = STORE_SCHEMA_VERSION
+    return moved
+
+def store_size_bytes(store: dict) -> int:
+    """Tamanho do store serializado exatamente como save_store grava."""
+    return len(json.dumps(store, ensure_ascii=False, indent=2, default=_json_default).encode("utf-8"))
+
+def compact_store(store: dict, live_keys, archive_path: str = STORE_ARCHIVE) -> Dict[str, int]:
+    """
+    Remove do store as entradas por funcionário cuja chave não está no quadro
+    atual (funcionários desligados, nomes antigos) e as acrescenta ao arquivo
+    morto comprimido. Cada compactação grava um membro gzip com uma linha JSON,
+    então o arquivo só cresce no fim e nunca é reescrito.
+    Retorna {"entries", "bytes_before", "bytes_after", "bytes_reclaimed"}.
+    """
+    live = set(live_keys)
+    before = store_size_bytes(store)
+    orphans: Dict[str, Dict[str, Any]] = {}
+    for section in EMP_STATE_SECTIONS:
+        data = store.get(section)
+        if not isinstance(data, dict):
+            continue
+        dead = [k for k in data if k not in live]
+        if dead:
+            orphans[section] = {k: data.pop(k) for k in dead}
+
+    entries = sum(len(v) for v in orphans.values())
+    if entries:
+        line = json.dumps({"archived_at": now_str(), "sections": orphans},
+                          ensure_ascii=False, default=_json_default)
+        offset = os.path.getsize(archive_path) if os.path.exists(archive_path) else 0
+        with gzip.open(archive_path, "at", encoding="utf-8") as f:
+            f.write(line + "\n")
+        # Registra o membro novo no índice (se o índice estiver em dia até aqui)
+        segments = _read_archive_index(archive_path, offset)
+        if _archive_index_end(segments) == offset:
+            keys = sorted({k for data in orphans.values() for k in data})
+            segments.append([offset, os.path.getsize(archive_path) - offset, keys])
+            _write_archive_index(archive_path, segments)
+
+    after = store_size_bytes(store)
+    return {"entries": entries, "bytes_before": before, "bytes_after": after,
+            "bytes_reclaimed": before - after}
+
+# Índice do arquivo morto: [deslocamento, tamanho, chaves] de cada membro gzip,
+# para que a restauração só descomprima os trechos com funcionários de volta.
+def _archive_index_path(archive_path: str) -> str:
+    return archive_path + ".idx.json"
+
+def _archive_index_end(segments: List[list]) -> int:
+    return segments[-1][0] + segments[-1][1] if segments else 0
+
+def _read_archive_index(archive_path: str, archive_size: int) -> List[list]:
+    """Trechos indexados, contíguos desde o início e dentro do tamanho atual do arquivo."""
+    try:
+        with open(_archive_index_path(archive_path), "r", encoding="utf-8") as f:
+            raw = json.load(f).get("segments", [])
+    except Exception:
+        return []
+    segments = []
+    for seg in raw:
+        try:
+            offset, length, keys = int(seg[0]), int(seg[1]), list(seg[2])
+        except Exception:
+            break
+        if offset != _archive_index_end(segments) or length <= 0 or offset + length > archive_size:
+            break
+        segments.append([offset, length, keys])
+    return segments
+
+def _write_archive_index(archive_path: str, segments: List[list]):
+    path = _archive_index_path(archive_path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segments": segments}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        print("ERRO AO GRAVAR ÍNDICE DO ARQUIVO MORTO:", e)
+
+def _read_archive_records(archive_path: str, offset: int, length: int):
+    with open(archive_path, "rb") as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length)).decode("utf-8")
+    for line in data.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+def restore_archived_state(store: dict, live_keys, archive_path: str = STORE_ARCHIVE) -> int:
+    """
+    Devolve ao store as entradas arquivadas de funcionários que voltaram ao
+    quadro (recontratação, planilha parcial importada antes). O valor mais
+    recente do arquivo vence; valores já presentes no store não são tocados.
+    Só os trechos do arquivo que contêm essas chaves são lidos (ver índice);
+    o que ainda não está indexado é lido uma vez e entra no índice.
+    """
+    if not os.path.exists(archive_path):
+        return 0
+    live = set(live_keys)
+    found: Dict[str, Dict[str, Any]] = {}
+
+    def take(rec) -> set:
+        keys = set()
+        for section, entries in rec.get("sections", {}).items():
+            for k, v in entries.items():
+                keys.add(k)
+                if k in live:
+                    found.setdefault(section, {})[k] = v
+        return keys
+
+    try:
+        size = os.path.getsize(archive_path)
+        segments = _read_archive_index(archive_path, size)
+        for offset, length, keys in segments:
+            if not live.isdisjoint(keys):
+                for rec in _read_archive_records(archive_path, offset, length):
+                    take(rec)
+        end = _archive_index_end(segments)
+        if end < size:
+            tail_keys = set()
+            for rec in _read_archive_records(archive_path, end, size - end):
+                tail_keys |= take(rec)
+            segments.append([end, size - end, sorted(tail_keys)])
+            _write_archive_index(archive_path, segments)
+    except Exception as e:
+        print("ERRO AO LER ARQUIVO MORTO DO STORE:", e)
+        return 0
+    restored = 0
+    for section, entries in found.items():
+        data = store.setdefault(section, {})
+        for k, v in entries.items():
+            if k not in data:
+                data[k] = v
+                restored += 1
+    return restored
+
+def format_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024.0
+    return f"{n:.1f} GB"
+
+# ---------------------------
+# AUDITORIA (QUEM ALTEROU O QUÊ E QUANDO)
+# ---------------------------
+# Seções do store cujas alterações são auditadas
+AUDITED_SECTIONS = EMP_STATE_SECTIONS + (
+    "global_holidays", "holiday_type", "holiday_postos", "holiday_cidades", "cidades",
+)
+AUDIT_SEGMENT_MAX_BYTES = 1024 * 1024  # segmento novo a cada ~1 MB comprimido (ou a cada mês)
+AUDIT_GLOBAL_KEY = "*"                 # entradas que não são de um funcionário (feriados, cidades)
+
+def audit_operator() -> str:
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = "?"
+    return f"{user}@{socket.gethostname()}"
+
+def diff_audited_sections(before: dict, after: dict) -> List[Dict[str, Any]]:
+    """
+    Registros de auditoria (forma compacta) para cada chave alterada entre
+    dois estados do store. Em valores que são dicionários (ocorrências por
+    dia), guarda só os dias que mudaram.
+    Campos: t=data/hora, u=operador, s=seção, k=chave, o=antes, n=depois.
+    """
+    stamp = now_str()
+    user = None
+    records = []
+    for sec in AUDITED_SECTIONS:
+        b = before.get(sec) or {}
+        a = after.get(sec) or {}
+        if b == a or not isinstance(a, dict) or not isinstance(b, dict):
+            continue
+        for k in list(b.keys()) + [k for k in a if k not in b]:
+            old, new = b.get(k), a.get(k)
+            if old == new:
+                continue
+            if isinstance(old, dict) and isinstance(new, dict):
+                changed = [d for d in set(old) | set(new) if old.get(d) != new.get(d)]
+                old = {d: old[d] for d in changed if d in old}
+                new = {d: new[d] for d in changed if d in new}
+            if user is None:
+                user = audit_operator()
+            records.append({"t": stamp, "u": user, "s": sec, "k": k, "o": old, "n": new})
+    return records
+
+class AuditLog:
+    """
+    Log de auditoria só de acréscimo, em segmentos gzip (auditoria_AAAAMM_NNN.jsonl.gz).
+    indice.json guarda, por funcionário, em quais segmentos ele aparece e o
+    intervalo de datas em cada um; a consulta de histórico só descomprime
+    os segmentos que interessam.
+    A gravação acontece dentro do lock do store (ver save_store).
+    """
+
+    def __init__(self, folder: str = AUDIT_FOLDER):
+        self.folder = folder
+        self.index_path = os.path.join(folder, "indice.json")
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {"segments": {}, "employees": {}}
+
+    def _save_index(self, index: dict):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def _current_segment(self, index: dict, stamp: str) -> str:
+        month = stamp[:7].replace("-", "")
+        names = sorted(n for n in index["segments"] if n.startswith(f"auditoria_{month}_"))
+        if names:
+            last = names[-1]
+            path = os.path.join(self.folder, last)
+            if not os.path.exists(path) or os.path.getsize(path) < AUDIT_SEGMENT_MAX_BYTES:
+                return last
+            seq = int(last.rsplit("_", 1)[1].split(".")[0]) + 1
+        else:
+            seq = 1
+        return f"auditoria_{month}_{seq:03d}.jsonl.gz"
+
+    def append(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        safe_mkdir(self.folder)
+        index = self._load_index()
+        stamp = records[0]["t"]
+        seg = self._current_segment(index, stamp)
+        # Cada append é um membro gzip novo no fim do arquivo (nada é reescrito)
+        with gzip.open(os.path.join(self.folder, seg), "at", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+        seg_info = index["segments"].setdefault(seg, {"first": stamp, "last": stamp, "count": 0})
+        seg_info["last"] = stamp
+        seg_info["count"] += len(records)
+        for rec in records:
+            who = rec["k"] if rec["s"] in EMP_STATE_SECTIONS else AUDIT_GLOBAL_KEY
+            rng = index["employees"].setdefault(who, {}).setdefault(seg, [rec["t"], rec["t"]])
+            rng[0] = min(rng[0], rec["t"])
+            rng[1] = max(rng[1], rec["t"])
+        self._save_index(index)
+
+    def history(self, emp_key: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Alterações de um funcionário (ou AUDIT_GLOBAL_KEY) entre start e end
+        ('AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM:SS', inclusivos).
+        """
+        lo = start or ""
+        hi = (end + " 99") if end and len(end) == 10 else (end or "9999")
+        index = self._load_index()
+        out = []
+        for seg, (first, last) in sorted(index["employees"].get(emp_key, {}).items()):
+            if last < lo or first > hi:
+                continue
+            path = os.path.join(self.folder, seg)
+            if not os.path.exists(path):
+                continue
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if emp_key != AUDIT_GLOBAL_KEY and emp_key not in line:
+                        continue  # filtro barato antes de decodificar
+                    rec = json.loads(line)
+                    who = rec["k"] if rec["s"] in EMP_STATE_SECTIONS else AUDIT_GLOBAL_KEY
+                    if who == emp_key and lo <= rec["t"] <= hi:
+                        out.append(rec)
+        return out
+
+# ---------------------------
+# IMPORTAÇÃO DE PLANILHAS (OPERAÇÕES POR COLUNA)
+# ---------------------------
+# Campo do funcionário -> nomes aceitos para a coluna na planilha
+ROSTER_COLUMNS = {
+    "nome": ["NOME", "name", "NOME DO FUNCIONÁRIO", "NOME DO COLABORADOR", "NOME COMPLETO", "FUNCIONÁRIO", "COLABORADOR"],
+    "matricula": ["MATRICULA", "matricula", "Nº MATRÍCULA", "MATRÍCULA DO FUNCIONÁRIO"],
+    "admissao": ["ADMISSAO", "ADMISSÃO"],
+    "cpf": ["CPF", "CPF DO FUNCIONÁRIO", "CPF DO COLABORADOR"],
+    "filial": ["FILIAL", "Empresa"],
+    "cnpj": ["CNPJ"],
+    "funcao": ["FUNCAO", "FUNÇÃO", "cargo"],
+    "posto": ["POSTO", "posto"],
+    "endereco": ["ENDERECO", "ENDEREÇO"],
+    "cidade": ["CIDADE", "city"],
+    # TIPO DE JORNADA e PRIMEIRO DIA DE FOLGA (colunas K e L)
+    "escala": ["JORNADA (5X1 / 5X2 / 6X1 FIXO / 6X1 INTERCALADA / 12X36)", "TIPO DE JORNADA", "JORNADA", "ESCALA"],
+    "primeira_folga": ["PRIMEIRO DIA DE FOLGA", "PRIMEIRODIADEFOLGA", "1 FOLGA", "PRIMEIRA FOLGA"],
+}
+# Colunas de texto: as que vão em maiúsculas e as que só perdem espaços
+ROSTER_UPPER_FIELDS = ("nome", "funcao", "filial", "posto", "endereco", "cidade")
+ROSTER_STRIP_FIELDS = ("matricula", "cnpj", "cpf")
+# Formatos aceitos, na ordem de tentativa (o último cobre datas do Excel lidas como texto)
+ADMISSAO_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d %H:%M:%S")
+PRIMEIRA_FOLGA_FORMATS = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%Y-%m-%d %H:%M:%S")
+
+# Similaridade mínima (difflib) para aceitar um cabeçalho parecido com um apelido
+HEADER_FUZZY_CUTOFF = 0.85
+# Prefixo mínimo (em caracteres) para "FUNÇÃO EXERCIDA" casar com "FUNCAO"
+HEADER_PREFIX_MIN = 3
+# Campos que identificam o funcionário: só nome de coluna exato ("NOME DA MÃE" não é NOME)
+HEADER_EXACT_ONLY_FIELDS = ("nome", "matricula", "cpf")
+_HEADER_CACHE: Dict[Tuple, Dict[str, Optional[str]]] = {}
+_HEADER_CACHE_MAX = 32
+
+def normalize_header(name) -> str:
+    """Cabeçalho comparável: sem acentos, minúsculo e só com letras/dígitos."""
+    return re.sub(r"[^0-9a-z]", "", normalize_text(name))
+
+def compile_header_aliases(extra: Optional[Dict[str, List[str]]] = None,
+                           columns_table: Optional[Dict[str, List[str]]] = None) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """
+    Tabela (campo, apelidos normalizados) na ordem de prioridade.
+    'extra' vem do store (chave 'import_aliases') e tem precedência sobre
+    'columns_table' (padrão: ROSTER_COLUMNS).
+    """
+    table = []
+    for field, aliases in (columns_table or ROSTER_COLUMNS).items():
+        names = list((extra or {}).get(field, [])) + list(aliases)
+        seen = []
+        for a in names:
+            na = normalize_header(a)
+            if na and na not in seen:
+                seen.append(na)
+        table.append((field, tuple(seen)))
+    return tuple(table)
+
+def _match_headers(headers: List[str], table) -> Tuple[Dict[str, Optional[int]], set]:
+    """
+    (campo -> posição da coluna, campos associados sem nome exato).
+    Três rodadas, cada coluna usada no máximo uma vez: igualdade exata, depois
+    prefixo e por fim semelhança (difflib). Prefixo e semelhança não valem para
+    HEADER_EXACT_ONLY_FIELDS e só associam quando UMA única coluna livre se
+    qualifica; na semelhança o cabeçalho não pode ser mais curto que o apelido
+    ("IDADE" não vira CIDADE).
+    """
+    result: Dict[str, Optional[int]] = {field: None for field, _ in table}
+    inexact = set()
+    used = set()
+    positions: Dict[str, int] = {}
+    for i, h in enumerate(headers):
+        positions.setdefault(h, i)
+
+    for field, aliases in table:
+        for alias in aliases:
+            i = positions.get(alias)
+            if i is not None and i not in used:
+                result[field] = i
+                used.add(i)
+                break
+
+    def prefix(alias) -> set:
+        if len(alias) < HEADER_PREFIX_MIN:
+            return set()
+        return {i for i, h in enumerate(headers) if i not in used and h.startswith(alias)}
+
+    def fuzzy(alias) -> set:
+        return {i for i, h in enumerate(headers)
+                if i not in used and h and len(h) >= len(alias)
+                and difflib.SequenceMatcher(None, alias, h).ratio() >= HEADER_FUZZY_CUTOFF}
+
+    for candidates in (prefix, fuzzy):
+        for field, aliases in table:
+            if result[field] is not None or field in HEADER_EXACT_ONLY_FIELDS:
+                continue
+            found = set()
+            for alias in aliases:
+                found |= candidates(alias)
+            if len(found) == 1:  # mais de uma coluna parecida: ambíguo, não adivinha
+                result[field] = found.pop()
+                used.add(result[field])
+                inexact.add(field)
+    return result, inexact
+
+def resolve_columns(columns, extra_aliases: Optional[Dict[str, List[str]]] = None,
+                    columns_table: Optional[Dict[str, List[str]]] = None) -> Tuple[Dict[str, Optional[str]], Dict[str, str]]:
+    """
+    (campo -> coluna da planilha ou None, campo -> coluna associada sem nome exato).
+    O resultado fica em cache pela assinatura do cabeçalho: reimportar o
+    mesmo layout não refaz a resolução.
+    """
+    columns = list(columns)
+    table = compile_header_aliases(extra_aliases, columns_table)
+    signature = (tuple(str(c) for c in columns), table)
+    cached = _HEADER_CACHE.get(signature)
+    if cached is None:
+        found, inexact = _match_headers([normalize_header(c) for c in columns], table)
+        colmap = {field: (columns[i] if i is not None else None) for field, i in found.items()}
+        cached = (colmap, {field: colmap[field] for field in inexact})
+        if len(_HEADER_CACHE) >= _HEADER_CACHE_MAX:
+            _HEADER_CACHE.pop(next(iter(_HEADER_CACHE)))
+        _HEADER_CACHE[signature] = cached
+    return dict(cached[0]), dict(cached[1])
+
+def resolve_roster_columns(columns, extra_aliases: Optional[Dict[str, List[str]]] = None,
+                           columns_table: Optional[Dict[str, List[str]]] = None) -> Dict[str, Optional[str]]:
+    """Campo do funcionário -> coluna da planilha (None se não encontrada)."""
+    return resolve_columns(columns, extra_aliases, columns_table)[0]
+
+def normalize_jornada(value: str) -> str:
+    """
+    Converte o texto da planilha para uma chave de SCALE_TYPES ('' se não reconhecido).
+    Aceita variações como "6x1 fica", "6x1 fixo", "6x1 intercalada", etc.
+    """
+    tj = str(value).strip().lower().replace("(", "").replace(")", "").strip()
+    if not tj:
+        return ""
+    if "5x2" in tj or "5 x 2" in tj:
+        return "5X2"
+    if "5x1" in tj or "5 x 1" in tj:
+        return "5X1"
+    if "12x36" in tj or "12 x 36" in tj:
+        return "12X36"
+    if "6x1" in tj or "6 x 1" in tj:
+        return "6X1 (INTERCALADA)" if "intercalad" in tj else "6X1 (FIXO)"
+    return ""
+
+def _map_distinct(series, fn):
+    # Colunas como JORNADA têm poucos valores distintos: calcula uma vez por valor
+    import pandas as pd
+    table = {v: fn(v) for v in pd.unique(series)}
+    return series.map(table)
+
+def parse_date_series(series, formats: Tuple[str, ...]):
+    """Converte uma coluna de texto em datas tentando cada formato só nas linhas ainda sem data."""
+    import pandas as pd
+    s = series.astype(str).str.strip()
+    out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    pending = s != ""
+    for fmt in formats:
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(s[pending], format=fmt, errors="coerce")
+        out = out.combine_first(parsed)
+        pending &= out.isna()
+    return out
+
+CSV_SAMPLE_BYTES = 64 * 1024
+CSV_VALIDATE_BLOCK = 1024 * 1024
+CSV_CHUNK_ROWS = 50000
+CSV_DELIMITERS = ";,\t|"
+
+def sniff_csv(path: str, sample_bytes: int = CSV_SAMPLE_BYTES) -> Tuple[str, str]:
+    """
+    Descobre (encoding, separador). O separador sai só do começo do arquivo;
+    o encoding é UTF-8 (com ou sem BOM) se o arquivo INTEIRO decodificar,
+    senão latin-1 — um latin-1 cujo começo é só ASCII passaria na amostra.
+    """
+    with open(path, "rb") as f:
+        sample = f.read(sample_bytes)
+        if sample.startswith(codecs.BOM_UTF8):
+            encoding = "utf-8-sig"
+        else:
+            encoding = "utf-8"
+        # Decodificador incremental: um caractere cortado no fim da amostra não é erro
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            text = decoder.decode(sample, final=False)
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+            text = sample.decode(encoding)
+        else:
+            try:
+                while True:
+                    block = f.read(CSV_VALIDATE_BLOCK)
+                    decoder.decode(block, final=not block)
+                    if not block:
+                        break
+            except UnicodeDecodeError:
+                print(f"[{now_str()}] AVISO: {os.path.basename(path)} NÃO É UTF-8 DEPOIS DOS PRIMEIROS "
+                      f"{format_bytes(len(sample))}; LIDO COMO LATIN-1.")
+                encoding = "latin-1"
+    lines = text.splitlines()
+    if len(sample) == sample_bytes and len(lines) > 1:
+        lines = lines[:-1]  # última linha da amostra pode estar incompleta
+    try:
+        sep = csv.Sniffer().sniff("\n".join(lines), delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        header = lines[0] if lines else ""
+        sep = max(CSV_DELIMITERS, key=header.count) if header else ","
+    return encoding, sep
+
+def iter_csv_chunks(path: str, chunksize: int = CSV_CHUNK_ROWS):
+    """
+    Lê o CSV em blocos com o parser C, sem carregar o arquivo inteiro.
+    Gera (DataFrame do bloco, fração lida do arquivo entre 0 e 1).
+    Decodificação estrita: sniff_csv já validou o encoding no arquivo todo.
+    """
+    import pandas as pd
+    encoding, sep = sniff_csv(path)
+    total = max(os.path.getsize(path), 1)
+    with open(path, "rb") as f:
+        reader = pd.read_csv(
+            f, dtype=str, sep=sep, engine="c", encoding=encoding,
+            chunksize=chunksize, keep_default_na=False,
+        )
+        for chunk in reader:
+            yield chunk, min(f.tell() / total, 1.0)
+
+XLSX_CHUNK_ROWS = 20000
+
+def _xlsx_cell_text(value) -> str:
+    # Mesmo texto que pd.read_excel(dtype=str) produziria para a célula
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _unique_headers(raw) -> List[str]:
+    # Cabeçalhos vazios/repetidos recebem nomes únicos, como no pandas
+    out, seen = [], {}
+    for i, h in enumerate(raw):
+        name = _xlsx_cell_text(h).strip() or f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        out.append(name)
+    return out
+
+def iter_xlsx_chunks(path: str, chunksize: int = XLSX_CHUNK_ROWS):
+    """
+    Lê a primeira aba do XLSX em modo somente leitura (openpyxl), linha a linha,
+    sem carregar a pasta de trabalho inteira. O cabeçalho é a primeira linha
+    não vazia. Gera (DataFrame de texto do bloco, fração lida entre 0 e 1).
+    """
+    import pandas as pd
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        total = ws.max_row or 0
+        rows = ws.iter_rows(values_only=True)
+        headers = None
+        for raw in rows:
+            if any(v is not None and str(v).strip() for v in raw):
+                headers = _unique_headers(raw)
+                break
+        if headers is None:
+            return
+        width = len(headers)
+        buf: List[List[str]] = []
+        read = 1
+        for raw in rows:
+            read += 1
+            cells = [_xlsx_cell_text(v) for v in raw[:width]]
+            if len(cells) < width:
+                cells += [""] * (width - len(cells))
+            buf.append(cells)
+            if len(buf) >= chunksize:
+                yield pd.DataFrame(buf, columns=headers, dtype=str), (read / total if total else 0.0)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=headers, dtype=str), 1.0
+    finally:
+        wb.close()
+
+def roster_records_from_frame(df, colmap: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+    """
+    Converte a planilha (DataFrame de texto) em registros de funcionários
+    usando operações por coluna; as linhas sem nome são descartadas.
+    Cada registro traz também 'escala' e 'primeira_folga' (texto, '' se ausente),
+    que o chamador retira e aplica pela chave estável.
+    """
+    import pandas as pd
+    n = len(df)
+    empty = pd.Series([""] * n, index=df.index, dtype=object)
+
+    def text(field):
+        col = colmap.get(field)
+        return df[col].fillna("").astype(str).str.strip() if col else empty
+
+    cols: Dict[str, Any] = {}
+    for field in ROSTER_UPPER_FIELDS:
+        cols[field] = text(field).str.upper()
+    for field in ROSTER_STRIP_FIELDS:
+        cols[field] = text(field)
+
+    keep = cols["nome"] != ""
+    adm = parse_date_series(text("admissao"), ADMISSAO_FORMATS)
+    cols["admissao"] = pd.Series(adm.dt.date, index=df.index, dtype=object).where(adm.notna(), None)
+    cols["escala"] = _map_distinct(text("escala"), normalize_jornada)
+    folga = parse_date_series(text("primeira_folga"), PRIMEIRA_FOLGA_FORMATS)
+    cols["primeira_folga"] = folga.dt.strftime("%Y-%m-%d").fillna("")
+
+    fields = ("nome", "matricula", "admissao", "funcao", "filial", "cnpj",
+              "endereco", "cidade", "cpf", "posto", "escala", "primeira_folga")
+    columns = [cols[f][keep].tolist() for f in fields]
+    return [dict(zip(fields, values)) for values in zip(*columns)]
+
+class RosterImportError(Exception):
+    pass
+
+class RosterImportCancelled(Exception):
+    pass
+
+def read_table_headers(path: str) -> List[str]:
+    """Só o cabeçalho (mesmos nomes que iter_table_chunks daria), para conferir colunas antes de importar."""
+    import pandas as pd
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xls":
+        return list(pd.read_excel(path, dtype=str, nrows=0).columns)
+    if ext in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for raw in wb.worksheets[0].iter_rows(values_only=True):
+                if any(v is not None and str(v).strip() for v in raw):
+                    return _unique_headers(raw)
+            return []
+        finally:
+            wb.close()
+    encoding, sep = sniff_csv(path)
+    return list(pd.read_csv(path, dtype=str, sep=sep, engine="c", encoding=encoding, nrows=0).columns)
+
+def iter_table_chunks(path: str):
+    """Blocos de texto (DataFrame, fração lida) de um CSV, XLSX ou XLS."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xls":
+        import pandas as pd
+        return iter([(pd.read_excel(path, dtype=str).fillna(""), 1.0)])
+    if ext in (".xlsx", ".xlsm"):
+        return iter_xlsx_chunks(path)
+    return iter_csv_chunks(path)
+
+def read_roster_file(path: str, extra_aliases: Optional[Dict[str, List[str]]] = None, on_progress=None) -> List[Dict[str, Any]]:
+    """
+    Lê e converte uma planilha de funcionários (CSV/XLSX em blocos; XLS inteiro).
+    on_progress(fração, lidos) pode devolver False para cancelar (RosterImportCancelled).
+    Sem coluna NOME ou arquivo vazio: RosterImportError.
+    """
+    records: List[Dict[str, Any]] = []
+    colmap = None
+    for chunk, frac in iter_table_chunks(path):
+        if colmap is None:
+            colmap = resolve_roster_columns(chunk.columns, extra_aliases)
+            if not colmap["nome"]:
+                raise RosterImportError("Coluna 'NOME' não encontrada.")
+        records.extend(roster_records_from_frame(chunk, colmap))
+        if on_progress is not None and on_progress(frac, len(records)) is False:
+            raise RosterImportCancelled()
+    if colmap is None:
+        raise RosterImportError("ARQUIVO VAZIO.")
+    return records
+
+def records_to_columns(records: List[Dict[str, Any]]) -> Tuple[List[str], List[list]]:
+    # Forma por colunas: bem mais barata de serializar (cache, outro processo) que lista de dicts
+    fields = list(records[0].keys()) if records else []
+    return fields, [[r.get(f) for r in records] for f in fields]
+
+def records_from_columns(fields: List[str], columns: List[list]) -> List[Dict[str, Any]]:
+    return [dict(zip(fields, values)) for values in zip(*columns)]
+
+def read_roster_file_columns(path: str, extra_aliases: Optional[Dict[str, List[str]]] = None):
+    """read_roster_file para rodar em outro processo: devolve (campos, colunas)."""
+    return records_to_columns(read_roster_file(path, extra_aliases))
+
+def merge_roster_files(per_file: List[Tuple[str, List[Dict[str, Any]]]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Junta as planilhas de várias filiais em um só quadro.
+    Repetições DENTRO de um arquivo continuam recebendo sufixo (#2...); a mesma
+    chave em arquivos diferentes (ex.: transferido entre filiais) fica uma vez só:
+    vale o registro com admissão mais recente e, no empate, o do último arquivo.
+    Retorna (registros, repetidos) com repetidos = [{chave, nome, mantido, descartados}].
+    """
+    chosen: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    sources: Dict[str, List[str]] = {}
+    order: List[str] = []
+    for pos, (path, records) in enumerate(per_file):
+        for key, rec in zip(assign_employee_keys(records), records):
+            name = os.path.basename(path)
+            if key not in chosen:
+                chosen[key] = (pos, rec)
+                sources[key] = [name]
+                order.append(key)
+                continue
+            sources[key].append(name)
+            _, cur = chosen[key]
+            if (rec.get("admissao") or date.min) >= (cur.get("admissao") or date.min):
+                chosen[key] = (pos, rec)
+    merged, dupes = [], []
+    for key in order:
+        pos, rec = chosen[key]
+        merged.append(rec)
+        if len(sources[key]) > 1:
+            kept = os.path.basename(per_file[pos][0])
+            dropped = list(sources[key])
+            dropped.remove(kept)
+            dupes.append({"chave": key, "nome": rec.get("nome", ""), "mantido": kept, "descartados": dropped})
+    return merged, dupes
+
+# Mude ao alterar a conversão da planilha: invalida os caches antigos
+IMPORT_CACHE_VERSION = 3
+IMPORT_CACHE_MAX_FILES = 10
+
+def file_content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ImportCache:
+    """
+    Cache das planilhas já convertidas, em JSON gzip por colunas.
+    Nada de pickle: a pasta pode ficar num compartilhamento gravável por outros,
+    e ler um pickle adulterado executaria código em todas as estações.
+    Caminho rápido: tamanho + data de modificação iguais aos da última leitura.
+    Caso contrário o conteúdo é hasheado (arquivo copiado/tocado mas igual
+    continua aproveitando o cache). A tabela de apelidos de colunas faz parte
+    da chave, pois muda o resultado da conversão.
+    """
+
+    def __init__(self, folder: str = IMPORT_CACHE_FOLDER):
+        self.folder = folder
+        self.index_path = os.path.join(folder, "indice.json")
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_index(self, index: dict):
+        safe_mkdir(self.folder)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    @staticmethod
+    def _variant(extra_aliases) -> str:
+        raw = json.dumps([IMPORT_CACHE_VERSION, compile_header_aliases(extra_aliases)], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+    def _payload_path(self, content_hash: str, variant: str) -> str:
+        return os.path.join(self.folder, f"{content_hash[:32]}_{variant}.json.gz")
+
+    def _content_hash(self, path: str, index: dict) -> str:
+        st = os.stat(path)
+        entry = index.get(os.path.abspath(path))
+        if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+            return entry["sha256"]
+        digest = file_content_hash(path)
+        index[os.path.abspath(path)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": digest}
+        self._save_index(index)
+        return digest
+
+    def load(self, path: str, extra_aliases=None) -> Optional[List[Dict[str, Any]]]:
+        try:
+            index = self._load_index()
+            payload = self._payload_path(self._content_hash(path, index), self._variant(extra_aliases))
+            if not os.path.exists(payload):
+                return None
+            with gzip.open(payload, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            return [coerce_employee_record(rec) for rec in records_from_columns(data["fields"], data["columns"])]
+        except Exception:
+            return None
+
+    def save(self, path: str, extra_aliases, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        try:
+            index = self._load_index()
+            payload = self._payload_path(self._content_hash(path, index), self._variant(extra_aliases))
+            fields, columns = records_to_columns(records)
+            data = {"fields": fields, "columns": columns}
+            tmp = payload + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=1) as f:
+                json.dump(data, f, ensure_ascii=False, default=_json_default)
+            os.replace(tmp, payload)
+            self._prune()
+        except Exception as e:
+            print("ERRO AO GRAVAR CACHE DE IMPORTAÇÃO:", e)
+
+    def _prune(self):
+        names = os.listdir(self.folder)
+        # Caches antigos em pickle nunca são lidos: apaga
+        for name in names:
+            if name.endswith(".pkl.gz"):
+                safe_remove_file(os.path.join(self.folder, name))
+        files = [os.path.join(self.folder, n) for n in names if n.endswith(".json.gz")]
+        files.sort(key=os.path.getmtime, reverse=True)
+        for old in files[IMPORT_CACHE_MAX_FILES:]:
+            safe_remove_file(old)
+
+# ---------------------------
+# EXPORTAÇÃO DO QUADRO (MESMO LAYOUT DA IMPORTAÇÃO)
+# ---------------------------
+# Colunas A-L do modelo, na ordem em que o importador as reconhece
+ROSTER_EXPORT_HEADERS = (
+    ("NOME", "nome"),
+    ("CPF", "cpf"),
+    ("MATRICULA", "matricula"),
+    ("FUNÇÃO", "funcao"),
+    ("POSTO", "posto"),
+    ("ADMISSÃO", "admissao"),
+    ("FILIAL", "filial"),
+    ("CNPJ", "cnpj"),
+    ("ENDEREÇO", "endereco"),
+    ("CIDADE", "cidade"),
+    ("JORNADA (5X1 / 5X2 / 6X1 FIXO / 6X1 INTERCALADA / 12X36)", "escala"),
+    ("PRIMEIRO DIA DE FOLGA", "primeira_folga"),
+)
+
+def iter_roster_export_rows(funcionarios: List[Dict[str, Any]], scale_choice: Dict[str, str],
+                            first_off: Dict[str, str]):
+    """Uma linha (lista de textos) por funcionário, datas em DD/MM/AAAA."""
+    for emp in funcionarios:
+        key = emp.get("id") or employee_key(emp)
+        adm = emp.get("admissao")
+        folga = first_off.get(key) or ""
+        if folga:
+            try:
+                folga = datetime.strptime(folga, "%Y-%m-%d").strftime("%d/%m/%Y")
+            except ValueError:
+                pass
+        values = {
+            "admissao": adm.strftime("%d/%m/%Y") if isinstance(adm, date) else (adm or ""),
+            "escala": scale_choice.get(key, ""),
+            "primeira_folga": folga,
+        }
+        yield [values[f] if f in values else (emp.get(f) or "") for _, f in ROSTER_EXPORT_HEADERS]
+
+def export_roster(path: str, rows) -> int:
+    """
+    Grava as linhas em CSV (';', UTF-8 com BOM, abre direto no Excel) ou XLSX
+    em modo somente escrita (memória constante). Retorna a quantidade de linhas.
+    """
+    headers = [h for h, _ in ROSTER_EXPORT_HEADERS]
+    count = 0
+    if path.lower().endswith(".csv"):
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(headers)
+            for row in rows:
+                w.writerow(row)
+                count += 1
+        return count
+
+    from openpyxl import Workbook
+    from openpyxl.worksheet.datavalidation import DataValidation
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("FUNCIONÁRIOS")
+    ws.freeze_panes = "A2"
+    ws.append(headers)
+    for row in rows:
+        ws.append(row)
+        count += 1
+    # Mesmo dropdown de JORNADA do modelo (coluna K)
+    jornada = DataValidation(type="list", formula1='"' + ",".join(SCALE_TYPES) + '"', allow_blank=True)
+    jornada.add(f"K2:K{max(count + 1, 2)}")
+    ws.data_validations.append(jornada)
+    wb.save(path)
+    return count
+
+# ---------------------------
+# VALIDAÇÃO DO CADASTRO (CPF/CNPJ, REPETIDOS, DATAS)
+# ---------------------------
+# Pesos dos dígitos verificadores (1º e 2º)
+CPF_WEIGHTS = (tuple(range(10, 1, -1)), tuple(range(11, 1, -1)))
+CNPJ_WEIGHTS = ((5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2), (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2))
+ADMISSAO_MIN_ANO = 1950
+
+def valid_document_digits(digits, size: int, weights):
+    """
+    Valida dígitos verificadores (regra módulo 11 de CPF/CNPJ) de uma coluna
+    inteira de uma vez. 'digits' são strings só com dígitos; as de tamanho
+    errado ou com todos os dígitos iguais são inválidas.
+    """
+    import numpy as np
+    digits = list(digits)
+    ok = np.zeros(len(digits), dtype=bool)
+    sized = np.fromiter((len(d) == size for d in digits), dtype=bool, count=len(digits))
+    if not sized.any():
+        return ok
+    joined = "".join(d for d, good in zip(digits, sized) if good)
+    m = np.frombuffer(joined.encode("ascii"), dtype=np.uint8).reshape(-1, size).astype(np.int32) - 48
+    good = ~(m == m[:, :1]).all(axis=1)
+    for w in weights:
+        n = len(w)
+        r = (m[:, :n] * np.array(w, dtype=np.int32)).sum(axis=1) % 11
+        dv = np.where(r < 2, 0, 11 - r)
+        good &= dv == m[:, n]
+    ok[sized] = good
+    return ok
+
+def validate_roster(funcionarios: List[Dict[str, Any]], today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Verifica o quadro inteiro por colunas e devolve a lista de problemas:
+    {gravidade, chave, nome, matricula, campo, problema, valor}.
+    """
+    import pandas as pd
+    if not funcionarios:
+        return []
+    today = today or date.today()
+    df = pd.DataFrame.from_records(
+        funcionarios, columns=["id", "nome", "matricula", "cpf", "cnpj", "posto", "admissao"]
+    )
+    for col in ("id", "nome", "matricula", "cpf", "cnpj", "posto"):
+        df[col] = df[col].fillna("").astype(str).str.strip()
+    issues: List[Dict[str, Any]] = []
+
+    def report(mask, gravidade, campo, problema, valores):
+        for i in df.index[mask]:
+            issues.append({
+                "gravidade": gravidade, "chave": df.at[i, "id"], "nome": df.at[i, "nome"],
+                "matricula": df.at[i, "matricula"], "campo": campo, "problema": problema,
+                "valor": "" if valores[i] is None else str(valores[i]),
+            })
+
+    cpf = df["cpf"].str.replace(r"\D", "", regex=True)
+    has_cpf = cpf != ""
+    cpf_ok = pd.Series(valid_document_digits(cpf, 11, CPF_WEIGHTS), index=df.index)
+    report(has_cpf & ~cpf_ok, "ERRO", "CPF", "CPF INVÁLIDO (DÍGITO VERIFICADOR)", df["cpf"])
+    report(~has_cpf, "AVISO", "CPF", "CPF NÃO INFORMADO", df["cpf"])
+
+    # CNPJ se repete por filial: valida cada valor distinto uma vez
+    cnpj = df["cnpj"].str.replace(r"\D", "", regex=True)
+    distinct = pd.unique(cnpj[cnpj != ""])
+    valid_cnpj = dict(zip(distinct, valid_document_digits(distinct, 14, CNPJ_WEIGHTS)))
+    report((cnpj != "") & ~cnpj.map(valid_cnpj).fillna(True).astype(bool),
+           "ERRO", "CNPJ", "CNPJ INVÁLIDO (DÍGITO VERIFICADOR)", df["cnpj"])
+
+    # Repetidos (agrupamento por hash)
+    mat = df["matricula"].map(normalize_matricula)
+    report((mat != "") & mat.duplicated(keep=False), "ERRO", "MATRÍCULA", "MATRÍCULA REPETIDA", df["matricula"])
+    cpf_groups = df.loc[has_cpf].assign(_cpf=cpf, _mat=mat).groupby("_cpf")["_mat"].nunique()
+    shared = set(cpf_groups.index[cpf_groups > 1])
+    report(cpf.isin(shared), "ERRO", "CPF", "MESMO CPF EM MATRÍCULAS DIFERENTES", df["cpf"])
+
+    # CPF colado na coluna POSTO (mais de 70% de dígitos/pontos/traços)
+    posto = df["posto"]
+    lens = posto.str.len().replace(0, 1)
+    report((posto != "") & (posto.str.count(r"[\d.\-]") / lens > 0.7),
+           "AVISO", "POSTO", "POSTO PARECE UM CPF", posto)
+
+    adm = pd.to_datetime(df["admissao"], errors="coerce")
+    report(adm.isna() & df["admissao"].isna(), "AVISO", "ADMISSÃO", "ADMISSÃO NÃO INFORMADA", df["admissao"])
+    report(adm > pd.Timestamp(today), "ERRO", "ADMISSÃO", "ADMISSÃO NO FUTURO", df["admissao"])
+    report(adm < pd.Timestamp(ADMISSAO_MIN_ANO, 1, 1), "ERRO", "ADMISSÃO",
+           f"ADMISSÃO ANTES DE {ADMISSAO_MIN_ANO}", df["admissao"])
+    return issues
+
+# ---------------------------
+# IMPORTAÇÃO DE OCORRÊNCIAS EM LOTE (FÉRIAS, ATESTADOS, FOLGAS)
+# ---------------------------
+OCCURRENCE_COLUMNS = {
+    "matricula": ["MATRICULA", "REGISTRO"],
+    "cpf": ["CPF"],
+    "nome": ["NOME"],
+    "tipo": ["TIPO", "OCORRENCIA", "MOTIVO"],
+    "inicio": ["INICIO", "DATA INICIO", "DATA INICIAL", "DE", "DATA"],
+    "fim": ["FIM", "DATA FIM", "DATA FINAL", "FINAL", "ATE", "TERMINO", "DATA TERMINO",
+            "DATA DE TERMINO", "RETORNO", "DATA RETORNO"],
+}
+OCCURRENCE_DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%Y-%m-%d %H:%M:%S")
+OCCURRENCE_MAX_DAYS = 366  # período maior que isso é tratado como erro de digitação
+
+def normalize_occurrence_type(value: str) -> str:
+    """Texto da planilha -> tipo de OCCURRENCE_TYPES ('' se não reconhecido)."""
+    t = normalize_header(value)
+    for prefix, tipo in (("ferias", "FERIAS"), ("atestado", "ATESTADO"), ("licenca", "ATESTADO"),
+                         ("folga", "FOLGA"), ("feriado", "FERIADO")):
+        if t.startswith(prefix):
+            return tipo
+    return ""
+
+def expand_occurrences(df, colmap: Dict[str, Optional[str]], key_by_mat: Dict[str, str],
+                       key_by_cpf: Dict[str, str]):
+    """
+    Valida as linhas (funcionário, tipo, início, fim) por colunas e expande
+    cada período em um registro por dia.
+    Retorna (DataFrame[chave, data, tipo, linha], erros [(linha, motivo)]).
+    Sem coluna de fim não dá para saber a duração: ValueError.
+    """
+    import numpy as np
+    import pandas as pd
+    if not colmap.get("fim"):
+        raise ValueError("COLUNA DE FIM NÃO ENCONTRADA")
+    n = len(df)
+    empty = pd.Series([""] * n, index=df.index, dtype=object)
+
+    def text(field):
+        col = colmap.get(field)
+        return df[col].fillna("").astype(str).str.strip() if col else empty
+
+    linha = pd.Series(np.arange(n) + 2, index=df.index)  # linha 1 é o cabeçalho
+    key = text("matricula").map(normalize_matricula).map(key_by_mat)
+    by_cpf = text("cpf").str.replace(r"\D", "", regex=True).map(key_by_cpf)
+    key = key.fillna(by_cpf)
+    tipo = _map_distinct(text("tipo"), normalize_occurrence_type)
+    inicio = parse_date_series(text("inicio"), OCCURRENCE_DATE_FORMATS)
+    fim = parse_date_series(text("fim"), OCCURRENCE_DATE_FORMATS)
+    # FIM em branco (com a coluna presente) = ocorrência de um dia; preenchido e inválido fica NaT e vira erro
+    fim = fim.where(text("fim") != "", inicio)
+    dias = (fim - inicio).dt.days + 1
+
+    problems = [
+        (key.isna(), "FUNCIONÁRIO NÃO ENCONTRADO (MATRÍCULA/CPF)"),
+        (tipo == "", "TIPO DE OCORRÊNCIA DESCONHECIDO"),
+        (inicio.isna(), "DATA DE INÍCIO INVÁLIDA"),
+        (fim.isna() & inicio.notna(), "DATA DE FIM INVÁLIDA"),
+        (dias < 1, "FIM ANTES DO INÍCIO"),
+        (dias > OCCURRENCE_MAX_DAYS, f"PERÍODO MAIOR QUE {OCCURRENCE_MAX_DAYS} DIAS"),
+    ]
+    bad = pd.Series(False, index=df.index)
+    errors: List[Tuple[int, str]] = []
+    for mask, motivo in problems:
+        mask = mask.fillna(False) & ~bad
+        errors.extend((int(l), motivo) for l in linha[mask])
+        bad |= mask
+    ok = ~bad
+    if not ok.any():
+        return pd.DataFrame(columns=["chave", "data", "tipo", "linha"]), sorted(errors)
+
+    # Um registro por dia: repete cada linha 'dias' vezes e soma o deslocamento
+    counts = dias[ok].astype(int).to_numpy()
+    rep_idx = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    start_days = inicio[ok].to_numpy().astype("datetime64[D]")
+    datas = start_days[rep_idx] + offsets.astype("timedelta64[D]")
+    events = pd.DataFrame({
+        "chave": key[ok].to_numpy()[rep_idx],
+        "data": np.datetime_as_string(datas, unit="D"),
+        "tipo": tipo[ok].to_numpy()[rep_idx],
+        "linha": linha[ok].to_numpy()[rep_idx],
+    })
+    return events, sorted(errors)
+
+def merge_occurrences(emp_events: Dict[str, Dict[str, str]], events, overwrite: bool = False,
+                      apply: bool = True) -> Dict[str, Any]:
+    """
+    Junta os eventos expandidos em emp_faltas_atestados (alterado no lugar).
+    Conflitos: o mesmo dia com tipos diferentes dentro da planilha (vale a
+    última linha) ou já gravado com outro tipo (só substitui se overwrite).
+    Com apply=False só conta, sem alterar nada (prévia para perguntar ao usuário).
+    """
+    dup = events.duplicated(["chave", "data"], keep="last")
+    internos = events[dup & ~events.duplicated(["chave", "data", "tipo"], keep="last")]
+    events = events[~dup]
+    stats = {"aplicados": 0, "iguais": 0, "conflitos": [], "internos": len(internos)}
+    for chave, data, tipo, linha in events.itertuples(index=False, name=None):
+        per_emp = emp_events.get(chave) or {}
+        atual = per_emp.get(data)
+        if atual == tipo:
+            stats["iguais"] += 1
+            continue
+        if atual:
+            stats["conflitos"].append((linha, chave, data, atual, tipo))
+            if not overwrite:
+                continue
+        if apply:
+            emp_events.setdefault(chave, {})[data] = tipo
+        stats["aplicados"] += 1
+    return stats
+
+# ---------------------------
+# EDIÇÃO EM LOTE (ESCALA, 1ª FOLGA, OCORRÊNCIAS)
+# ---------------------------
+def bulk_edit_employees(keys: List[str], scale_choice: Dict[str, str], first_off: Dict[str, str],
+                        emp_events: Dict[str, Dict[str, str]], escala: Optional[str] = None,
+                        primeira_folga: Optional[str] = None,
+                        ocorrencia: Optional[Tuple[str, date, int]] = None) -> Dict[str, int]:
+    """
+    Aplica de uma vez a vários funcionários (dicionários alterados no lugar):
+    - escala: nome em SCALE_TYPES
+    - primeira_folga: "AAAA-MM-DD" ("" limpa)
+    - ocorrencia: (tipo, primeiro dia, quantidade de dias); "" no tipo limpa os dias
+    None = não mexe naquele campo. Retorna quantos valores mudaram de fato.
+    """
+    stats = {"escala": 0, "primeira_folga": 0, "ocorrencias": 0}
+    dias: List[str] = []
+    tipo = ""
+    if ocorrencia is not None:
+        tipo, inicio, qnt = ocorrencia
+        dias = [(inicio + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(max(1, qnt))]
+    for key in keys:
+        if escala is not None and scale_choice.get(key) != escala:
+            scale_choice[key] = escala
+            stats["escala"] += 1
+        if primeira_folga is not None and first_off.get(key, "") != primeira_folga:
+            first_off[key] = primeira_folga
+            stats["primeira_folga"] += 1
+        if dias:
+            per_emp = emp_events.get(key)
+            if per_emp is None:
+                if not tipo:
+                    continue
+                per_emp = emp_events[key] = {}
+            for ds in dias:
+                if tipo:
+                    if per_emp.get(ds) != tipo:
+                        per_emp[ds] = tipo
+                        stats["ocorrencias"] += 1
+                elif per_emp.pop(ds, None) is not None:
+                    stats["ocorrencias"] += 1
+    return stats
+
 # ---------------------------
 # SCHEDULE (SIMULAÇÃO E REGRAS)
 # ---------------------------
@@ -241,10 +1983,10 @@ def generate_employee_schedule(employee: dict, config: dict, emp_events: dict):
     cycle_len = len(cycle) if cycle else None
 
     admissao = employee.get("admissao", None)
-    emp_name = employee.get("nome", "")
+    emp_key = employee.get("id") or employee_key(employee)
     emp_posto = employee.get("posto", "")
 
-    emp_events_for_emp = emp_events.get(emp_name, {}).copy()  # copiar para podermos alterar localmente
+    emp_events_for_emp = emp_events.get(emp_key, {}).copy()  # copiar para podermos alterar localmente
 
     # --- Lógica de Alinhamento de Ciclo (para 5X2, 12X36, 5X1) ---
     cycle_start_ref = start # Padrão: alinha com a data de início do período
@@ -294,7 +2036,7 @@ def generate_employee_schedule(employee: dict, config: dict, emp_events: dict):
 
         # eventos manuais
         ev = emp_events_for_emp.get(ds)
-        if ev in ("FOLGA", "FERIADO"):
+        if ev in OCCURRENCE_TYPES:
             final_schedule[ds] = {"type": ev}
             continue
 
@@ -407,9 +2149,660 @@ def generate_employee_schedule(employee: dict, config: dict, emp_events: dict):
     for ds in sorted(final_schedule.keys()):
         yield ds, final_schedule[ds]
 
+def _frozen(value):
+    """Cópia imutável (hashable) de dicts/listas, para compor chaves de cache."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _frozen(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(v) for v in value)
+    if isinstance(value, set):
+        return tuple(sorted(_frozen(v) for v in value))
+    return value
+
+class ScheduleCache:
+    """
+    Agendas já calculadas (AAAA-MM-DD -> entrada), por funcionário e intervalo.
+    A chave leva tudo o que generate_employee_schedule lê (admissão, posto,
+    escala, 1ª folga, ocorrências do funcionário e feriados): mudou qualquer
+    coisa, a chave muda e a agenda é recalculada. As agendas devolvidas são
+    compartilhadas; quem usa só lê.
+    """
+    MAX_ENTRIES = 2048
+
+    def __init__(self):
+        self._entries: Dict[tuple, Dict[str, dict]] = {}
+
+    def get(self, employee: dict, config: dict, emp_events: dict) -> Dict[str, dict]:
+        emp_key = employee.get("id") or employee_key(employee)
+        sig = (
+            emp_key, str(employee.get("admissao") or ""), employee.get("posto", ""),
+            config["start_date"], config["end_date"], config.get("scale_type"), config.get("first_off"),
+            _frozen(emp_events.get(emp_key, {})),
+            _frozen(config.get("holidays", {})), _frozen(config.get("holiday_type", {})),
+            _frozen(config.get("holiday_postos", {})),
+        )
+        schedule = self._entries.get(sig)
+        if schedule is None:
+            schedule = dict(generate_employee_schedule(employee, config, emp_events))
+            if len(self._entries) >= self.MAX_ENTRIES:
+                self._entries.pop(next(iter(self._entries)))  # sai a mais antiga
+            self._entries[sig] = schedule
+        return schedule
+
+# ---------------------------
+# FECHAMENTO DE PERÍODO (ESCALAS CONGELADAS)
+# ---------------------------
+# Cada dia vira 1 byte; um mês inteiro de um funcionário cabe em ~31 bytes.
+SCHEDULE_CODES = {
+    "TRABALHADO": 1,
+    "FOLGA": 2,
+    "FERIADO": 3,
+    "FOLGA_DOMINGO_EXTRA": 4,
+    "ANTES_ADMISSAO": 5,
+    "FERIAS": 6,
+    "ATESTADO": 7,
+}
+SCHEDULE_CODE_TYPES = {v: k for k, v in SCHEDULE_CODES.items()}
+
+# Campos do cabeçalho do PDF guardados junto com a escala congelada
+SNAPSHOT_EMP_FIELDS = ("nome", "cpf", "matricula", "funcao", "posto", "filial", "cnpj", "endereco", "cidade")
+
+def schedule_entry_from_type(etype: str) -> dict:
+    """Recria a entrada de agenda no mesmo formato de generate_employee_schedule."""
+    if etype == "TRABALHADO":
+        return {"type": "TRABALHADO", "entrada": "", "int_start": "", "int_end": "", "saida": ""}
+    if etype == "FOLGA_DOMINGO_EXTRA":
+        return {"type": etype, "obs": "FOLGA DOMINGO EXTRA"}
+    return {"type": etype}
+
+def encode_schedule_codes(entries: Dict[str, dict]) -> Tuple[str, bytes]:
+    """Dias (AAAA-MM-DD -> entrada) -> (primeiro_dia, bytes com 1 código por dia; 0 = dia sem entrada)."""
+    days = sorted(entries)
+    d0 = datetime.strptime(days[0], "%Y-%m-%d").date()
+    span = (datetime.strptime(days[-1], "%Y-%m-%d").date() - d0).days + 1
+    codes = bytearray(span)
+    for ds in days:
+        i = (datetime.strptime(ds, "%Y-%m-%d").date() - d0).days
+        codes[i] = SCHEDULE_CODES.get((entries[ds].get("type") or "").upper(), 0)
+    return days[0], bytes(codes)
+
+def decode_schedule_codes(first_day: str, codes: bytes) -> Dict[str, dict]:
+    d0 = datetime.strptime(first_day, "%Y-%m-%d").date()
+    out = {}
+    for i, code in enumerate(codes):
+        etype = SCHEDULE_CODE_TYPES.get(code)
+        if etype:
+            out[(d0 + timedelta(days=i)).strftime("%Y-%m-%d")] = schedule_entry_from_type(etype)
+    return out
+
+def split_contiguous_days(entries: Dict[str, dict]) -> List[Dict[str, dict]]:
+    """Quebra a agenda em trechos de dias consecutivos."""
+    runs: List[Dict[str, dict]] = []
+    prev = None
+    for ds in sorted(entries):
+        d = datetime.strptime(ds, "%Y-%m-%d").date()
+        if prev is None or (d - prev).days != 1:
+            runs.append({})
+        runs[-1][ds] = entries[ds]
+        prev = d
+    return runs
+
+# 2 = uma linha por trecho fechado do mês (PK com primeiro_dia); 1 = uma linha por mês
+SNAPSHOT_SCHEMA_VERSION = 2
+_SNAPSHOT_TABLE_SQL = (
+    "CREATE TABLE fechamentos ("
+    " periodo TEXT NOT NULL,"        # AAAA-MM
+    " emp_key TEXT NOT NULL,"
+    " primeiro_dia TEXT NOT NULL,"   # AAAA-MM-DD do 1º código
+    " codigos BLOB NOT NULL,"
+    " funcionario TEXT NOT NULL,"    # JSON com os campos do cabeçalho
+    " fechado_em TEXT NOT NULL,"
+    " PRIMARY KEY (periodo, emp_key, primeiro_dia))"
+)
+
+class PeriodSnapshotStore:
+    """
+    Escalas congeladas por funcionário (tabela SQLite, códigos em BLOB), uma
+    linha por trecho fechado dentro de cada mês, cada trecho com o cabeçalho
+    da época. O período fechado pode cortar o mês ao meio (ciclo 16 a 15):
+    fechar um período só substitui os dias dele; os outros dias fechados do
+    mês continuam como foram assinados.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_DB):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=15)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SNAPSHOT_SCHEMA_VERSION:
+            self._migrate(conn)
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Outra estação pode ter migrado enquanto esperávamos o lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SNAPSHOT_SCHEMA_VERSION:
+                old = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fechamentos'").fetchone()
+                if old:
+                    # Linhas da versão 1 (mês inteiro ou parte dele) já são trechos válidos
+                    conn.execute("ALTER TABLE fechamentos RENAME TO fechamentos_v1")
+                conn.execute(_SNAPSHOT_TABLE_SQL)
+                if old:
+                    conn.execute("INSERT INTO fechamentos SELECT * FROM fechamentos_v1")
+                    conn.execute("DROP TABLE fechamentos_v1")
+                conn.execute(f"PRAGMA user_version = {SNAPSHOT_SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close_period(self, rows: List[Tuple[str, str, Dict[str, dict], Dict[str, Any]]]) -> int:
+        """
+        Grava (periodo, emp_key, agenda_do_mes, funcionario) numa transação só.
+        Dias já fechados dentro do mesmo intervalo são substituídos; os de fora
+        ficam como estavam (com o cabeçalho e a data de fechamento originais).
+        """
+        stamp = now_str()
+        conn = self._connect()
+        total = 0
+        try:
+            with conn:
+                for periodo, emp_key, month_schedule, emp in rows:
+                    if not month_schedule:
+                        continue
+                    first, last = min(month_schedule), max(month_schedule)
+                    existing = conn.execute(
+                        "SELECT primeiro_dia, codigos, funcionario, fechado_em FROM fechamentos"
+                        " WHERE periodo = ? AND emp_key = ?", (periodo, emp_key)).fetchall()
+                    for d0, codes, emp_json, closed_at in existing:
+                        days = decode_schedule_codes(d0, bytes(codes))
+                        keep = {ds: v for ds, v in days.items() if not (first <= ds <= last)}
+                        if len(keep) == len(days):
+                            continue
+                        conn.execute("DELETE FROM fechamentos WHERE periodo = ? AND emp_key = ? AND primeiro_dia = ?",
+                                     (periodo, emp_key, d0))
+                        for run in split_contiguous_days(keep):
+                            conn.execute("INSERT INTO fechamentos VALUES (?, ?, ?, ?, ?, ?)",
+                                         (periodo, emp_key, *encode_schedule_codes(run), emp_json, closed_at))
+                    emp_fields = {f: emp.get(f, "") or "" for f in SNAPSHOT_EMP_FIELDS}
+                    conn.execute("INSERT INTO fechamentos VALUES (?, ?, ?, ?, ?, ?)",
+                                 (periodo, emp_key, *encode_schedule_codes(month_schedule),
+                                  json.dumps(emp_fields, ensure_ascii=False), stamp))
+                    total += 1
+        finally:
+            conn.close()
+        return total
+
+    def load_range(self, start: date, end: date,
+                   emp_key: Optional[str] = None) -> Dict[str, List[Tuple[Dict[str, dict], Dict[str, Any]]]]:
+        """
+        emp_key -> [(dias congelados dentro de start..end, campos do cabeçalho)], um item por trecho.
+        Dias fechados fora do intervalo pedido não entram.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        periodos = months_in_range(start, end)
+        lo, hi = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+        sql = ("SELECT emp_key, primeiro_dia, codigos, funcionario FROM fechamentos"
+               f" WHERE periodo IN ({','.join('?' * len(periodos))})")
+        params: List[Any] = list(periodos)
+        if emp_key is not None:
+            sql += " AND emp_key = ?"
+            params.append(emp_key)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql + " ORDER BY primeiro_dia", params).fetchall()
+        finally:
+            conn.close()
+        out: Dict[str, List[Tuple[Dict[str, dict], Dict[str, Any]]]] = {}
+        for k, d0, codes, emp_json in rows:
+            days = {ds: v for ds, v in decode_schedule_codes(d0, bytes(codes)).items() if lo <= ds <= hi}
+            if days:
+                out.setdefault(k, []).append((days, json.loads(emp_json)))
+        return out
+
+def months_in_range(start: date, end: date) -> List[str]:
+    """Meses (AAAA-MM) tocados pelo intervalo."""
+    out = []
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+def overlay_frozen_days(computed: Dict[str, dict], frozen: List[Tuple[Dict[str, dict], Dict[str, Any]]],
+                        emp: Optional[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Dict[str, dict]]]:
+    """
+    Agenda de impressão: os dias congelados (já recortados ao período pedido)
+    substituem os calculados, dia a dia; o resto do período sai do cálculo.
+    Cada mês sai com um cabeçalho só: o do trecho fechado que cobre mais dias
+    do mês, ou o cadastro atual (emp) se o mês não tem dia fechado.
+    Retorna [(cabeçalho, agenda)], um item por cabeçalho diferente.
+    """
+    merged = dict(computed)
+    votes: Dict[str, Dict[str, int]] = {}
+    for schedule, header in frozen:
+        hdr = json.dumps(header, ensure_ascii=False, sort_keys=True)
+        for ds, entry in schedule.items():
+            merged[ds] = entry
+            month_votes = votes.setdefault(ds[:7], {})
+            month_votes[hdr] = month_votes.get(hdr, 0) + 1
+    own = json.dumps({f: (emp or {}).get(f, "") or "" for f in SNAPSHOT_EMP_FIELDS}, ensure_ascii=False, sort_keys=True)
+    groups: Dict[str, Dict[str, dict]] = {}
+    for ds, entry in merged.items():
+        month_votes = votes.get(ds[:7])
+        hdr = max(month_votes, key=month_votes.get) if month_votes else own
+        groups.setdefault(hdr, {})[ds] = entry
+    return [(json.loads(hdr), schedule) for hdr, schedule in groups.items()]
+
 # ---------------------------
 # PDF GENERATION (A4, MARGENS 10mm, HELVETICA 8pt, GRADE, SALDO TOTAL, RODAPÉ)
 # ---------------------------
+def month_has_workdays(entries: Dict[str, dict]) -> bool:
+    """Mês sem nenhum dia a registrar (só folgas/feriados/antes da admissão) não gera folha."""
+    return any((e.get("type") or "").upper() not in ("ANTES_ADMISSAO", "FERIADO", "FOLGA")
+               for e in entries.values())
+
+def group_schedule_by_month(schedule_map: Dict[str, Any]) -> Dict[Tuple[int, int], Dict[str, dict]]:
+    by_month: Dict[Tuple[int, int], Dict[str, dict]] = {}
+    for ds, entry in schedule_map.items():
+        try:
+            dt = datetime.strptime(ds, "%Y-%m-%d").date()
+        except Exception:
+            continue
+        by_month.setdefault((dt.year, dt.month), {})[ds] = entry
+    return by_month
+
+def draw_timesheet_page(c, header: Dict[str, Any], entries: Dict[str, dict], logo=None):
+    """
+    Desenha a folha de ponto de um mês na página atual do canvas (sem showPage).
+    header: campos do cabeçalho (SNAPSHOT_EMP_FIELDS); entries: AAAA-MM-DD -> entrada do mês.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+
+    nome = header.get("nome", "")
+    cpf = header.get("cpf", "")
+    matricula = header.get("matricula", "")
+    funcao = header.get("funcao", "")
+    posto_global = header.get("posto", "")
+    filial = header.get("filial", "")
+    cnpj = header.get("cnpj", "")
+    endereco = header.get("endereco", "")
+    cidade = header.get("cidade", "")
+    sorted_dates = sorted(entries.keys())
+
+    page_w, page_h = A4
+
+    left = 10 * mm
+    right = page_w - 10 * mm
+    top_margin = page_h - 10 * mm
+    bottom_margin = 10 * mm
+
+    font_main = "Helvetica"
+    font_bold = "Helvetica-Bold"
+    font_size_table = 8
+
+    row_height = 4.2 * mm  # Reduzido de 6.0mm para 4.2mm (-5px aprox.)
+    cell_padding = row_height * 0.35  # Aumentado para 35% da altura para mais espaço vertical
+    text_vertical_shift = -(row_height * 0.5)  # Desloca o conteúdo meia linha para baixo
+
+    # CÓDIGO DE 13 DÍGITOS
+    first_day_dt = datetime.strptime(sorted_dates[0], "%Y-%m-%d").date()
+    mat_5_digits = str(matricula or '0').zfill(5)[:5]
+    first_day_dmy = first_day_dt.strftime("%d%m%Y")
+    codigo_13_digitos = f"{mat_5_digits}{first_day_dmy}"
+
+    # cabeçalho
+    info_x = left
+    if logo:
+        try:
+            logo_target_h = 26.0 * mm * 0.65
+            lw, lh = logo.getSize()
+            scale = logo_target_h / lh
+            logo_target_w = lw * scale
+            logo_y = (top_margin - 2 * mm) - (logo_target_h / 2) - (6.3 * mm) - (3.5 * mm) - (3.5 * mm)  # 10px + 10px = 20px para baixo
+            logo_x = left + (2.1 * mm) + (3.5 * mm)  # 6px + 10px = 16px para direita
+            c.drawImage(logo, logo_x, logo_y, width=logo_target_w, height=logo_target_h, mask='auto')
+            info_x = left + logo_target_w + 12 * mm
+        except Exception:
+            info_x = left
+
+    # 1. EMPRESA/FILIAL (10pt) e CNPJ/ENDEREÇO/CIDADE (7pt)
+    y_empresa = top_margin - 6 * mm
+    c.setFont(font_bold, 10) # 10px para nome da empresa
+    c.drawString(info_x, y_empresa, (filial or "EMPRESA").upper())
+
+    y_cnpj = top_margin - 12 * mm
+    cnpj_txt_prefix = "CNPJ: "
+    c.setFont(font_main, 7) # 7px para CNPJ
+    c.drawString(info_x, y_cnpj, cnpj_txt_prefix + (cnpj or '---').upper())
+    
+    # Endereço e Cidade (7pt) - AJUSTADO: Usa I e J separados por ", "
+    y_end = y_cnpj - 4 * mm 
+    end_prefix = "ENDEREÇO: "
+    
+    # Concatena Endereço e Cidade com vírgula + espaço, se existirem
+    end_city_txt = ""
+    if endereco and cidade:
+        end_city_txt = f"{endereco}, {cidade}".upper()
+    elif endereco:
+        end_city_txt = endereco.upper()
+    elif cidade:
+        end_city_txt = cidade.upper()
+    
+    # Escreve ENDEREÇO: [ENDEREÇO, CIDADE]
+    c.setFont(font_bold, 7)
+    c.drawString(info_x, y_end, end_prefix.upper())
+    end_prefix_w = c.stringWidth(end_prefix, font_bold, 7)
+
+    c.setFont(font_main, 7)
+    # O valor do endereço começa logo após o prefixo negrito
+    c.drawString(info_x + end_prefix_w, y_end, end_city_txt)
+    # FIM AJUSTE ENDEREÇO/CIDADE
+
+    # 2. FUNCIONÁRIO/MATRÍCULA (Negrito no rótulo, normal no valor)
+    y_nome = y_end - 4 * mm # Puxa para baixo 4mm
+    
+    # FUNCIONÁRIO
+    c.setFont(font_bold, 9)
+    nome_prefix = "FUNCIONÁRIO: "
+    c.drawString(info_x, y_nome, nome_prefix.upper())
+    
+    nome_prefix_w = c.stringWidth(nome_prefix, font_bold, 9)
+    c.setFont(font_main, 9)
+    c.drawString(info_x + nome_prefix_w, y_nome, (nome or '').upper())
+    
+    # MATRÍCULA
+    y_mat = y_nome
+    mat_prefix = "MATRÍCULA: "
+    nome_w = c.stringWidth((nome or ''), font_main, 9)
+    mat_x = info_x + nome_prefix_w + nome_w + 8 * mm
+    
+    c.setFont(font_bold, 9)
+    c.drawString(mat_x, y_mat, mat_prefix.upper())
+    
+    mat_prefix_w = c.stringWidth(mat_prefix, font_bold, 9)
+    c.setFont(font_main, 9)
+    c.drawString(mat_x + mat_prefix_w, y_mat, (matricula or '').upper())
+
+    # 3. CPF (8pt)
+    y_cpf = y_nome - 4 * mm
+    c.setFont(font_main, 8)
+    if cpf:
+        c.drawString(info_x, y_cpf, f"CPF: {cpf}".upper())
+
+    # 4. POSTO e FUNÇÃO (8pt - Negrito no rótulo, normal no valor)
+    y_posto = y_cpf - 4 * mm
+    posto_prefix = "POSTO: "
+    
+    c.setFont(font_bold, 8)
+    c.drawString(info_x, y_posto, posto_prefix.upper())
+    
+    posto_prefix_w = c.stringWidth(posto_prefix, font_bold, 8)
+    c.setFont(font_main, 8)
+    c.drawString(info_x + posto_prefix_w, y_posto, (posto_global or '').upper())
+    
+    # FUNÇÃO ao lado do POSTO
+    posto_w = c.stringWidth((posto_global or ''), font_main, 8)
+    funcao_prefix = " - FUNÇÃO: "
+    funcao_x = info_x + posto_prefix_w + posto_w
+    
+    c.setFont(font_bold, 8)
+    c.drawString(funcao_x, y_posto, funcao_prefix.upper())
+    
+    funcao_prefix_w = c.stringWidth(funcao_prefix, font_bold, 8)
+    c.setFont(font_main, 8)
+    c.drawString(funcao_x + funcao_prefix_w, y_posto, (funcao or '').upper())
+    
+    # 5. Título da Tabela (PONTOS REALIZADOS, CÓDIGO, PERÍODO)
+    y_title = y_posto - 5 * mm
+    c.setLineWidth(0.5)
+    c.line(left, y_title, right, y_title)
+    
+    y_line = y_title - 5 * mm
+    
+    # PONTOS REALIZADOS (CENTRO)
+    c.setFont(font_bold, 9)
+    pontos_txt = "PONTOS REALIZADOS"
+    pontos_x = page_w / 2
+    c.drawCentredString(pontos_x, y_line, pontos_txt)
+    
+    # CÓDIGO DE 13 DÍGITOS (ESQUERDA)
+    c.setFont(font_main, 8) # 8px para Código
+    c.drawString(left + 2 * mm, y_line, codigo_13_digitos)
+    
+    # PERÍODO (DIREITA)
+    # Formata a data do período como DD/MM/YYYY
+    start_date_str = first_day_dt.strftime("%d/%m/%Y")
+    end_date_str = datetime.strptime(sorted_dates[-1], "%Y-%m-%d").date().strftime("%d/%m/%Y")
+    periodo_txt = f"PERÍODO: {start_date_str} A {end_date_str}"
+    
+    c.setFont(font_main, 8) # 8px para PERÍODO
+    periodo_w = c.stringWidth(periodo_txt, font_main, 8)
+    c.drawString(right - periodo_w - 2 * mm, y_line, periodo_txt)
+
+    # 6. Início da Tabela
+    y_header = y_line - 5 * mm
+
+    sorted_dates = sorted(entries.keys())
+    # row_height definido acima (6.0 mm)
+
+    # Tabela: DIA | ENTRADA | INT. SAÍDA | INT. RETORNO | SAÍDA | SALDO | OCORRÊNCIA
+    headers = ["DIA", "ENTRADA", "INT. SAÍDA", "INT. RETORNO", "SAÍDA", "SALDO", "OCORRÊNCIA"]
+    table_left = left
+    table_right = right
+    table_width = table_right - table_left
+
+    # Colunas reajustadas
+    col_widths = [
+        25 * mm,  # DIA
+        25 * mm, 25 * mm, 25 * mm, 25 * mm,  # ENTRADA/SAÍDA x4 (100 mm)
+        25 * mm, # SALDO
+        table_width - (25 * mm * 6) # OCORRÊNCIA (190 - 150 = 40mm)
+    ]
+
+    c.setFont(font_bold, font_size_table)
+    x = table_left
+    header_text_y = y_header - (row_height - cell_padding)  # Base do cabeçalho considerando padding
+    for i, h in enumerate(headers):
+        cw = col_widths[i]
+        # Centraliza e aplica deslocamento meia linha para baixo
+        c.drawCentredString(x + cw / 2, header_text_y + (cell_padding/2) + text_vertical_shift, h.upper())
+        x += cw
+
+    c.setFont(font_main, font_size_table)
+    y = header_text_y - (row_height * 0.5)  # Posição inicial das linhas
+
+    # Não há mais cálculo de saldo - todos os horários ficam em branco
+
+    for ds in sorted_dates:
+        entry = entries[ds]
+        dt = datetime.strptime(ds, "%Y-%m-%d").date()
+        day_label = f"{dt.strftime('%d/%m')} - {WEEKDAY_PT_SHORT[dt.weekday()]}"
+        etype = (entry.get("type", "") or "").upper()
+
+        obs_text = ""
+        if etype in ("FOLGA", "FOLGA_DOMINGO_EXTRA") or etype in OCCURRENCE_TYPES:
+            col_vals = ["-", "-", "-", "-"]
+            obs_text = OCCURRENCE_LABELS.get(etype, etype.replace("_DOMINGO_EXTRA", " (EXTRA)"))
+            saldo_display = ""
+            saldo_minutes = 0
+        elif etype in ("ANTES_ADMISSAO"):
+            col_vals = ["-", "-", "-", "-"]
+            obs_text = "PRÉ-ADMISSAO"
+            saldo_display = ""
+            saldo_minutes = 0
+        else:
+            # Deixa todos os horários em branco para preenchimento manual
+            col_vals = ["", "", "", ""]
+            saldo_display = ""
+            saldo_minutes = 0
+            obs_text = (entry.get("name") or entry.get("obs") or "").upper()
+
+        # Calcula posição Y centralizada com o novo padding e deslocamento meia linha para baixo
+        text_y = y - (row_height / 2) + cell_padding + text_vertical_shift
+
+        x = table_left
+        c.drawCentredString(x + col_widths[0] / 2, text_y, day_label.upper()); x += col_widths[0]
+
+        # 4 Colunas de Ponto
+        for i_col in range(4):
+            txt = col_vals[i_col] if i_col < len(col_vals) else ""
+            c.drawCentredString(x + col_widths[i_col + 1] / 2, text_y, (txt or "").upper()); x += col_widths[i_col + 1]
+
+        # Saldo
+        c.drawCentredString(x + col_widths[5] / 2, text_y, (saldo_display or "").upper()); x += col_widths[5]
+
+        # Ocorrência
+        c.drawString(x + 2 * mm, text_y, (obs_text or "").upper()); x += col_widths[6]
+
+        y -= row_height
+
+    # ADICIONA LINHA DE SALDO TOTAL
+    # Fundo cinza claro para toda a linha
+    c.setFillColorRGB(0.9, 0.9, 0.9)
+    c.rect(table_left, y - row_height, table_right - table_left, row_height, fill=1, stroke=0)
+    
+    # Sobrescreve a coluna SALDO com branco
+    x_saldo_inicio = table_left + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] + col_widths[4]
+    c.setFillColorRGB(1, 1, 1)  # Branco
+    c.rect(x_saldo_inicio, y - row_height, col_widths[5], row_height, fill=1, stroke=0)
+    
+    c.setFillColorRGB(0, 0, 0)  # Volta para preto para o texto
+    
+    text_y_saldo_total = y - (row_height / 2) + cell_padding + text_vertical_shift
+    x = table_left
+    
+    # Coluna DATA com texto "SALDO TOTAL:" (em negrito, centralizado)
+    c.setFont(font_bold, font_size_table)
+    c.drawCentredString(x + col_widths[0] / 2, text_y_saldo_total, "SALDO TOTAL:")
+    c.setFont(font_main, font_size_table)  # Volta para fonte normal
+    x += col_widths[0]
+    
+    # 4 Colunas de Ponto vazias
+    for i_col in range(4):
+        x += col_widths[i_col + 1]
+    
+    # Coluna SALDO vazia (branca, para preenchimento manual)
+    x += col_widths[5]
+    
+    # Coluna OCORRÊNCIA vazia
+    x += col_widths[6]
+    
+    y -= row_height
+
+    # grade (sem linha de SALDO MÊS - removida)
+    c.setLineWidth(0.3)
+    top_y = header_text_y + (cell_padding * 1.5)  # Ajustado para novo padding
+    bottom_y = y  # Borda inferior
+    if bottom_y >= top_y:
+        bottom_y = top_y - row_height
+
+    # Desenha as linhas horizontais da grade
+    c.line(table_left, top_y, table_right, top_y) # Linha topo
+    for i in range(int(round((top_y - bottom_y) / float(row_height))) + 1):
+        yy = top_y - i * row_height
+        c.line(table_left, yy, table_right, yy)
+    c.line(table_left, bottom_y, table_right, bottom_y) # Linha baixo (após Saldo)
+
+    # Grade Vertical
+    x = table_left
+    for cw in col_widths:
+        c.line(x, top_y, x, bottom_y)
+        x += cw
+    c.line(x, top_y, x, bottom_y) # Linha final direita
+
+    # RODAPÉ SOLICITADO
+
+    # 1. OBSERVAÇÕES
+    y_obs = y - row_height - 4 * mm
+    c.setFont(font_main, 6)
+    obs_text = "OBSERVAÇÕES PARA USO EXCLUSIVO DO DEPARTAMENTO PESSOAL:"
+    c.drawString(table_left + 2 * mm, y_obs, obs_text.upper())
+    
+    obs_line_y = y_obs - 1 * mm
+    obs_line_height = 6 * mm  # Aumentado de 5mm para 6mm para melhor distribuição
+    num_obs_lines = 3 # Reduzido de 4 para 3 linhas
+    
+    # Desenha as linhas das observações
+    for i in range(num_obs_lines):
+        c.line(table_left, obs_line_y - (i * obs_line_height), table_right, obs_line_y - (i * obs_line_height))
+    
+    # 2. DECLARAÇÃO - Descer 2 linhas
+    y_decl = obs_line_y - (num_obs_lines * obs_line_height) - 2 * mm + (row_height / 2) - (2 * row_height)  # Desce 2 linhas adicionais
+    decl = "DECLARO QUE O HORÁRIO ACIMA REGISTRADO, FOI O ÚNICO POR MIM REALIZADO NO PERÍODO."
+    c.setFont(font_bold, 7)
+    decl_w = c.stringWidth(decl, font_bold, 7)
+    decl_x = (table_left + table_right) / 2 - decl_w / 2
+    c.drawString(decl_x, y_decl, decl.upper())
+
+    # 3. ASSINATURA E DATA (REMOVIDAS AS BARRAS "/")
+    # Espaço de 2 linhas abaixo da declaração antes das informações
+    sign_y = y_decl - (2 * row_height) - 6 * mm
+    
+    # DATA
+    date_line_w = 40 * mm 
+    date_x = table_left + 8 * mm
+    c.line(date_x, sign_y, date_x + date_line_w, sign_y)
+    
+    # Texto DATA (CENTRALIZADO ABAIXO DA LINHA)
+    date_txt = "DATA"
+    c.setFont(font_main, 6)
+    c.drawCentredString(date_x + date_line_w / 2, sign_y - 4 * mm, date_txt)
+
+    # ASSINATURA
+    sig_line_w = 80 * mm
+    sig_x = date_x + date_line_w + 12 * mm 
+    c.line(sig_x, sign_y, sig_x + sig_line_w, sign_y)
+
+    # Texto ASSINATURA DO FUNCIONÁRIO (CENTRALIZADO ABAIXO DA LINHA)
+    sig_txt = "ASSINATURA DO FUNCIONÁRIO"
+    c.drawCentredString(sig_x + sig_line_w / 2, sign_y - 4 * mm, sig_txt)
+    
+    # 4. BORDA AO REDOR DE TODO O PDF
+    # Desenha retângulo conectando as bordas da tabela
+    c.setLineWidth(0.5)
+    # Usa as mesmas coordenadas das margens e da tabela
+    border_rect_x = left
+    border_rect_y = bottom_margin
+    border_rect_w = right - left
+    border_rect_h = top_margin - bottom_margin
+    c.rect(border_rect_x, border_rect_y, border_rect_w, border_rect_h, stroke=1, fill=0)
+
+def render_timesheet_pdf(header: Dict[str, Any], schedule_map: Dict[str, Any], logo=None) -> bytes:
+    """
+    PDF em memória: uma página por mês com dias a registrar (b"" se não houver nenhum).
+    Não toca no disco; quem chama decide se salva, abre ou envia.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    pages = 0
+    for _, entries in sorted(group_schedule_by_month(schedule_map).items()):
+        if not month_has_workdays(entries):
+            continue
+        draw_timesheet_page(c, header, entries, logo)
+        c.showPage()
+        pages += 1
+    if not pages:
+        return b""
+    c.save()
+    return buf.getvalue()
+
+def open_with_default_app(path: str):
+    """Abre o arquivo no visualizador padrão do sistema."""
+    if hasattr(os, "startfile"):
+        os.startfile(path)
+        return
+    import subprocess
+    subprocess.Popen(["open" if sys.platform == "darwin" else "xdg-open", path])
+
 def generate_pdf_for_employee(
     nome: str,
     cpf: str,
@@ -427,29 +2820,14 @@ def generate_pdf_for_employee(
 ) -> Optional[str]:
     safe_mkdir(out_folder)
     logo = load_logo_image(filial)
-
-    # agrupa por mês
-    by_month: Dict[Tuple[int,int], Dict[str,dict]] = {}
-    for ds, entry in schedule_map.items():
-        try:
-            dt = datetime.strptime(ds, "%Y-%m-%d").date()
-        except:
-            continue
-        key = (dt.year, dt.month)
-        by_month.setdefault(key, {})[ds] = entry
+    header = {"nome": nome, "cpf": cpf, "matricula": matricula, "funcao": funcao, "posto": posto_global,
+              "filial": filial, "cnpj": cnpj, "endereco": endereco, "cidade": cidade}
 
     # gera por mês
     saved_paths = []
-    for (yr, mo), entries in sorted(by_month.items()):
+    for (yr, mo), entries in sorted(group_schedule_by_month(schedule_map).items()):
         # se nenhum dia desse mês tem tipo TRABALHADO ou similar, pulamos
-        has_day = False
-        sorted_dates = sorted(entries.keys())
-        for ds, e in entries.items():
-            t = (e.get("type") or "").upper()
-            if t not in ("ANTES_ADMISSAO", "FERIADO", "FOLGA"):
-                has_day = True
-                break
-        if not has_day:
+        if not month_has_workdays(entries):
             # pulamos geração deste mês (sem dias úteis)
             continue
 
@@ -498,353 +2876,294 @@ def generate_pdf_for_employee(
                 print(f"[{now_str()}] AVISO: NÃO FOI POSSÍVEL SOBRESCREVER {path}. Arquivo pode estar aberto.")
                 continue
 
-        c = canvas.Canvas(path, pagesize=A4)
-        page_w, page_h = A4
+        try:
+            data = render_timesheet_pdf(header, entries, logo)
+            with open(path, "wb") as f:
+                f.write(data)
+            saved_paths.append(path)
+        except Exception as e:
+            print(f"[{now_str()}] ERRO AO SALVAR PDF PARA {nome}: {e}\n{traceback.format_exc()}")
 
-        left = 10 * mm
-        right = page_w - 10 * mm
-        top_margin = page_h - 10 * mm
-        bottom_margin = 10 * mm
+    return saved_paths
 
-        font_main = "Helvetica"
-        font_bold = "Helvetica-Bold"
-        font_size_table = 8
+# ---------------------------
+# TABELA VIRTUAL DE FUNCIONÁRIOS
+# ---------------------------
+class VirtualEmployeeTable:
+    """
+    Treeview que só materializa as linhas visíveis.
+    O modelo é a lista 'rows' (chaves, já filtradas/ordenadas); a tela tem
+    um conjunto fixo de itens (row0, row1...) reaproveitados ao rolar.
+    row_fn(chave) -> (texto, valores, revisado) monta cada linha.
+    A seleção fica no modelo (chaves), não nos itens da Treeview:
+    'selected' é a linha atual e 'selection' o conjunto marcado
+    (Ctrl+clique alterna, Shift+clique marca o intervalo, Ctrl+A marca todas).
+    Rolar, filtrar e marcar custam O(linhas visíveis).
+    """
+    HEADER_HEIGHT = 36  # altura aproximada do cabeçalho (fonte 9 + padding 10)
+
+    def __init__(self, parent, columns, row_fn, rowheight: int = 45):
+        self.row_fn = row_fn
+        self.rowheight = rowheight
+        self.rows: List[str] = []
+        self._positions: Optional[Dict[str, int]] = None
+        self.selected: Optional[str] = None
+        self.selection: set = set()
+        self.first = 0
+        self.pool: List[str] = []
+        self.pool_keys: List[Optional[str]] = []
+        # Seleção que a própria tabela aplicou na Treeview no último render;
+        # o <<TreeviewSelect>> disso chega depois (fila de eventos) e é ignorado
+        self._rendered_sel: Tuple[str, ...] = ()
+
+        self.tree = ttk.Treeview(parent, columns=columns, show="tree headings", height=16, selectmode="extended")
+        self.tree.tag_configure('oddrow', background='#f8f9fa')
+        self.tree.tag_configure('evenrow', background='#ffffff')
+        # Uma tag só para todas as linhas revisadas
+        self.tree.tag_configure('revisado', background="#27ae60", foreground="white")
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self.yview)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Up>", lambda e: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self._move_selection(1))
+        self.tree.bind("<Prior>", lambda e: self._move_selection(-self.visible_count()))
+        self.tree.bind("<Next>", lambda e: self._move_selection(self.visible_count()))
+        # Seleção múltipla tratada no modelo (a da Treeview só conhece as linhas visíveis)
+        self.tree.bind("<Control-Button-1>", self._on_ctrl_click)
+        self.tree.bind("<Shift-Button-1>", self._on_shift_click)
+        self.tree.bind("<Control-a>", lambda e: self.select_all())
+
+    # --- modelo ---
+    def set_rows(self, keys: List[str]):
+        self.rows = keys
+        self._positions = None
+        self.first = max(0, min(self.first, len(keys) - self.visible_count()))
+        self.render()
+
+    def position(self, key: str) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {k: i for i, k in enumerate(self.rows)}
+        return self._positions.get(key)
+
+    def key_at(self, y: int) -> Optional[str]:
+        iid = self.tree.identify_row(y)
+        if not iid or iid not in self.pool:
+            return None
+        return self.pool_keys[self.pool.index(iid)]
+
+    def selected_key(self) -> Optional[str]:
+        return self.selected
+
+    def selected_keys(self) -> List[str]:
+        """Chaves marcadas que estão no filtro atual, na ordem da tabela."""
+        marked = [(self.position(k), k) for k in self.selection]
+        return [k for pos, k in sorted((p, k) for p, k in marked if p is not None)]
+
+    def select_all(self):
+        self.selection = set(self.rows)
+        self.render()
+        return "break"
+
+    def refresh_keys(self, keys):
+        """Redesenha só as linhas dessas chaves que estão na tela."""
+        wanted = set(keys)
+        for i, key in enumerate(self.pool_keys):
+            if key in wanted:
+                self._fill(i, self.first + i)
+
+    # --- janela visível ---
+    def visible_count(self) -> int:
+        return max(1, len(self.pool))
+
+    def _on_resize(self, event):
+        n = max(1, (event.height - self.HEADER_HEIGHT) // self.rowheight)
+        if n == len(self.pool):
+            return
+        while len(self.pool) < n:
+            self.pool.append(self.tree.insert("", "end", iid=f"row{len(self.pool)}"))
+            self.pool_keys.append(None)
+        while len(self.pool) > n:
+            self.tree.delete(self.pool.pop())
+            self.pool_keys.pop()
+        self.first = max(0, min(self.first, len(self.rows) - n))
+        self.render()
+
+    def _fill(self, slot: int, row: int):
+        iid = self.pool[slot]
+        if row >= len(self.rows):
+            self.pool_keys[slot] = None
+            self.tree.item(iid, text="", values=(), tags=())
+            return
+        key = self.rows[row]
+        text, values, revisado = self.row_fn(key)
+        tag = 'revisado' if revisado else ('evenrow' if row % 2 == 0 else 'oddrow')
+        self.pool_keys[slot] = key
+        self.tree.item(iid, text=text, values=values, tags=(tag,))
+
+    def render(self):
+        for slot in range(len(self.pool)):
+            self._fill(slot, self.first + slot)
+        sel = tuple(self.pool[i] for i, k in enumerate(self.pool_keys) if k is not None and k in self.selection)
+        self._rendered_sel = sel
+        self.tree.selection_set(sel)
+        total = len(self.rows)
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + len(self.pool)) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
 
-        row_height = 4.2 * mm  # Reduzido de 6.0mm para 4.2mm (-5px aprox.)
-        cell_padding = row_height * 0.35  # Aumentado para 35% da altura para mais espaço vertical
-        text_vertical_shift = -(row_height * 0.5)  # Desloca o conteúdo meia linha para baixo
+    def scroll(self, delta: int):
+        top = max(0, min(self.first + delta, len(self.rows) - self.visible_count()))
+        if top != self.first:
+            self.first = top
+            self.render()
+        return "break"
 
-        # CÓDIGO DE 13 DÍGITOS
-        first_day_dt = datetime.strptime(sorted_dates[0], "%Y-%m-%d").date()
-        mat_5_digits = str(matricula or '0').zfill(5)[:5]
-        first_day_dmy = first_day_dt.strftime("%d%m%Y")
-        codigo_13_digitos = f"{mat_5_digits}{first_day_dmy}"
+    def yview(self, *args):
+        if not args:
+            return
+        if args[0] == "moveto":
+            self.first = 0
+            self.scroll(int(float(args[1]) * len(self.rows)))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.visible_count() if args[2] == "pages" else 1)
+            self.scroll(step)
+
+    def see(self, row: int):
+        if row < self.first:
+            self.scroll(row - self.first)
+        elif row >= self.first + self.visible_count():
+            self.scroll(row - self.first - self.visible_count() + 1)
+
+    def _on_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_select(self, event=None):
+        sel = self.tree.selection()
+        if sel == self._rendered_sel:
+            return
+        if sel and sel[0] in self.pool:
+            key = self.pool_keys[self.pool.index(sel[0])]
+            if key is not None:
+                self.selected = key
+                self.selection = {key}
+
+    def _on_ctrl_click(self, event):
+        key = self.key_at(event.y)
+        if key is not None:
+            self.selection.symmetric_difference_update((key,))
+            self.selected = key
+            self.render()
+        return "break"
+
+    def _on_shift_click(self, event):
+        key = self.key_at(event.y)
+        if key is None:
+            return "break"
+        anchor = self.position(self.selected) if self.selected is not None else None
+        row = self.position(key)
+        if anchor is None:
+            anchor = row
+        a, b = sorted((anchor, row))
+        self.selection = set(self.rows[a:b + 1])
+        self.render()
+        return "break"
+
+    def _move_selection(self, delta: int):
+        if not self.rows:
+            return "break"
+        pos = self.position(self.selected) if self.selected is not None else None
+        row = 0 if pos is None else max(0, min(pos + delta, len(self.rows) - 1))
+        self.selected = self.rows[row]
+        self.selection = {self.selected}
+        self.see(row)
+        self.render()
+        return "break"
 
-        # cabeçalho
-        info_x = left
-        if logo:
+# ---------------------------
+# CARGA INCREMENTAL DE LISTAS (TK)
+# ---------------------------
+class IncrementalLoader:
+    """
+    Preenche uma lista do Tk (Listbox/Treeview) em fatias de tempo via after(),
+    para a janela abrir na hora mesmo com milhares de linhas.
+    - insert(row): insere uma linha no widget
+    - counter/loading_text: rótulo que mostra o progresso ({done} e {total})
+    - on_done(): chamado quando a última linha entra
+    Fechar a janela cancela a carga; uma nova load() substitui a anterior.
+    """
+    SLICE_SECONDS = 0.015  # tempo máximo de inserção por fatia (a tela continua respondendo)
+    CHECK_EVERY = 64       # linhas entre consultas ao relógio
+
+    def __init__(self, widget, insert, counter: Optional[Label] = None,
+                 loading_text: str = "CARREGANDO {done} DE {total}...", on_done=None):
+        self.widget = widget
+        self.insert = insert
+        self.counter = counter
+        self.loading_text = loading_text
+        self.on_done = on_done
+        self.rows: List[Any] = []
+        self.done = 0
+        self._after: Optional[str] = None
+        widget.bind("<Destroy>", self._on_destroy, add="+")
+
+    @property
+    def running(self) -> bool:
+        return self._after is not None
+
+    def load(self, rows):
+        self.cancel()
+        self.rows = list(rows)
+        self.done = 0
+        self._step()
+
+    def cancel(self):
+        if self._after is not None:
             try:
-                logo_target_h = 26.0 * mm * 0.65
-                lw, lh = logo.getSize()
-                scale = logo_target_h / lh
-                logo_target_w = lw * scale
-                logo_y = (top_margin - 2 * mm) - (logo_target_h / 2) - (6.3 * mm) - (3.5 * mm) - (3.5 * mm)  # 10px + 10px = 20px para baixo
-                logo_x = left + (2.1 * mm) + (3.5 * mm)  # 6px + 10px = 16px para direita
-                c.drawImage(logo, logo_x, logo_y, width=logo_target_w, height=logo_target_h, mask='auto')
-                info_x = left + logo_target_w + 12 * mm
+                self.widget.after_cancel(self._after)
             except Exception:
-                info_x = left
-
-        # 1. EMPRESA/FILIAL (10pt) e CNPJ/ENDEREÇO/CIDADE (7pt)
-        y_empresa = top_margin - 6 * mm
-        c.setFont(font_bold, 10) # 10px para nome da empresa
-        c.drawString(info_x, y_empresa, (filial or "EMPRESA").upper())
-
-        y_cnpj = top_margin - 12 * mm
-        cnpj_txt_prefix = "CNPJ: "
-        c.setFont(font_main, 7) # 7px para CNPJ
-        c.drawString(info_x, y_cnpj, cnpj_txt_prefix + (cnpj or '---').upper())
-        
-        # Endereço e Cidade (7pt) - AJUSTADO: Usa I e J separados por ", "
-        y_end = y_cnpj - 4 * mm 
-        end_prefix = "ENDEREÇO: "
-        
-        # Concatena Endereço e Cidade com vírgula + espaço, se existirem
-        end_city_txt = ""
-        if endereco and cidade:
-            end_city_txt = f"{endereco}, {cidade}".upper()
-        elif endereco:
-            end_city_txt = endereco.upper()
-        elif cidade:
-            end_city_txt = cidade.upper()
-        
-        # Escreve ENDEREÇO: [ENDEREÇO, CIDADE]
-        c.setFont(font_bold, 7)
-        c.drawString(info_x, y_end, end_prefix.upper())
-        end_prefix_w = c.stringWidth(end_prefix, font_bold, 7)
-
-        c.setFont(font_main, 7)
-        # O valor do endereço começa logo após o prefixo negrito
-        c.drawString(info_x + end_prefix_w, y_end, end_city_txt)
-        # FIM AJUSTE ENDEREÇO/CIDADE
-
-        # 2. FUNCIONÁRIO/MATRÍCULA (Negrito no rótulo, normal no valor)
-        y_nome = y_end - 4 * mm # Puxa para baixo 4mm
-        
-        # FUNCIONÁRIO
-        c.setFont(font_bold, 9)
-        nome_prefix = "FUNCIONÁRIO: "
-        c.drawString(info_x, y_nome, nome_prefix.upper())
-        
-        nome_prefix_w = c.stringWidth(nome_prefix, font_bold, 9)
-        c.setFont(font_main, 9)
-        c.drawString(info_x + nome_prefix_w, y_nome, (nome or '').upper())
-        
-        # MATRÍCULA
-        y_mat = y_nome
-        mat_prefix = "MATRÍCULA: "
-        nome_w = c.stringWidth((nome or ''), font_main, 9)
-        mat_x = info_x + nome_prefix_w + nome_w + 8 * mm
-        
-        c.setFont(font_bold, 9)
-        c.drawString(mat_x, y_mat, mat_prefix.upper())
-        
-        mat_prefix_w = c.stringWidth(mat_prefix, font_bold, 9)
-        c.setFont(font_main, 9)
-        c.drawString(mat_x + mat_prefix_w, y_mat, (matricula or '').upper())
-
-        # 3. CPF (8pt)
-        y_cpf = y_nome - 4 * mm
-        c.setFont(font_main, 8)
-        if cpf:
-            c.drawString(info_x, y_cpf, f"CPF: {cpf}".upper())
-
-        # 4. POSTO e FUNÇÃO (8pt - Negrito no rótulo, normal no valor)
-        y_posto = y_cpf - 4 * mm
-        posto_prefix = "POSTO: "
-        
-        c.setFont(font_bold, 8)
-        c.drawString(info_x, y_posto, posto_prefix.upper())
-        
-        posto_prefix_w = c.stringWidth(posto_prefix, font_bold, 8)
-        c.setFont(font_main, 8)
-        c.drawString(info_x + posto_prefix_w, y_posto, (posto_global or '').upper())
-        
-        # FUNÇÃO ao lado do POSTO
-        posto_w = c.stringWidth((posto_global or ''), font_main, 8)
-        funcao_prefix = " - FUNÇÃO: "
-        funcao_x = info_x + posto_prefix_w + posto_w
-        
-        c.setFont(font_bold, 8)
-        c.drawString(funcao_x, y_posto, funcao_prefix.upper())
-        
-        funcao_prefix_w = c.stringWidth(funcao_prefix, font_bold, 8)
-        c.setFont(font_main, 8)
-        c.drawString(funcao_x + funcao_prefix_w, y_posto, (funcao or '').upper())
-        
-        # 5. Título da Tabela (PONTOS REALIZADOS, CÓDIGO, PERÍODO)
-        y_title = y_posto - 5 * mm
-        c.setLineWidth(0.5)
-        c.line(left, y_title, right, y_title)
-        
-        y_line = y_title - 5 * mm
-        
-        # PONTOS REALIZADOS (CENTRO)
-        c.setFont(font_bold, 9)
-        pontos_txt = "PONTOS REALIZADOS"
-        pontos_x = page_w / 2
-        c.drawCentredString(pontos_x, y_line, pontos_txt)
-        
-        # CÓDIGO DE 13 DÍGITOS (ESQUERDA)
-        c.setFont(font_main, 8) # 8px para Código
-        c.drawString(left + 2 * mm, y_line, codigo_13_digitos)
-        
-        # PERÍODO (DIREITA)
-        # Formata a data do período como DD/MM/YYYY
-        start_date_str = first_day_dt.strftime("%d/%m/%Y")
-        end_date_str = datetime.strptime(sorted_dates[-1], "%Y-%m-%d").date().strftime("%d/%m/%Y")
-        periodo_txt = f"PERÍODO: {start_date_str} A {end_date_str}"
-        
-        c.setFont(font_main, 8) # 8px para PERÍODO
-        periodo_w = c.stringWidth(periodo_txt, font_main, 8)
-        c.drawString(right - periodo_w - 2 * mm, y_line, periodo_txt)
-
-        # 6. Início da Tabela
-        y_header = y_line - 5 * mm
-
-        sorted_dates = sorted(entries.keys())
-        # row_height definido acima (6.0 mm)
-
-        # Tabela: DIA | ENTRADA | INT. SAÍDA | INT. RETORNO | SAÍDA | SALDO | OCORRÊNCIA
-        headers = ["DIA", "ENTRADA", "INT. SAÍDA", "INT. RETORNO", "SAÍDA", "SALDO", "OCORRÊNCIA"]
-        table_left = left
-        table_right = right
-        table_width = table_right - table_left
-
-        # Colunas reajustadas
-        col_widths = [
-            25 * mm,  # DIA
-            25 * mm, 25 * mm, 25 * mm, 25 * mm,  # ENTRADA/SAÍDA x4 (100 mm)
-            25 * mm, # SALDO
-            table_width - (25 * mm * 6) # OCORRÊNCIA (190 - 150 = 40mm)
-        ]
-
-        c.setFont(font_bold, font_size_table)
-        x = table_left
-        header_text_y = y_header - (row_height - cell_padding)  # Base do cabeçalho considerando padding
-        for i, h in enumerate(headers):
-            cw = col_widths[i]
-            # Centraliza e aplica deslocamento meia linha para baixo
-            c.drawCentredString(x + cw / 2, header_text_y + (cell_padding/2) + text_vertical_shift, h.upper())
-            x += cw
-
-        c.setFont(font_main, font_size_table)
-        y = header_text_y - (row_height * 0.5)  # Posição inicial das linhas
-
-        # Não há mais cálculo de saldo - todos os horários ficam em branco
-
-        for ds in sorted_dates:
-            entry = entries[ds]
-            dt = datetime.strptime(ds, "%Y-%m-%d").date()
-            day_label = f"{dt.strftime('%d/%m')} - {WEEKDAY_PT_SHORT[dt.weekday()]}"
-            etype = (entry.get("type", "") or "").upper()
-
-            obs_text = ""
-            if etype in ("FOLGA", "FOLGA_DOMINGO_EXTRA", "FERIADO"):
-                col_vals = ["-", "-", "-", "-"]
-                obs_text = etype.replace("_DOMINGO_EXTRA", " (EXTRA)")
-                saldo_display = ""
-                saldo_minutes = 0
-            elif etype in ("ANTES_ADMISSAO"):
-                col_vals = ["-", "-", "-", "-"]
-                obs_text = "PRÉ-ADMISSAO"
-                saldo_display = ""
-                saldo_minutes = 0
-            else:
-                # Deixa todos os horários em branco para preenchimento manual
-                col_vals = ["", "", "", ""]
-                saldo_display = ""
-                saldo_minutes = 0
-                obs_text = (entry.get("name") or entry.get("obs") or "").upper()
-
-            # Calcula posição Y centralizada com o novo padding e deslocamento meia linha para baixo
-            text_y = y - (row_height / 2) + cell_padding + text_vertical_shift
-
-            x = table_left
-            c.drawCentredString(x + col_widths[0] / 2, text_y, day_label.upper()); x += col_widths[0]
-
-            # 4 Colunas de Ponto
-            for i_col in range(4):
-                txt = col_vals[i_col] if i_col < len(col_vals) else ""
-                c.drawCentredString(x + col_widths[i_col + 1] / 2, text_y, (txt or "").upper()); x += col_widths[i_col + 1]
-
-            # Saldo
-            c.drawCentredString(x + col_widths[5] / 2, text_y, (saldo_display or "").upper()); x += col_widths[5]
-
-            # Ocorrência
-            c.drawString(x + 2 * mm, text_y, (obs_text or "").upper()); x += col_widths[6]
-
-            y -= row_height
-
-        # ADICIONA LINHA DE SALDO TOTAL
-        # Fundo cinza claro para toda a linha
-        c.setFillColorRGB(0.9, 0.9, 0.9)
-        c.rect(table_left, y - row_height, table_right - table_left, row_height, fill=1, stroke=0)
-        
-        # Sobrescreve a coluna SALDO com branco
-        x_saldo_inicio = table_left + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] + col_widths[4]
-        c.setFillColorRGB(1, 1, 1)  # Branco
-        c.rect(x_saldo_inicio, y - row_height, col_widths[5], row_height, fill=1, stroke=0)
-        
-        c.setFillColorRGB(0, 0, 0)  # Volta para preto para o texto
-        
-        text_y_saldo_total = y - (row_height / 2) + cell_padding + text_vertical_shift
-        x = table_left
-        
-        # Coluna DATA com texto "SALDO TOTAL:" (em negrito, centralizado)
-        c.setFont(font_bold, font_size_table)
-        c.drawCentredString(x + col_widths[0] / 2, text_y_saldo_total, "SALDO TOTAL:")
-        c.setFont(font_main, font_size_table)  # Volta para fonte normal
-        x += col_widths[0]
-        
-        # 4 Colunas de Ponto vazias
-        for i_col in range(4):
-            x += col_widths[i_col + 1]
-        
-        # Coluna SALDO vazia (branca, para preenchimento manual)
-        x += col_widths[5]
-        
-        # Coluna OCORRÊNCIA vazia
-        x += col_widths[6]
-        
-        y -= row_height
-
-        # grade (sem linha de SALDO MÊS - removida)
-        c.setLineWidth(0.3)
-        top_y = header_text_y + (cell_padding * 1.5)  # Ajustado para novo padding
-        bottom_y = y  # Borda inferior
-        if bottom_y >= top_y:
-            bottom_y = top_y - row_height
-
-        # Desenha as linhas horizontais da grade
-        c.line(table_left, top_y, table_right, top_y) # Linha topo
-        for i in range(int(round((top_y - bottom_y) / float(row_height))) + 1):
-            yy = top_y - i * row_height
-            c.line(table_left, yy, table_right, yy)
-        c.line(table_left, bottom_y, table_right, bottom_y) # Linha baixo (após Saldo)
-
-        # Grade Vertical
-        x = table_left
-        for cw in col_widths:
-            c.line(x, top_y, x, bottom_y)
-            x += cw
-        c.line(x, top_y, x, bottom_y) # Linha final direita
-
-        # RODAPÉ SOLICITADO
-
-        # 1. OBSERVAÇÕES
-        y_obs = y - row_height - 4 * mm
-        c.setFont(font_main, 6)
-        obs_text = "OBSERVAÇÕES PARA USO EXCLUSIVO DO DEPARTAMENTO PESSOAL:"
-        c.drawString(table_left + 2 * mm, y_obs, obs_text.upper())
-        
-        obs_line_y = y_obs - 1 * mm
-        obs_line_height = 6 * mm  # Aumentado de 5mm para 6mm para melhor distribuição
-        num_obs_lines = 3 # Reduzido de 4 para 3 linhas
-        
-        # Desenha as linhas das observações
-        for i in range(num_obs_lines):
-            c.line(table_left, obs_line_y - (i * obs_line_height), table_right, obs_line_y - (i * obs_line_height))
-        
-        # 2. DECLARAÇÃO - Descer 2 linhas
-        y_decl = obs_line_y - (num_obs_lines * obs_line_height) - 2 * mm + (row_height / 2) - (2 * row_height)  # Desce 2 linhas adicionais
-        decl = "DECLARO QUE O HORÁRIO ACIMA REGISTRADO, FOI O ÚNICO POR MIM REALIZADO NO PERÍODO."
-        c.setFont(font_bold, 7)
-        decl_w = c.stringWidth(decl, font_bold, 7)
-        decl_x = (table_left + table_right) / 2 - decl_w / 2
-        c.drawString(decl_x, y_decl, decl.upper())
-
-        # 3. ASSINATURA E DATA (REMOVIDAS AS BARRAS "/")
-        # Espaço de 2 linhas abaixo da declaração antes das informações
-        sign_y = y_decl - (2 * row_height) - 6 * mm
-        
-        # DATA
-        date_line_w = 40 * mm 
-        date_x = table_left + 8 * mm
-        c.line(date_x, sign_y, date_x + date_line_w, sign_y)
-        
-        # Texto DATA (CENTRALIZADO ABAIXO DA LINHA)
-        date_txt = "DATA"
-        c.setFont(font_main, 6)
-        c.drawCentredString(date_x + date_line_w / 2, sign_y - 4 * mm, date_txt)
-
-        # ASSINATURA
-        sig_line_w = 80 * mm
-        sig_x = date_x + date_line_w + 12 * mm 
-        c.line(sig_x, sign_y, sig_x + sig_line_w, sign_y)
-
-        # Texto ASSINATURA DO FUNCIONÁRIO (CENTRALIZADO ABAIXO DA LINHA)
-        sig_txt = "ASSINATURA DO FUNCIONÁRIO"
-        c.drawCentredString(sig_x + sig_line_w / 2, sign_y - 4 * mm, sig_txt)
-        
-        # 4. BORDA AO REDOR DE TODO O PDF
-        # Desenha retângulo conectando as bordas da tabela
-        c.setLineWidth(0.5)
-        # Usa as mesmas coordenadas das margens e da tabela
-        border_rect_x = left
-        border_rect_y = bottom_margin
-        border_rect_w = right - left
-        border_rect_h = top_margin - bottom_margin
-        c.rect(border_rect_x, border_rect_y, border_rect_w, border_rect_h, stroke=1, fill=0)
+                pass
+            self._after = None
 
-        try:
-            c.showPage()
-            c.save()
-            saved_paths.append(path)
-        except Exception as e:
-            print(f"[{now_str()}] ERRO AO SALVAR PDF PARA {nome}: {e}\n{traceback.format_exc()}")
+    def finish(self):
+        """Insere já o que falta (antes de ler o conteúdo da lista, p.ex. ao salvar)."""
+        if self._after is None:
+            return
+        self.cancel()
+        self._insert_until(None)
+
+    def _on_destroy(self, event):
+        if event.widget is self.widget:
+            self.cancel()
+
+    def _insert_until(self, deadline: Optional[float]):
+        rows, insert, total = self.rows, self.insert, len(self.rows)
+        while self.done < total:
+            stop = min(total, self.done + self.CHECK_EVERY)
+            for i in range(self.done, stop):
+                insert(rows[i])
+            self.done = stop
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        if self.done < total:
+            if self.counter is not None:
+                self.counter.config(text=self.loading_text.format(done=self.done, total=total))
+            return
+        self.rows = []
+        if self.on_done:
+            self.on_done()
 
-    return saved_paths
+    def _step(self):
+        self._after = None
+        if not self.widget.winfo_exists():
+            return
+        self._insert_until(time.perf_counter() + self.SLICE_SECONDS)
+        if self.rows:
+            self._after = self.widget.after(1, self._step)
 
 # ---------------------------
 # APLICAÇÃO GUI (JANELA PRINCIPAL)
@@ -854,36 +3173,141 @@ class PontoApp:
     def __init__(self, root: Tk):
         self.root = root
         self.root.title("GERADOR DE FOLHA DE PONTO - SALDO TOTAL:")
-        self.store = load_store()
-
-        # dados
-        self.funcionarios: List[Dict[str, Any]] = self.store.get("funcionarios", [])
-        self.global_holidays: Dict[str, str] = self.store.get("global_holidays", {})
+        try:
+            self.store = load_store()
+        except StoreReadError as e:
+            # Começar com store vazio e salvar depois apagaria os dados do arquivo
+            messagebox.showerror("ERRO", f"{e}\n\nO PROGRAMA SERÁ FECHADO PARA NÃO SOBRESCREVER O ARQUIVO DE DADOS. "
+                                          "FECHE-O EM OUTROS PROGRAMAS (OU RESTAURE UM BACKUP) E ABRA NOVAMENTE.")
+            root.destroy()
+            raise SystemExit(1)
+
+        # dados (os dicionários são os próprios objetos do store: merges com outras
+        # estações atualizam estes atributos no lugar)
+        self.funcionarios: List[Dict[str, Any]] = self.store.setdefault("funcionarios", [])
+        self.global_holidays: Dict[str, str] = self.store.setdefault("global_holidays", {})
         # Tipo de feriado: "NACIONAL" ou "LOCAL" - Dict[data_str, tipo]
-        self.holiday_type: Dict[str, str] = self.store.get("holiday_type", {})
+        self.holiday_type: Dict[str, str] = self.store.setdefault("holiday_type", {})
         # Postos que tem direito a cada feriado local - Dict[data_str, List[posto]]
-        self.holiday_postos: Dict[str, List[str]] = self.store.get("holiday_postos", {})
-        self.emp_personal_hols: Dict[str, List[str]] = self.store.get("emp_personal_hols", {})
-        self.emp_scale_choice: Dict[str, str] = self.store.get("emp_scale_choice", {})
-        self.emp_first_off: Dict[str, str] = self.store.get("emp_first_off", {})
-        self.emp_faltas_atestados: Dict[str, dict] = self.store.get("emp_faltas_atestados", {})
-        self.emp_trabalha_feriado: Dict[str, bool] = self.store.get("emp_trabalha_feriado", {})
+        self.holiday_postos: Dict[str, List[str]] = self.store.setdefault("holiday_postos", {})
+        self.emp_personal_hols: Dict[str, List[str]] = self.store.setdefault("emp_personal_hols", {})
+        self.emp_scale_choice: Dict[str, str] = self.store.setdefault("emp_scale_choice", {})
+        self.emp_first_off: Dict[str, str] = self.store.setdefault("emp_first_off", {})
+        self.emp_faltas_atestados: Dict[str, dict] = self.store.setdefault("emp_faltas_atestados", {})
+        self.emp_trabalha_feriado: Dict[str, bool] = self.store.setdefault("emp_trabalha_feriado", {})
         # Estado de ordenação por coluna da tabela principal (True = descendente)
         self._emp_sort_dir: Dict[str, bool] = {}
+        # Ordenação ativa (coluna, descendente), reaplicada a cada filtro
+        self._emp_sort: Optional[Tuple[str, bool]] = None
+        # Chaves de ordenação por coluna: coluna -> {chave do funcionário: tupla}
+        self._emp_sort_keys: Dict[str, Dict[str, tuple]] = {}
         # Estado de revisão por funcionário (True = revisado, mostra "OK" verde)
-        self.emp_revisado: Dict[str, bool] = self.store.get("emp_revisado", {})
+        self.emp_revisado: Dict[str, bool] = self.store.setdefault("emp_revisado", {})
+        # Quantos do quadro estão revisados; recontado só quando o quadro muda
+        self._revisados_count: Optional[int] = None
         # Sistema de cidades: Dict[cidade_nome, List[postos]]
-        self.cidades: Dict[str, List[str]] = self.store.get("cidades", {})
+        self.cidades: Dict[str, List[str]] = self.store.setdefault("cidades", {})
         # Cidades vinculadas aos feriados locais: Dict[data_str, cidade_nome]
-        self.holiday_cidades: Dict[str, str] = self.store.get("holiday_cidades", {})
+        self.holiday_cidades: Dict[str, str] = self.store.setdefault("holiday_cidades", {})
         # Registro histórico de todos os postos já vistos (mantém mesmo após trocar planilha)
         self.all_postos_historico: set = set(self.store.get("all_postos_historico", []))
 
+        # Índice por chave estável (matrícula/CPF); estado por funcionário usa essa chave
+        for emp in self.funcionarios:
+            coerce_employee_record(emp)
+        self.emp_index = EmployeeIndex(self.funcionarios)
+        # Índice da busca: montado na primeira consulta e refeito quando o quadro muda
+        self._search_index: Optional[EmployeeSearchIndex] = None
+        self._search_after: Optional[str] = None
+        # Agendas calculadas (prévia, PDFs, fechamento) e estado da prévia na tela
+        self._schedule_cache = ScheduleCache()
+        self._preview_key: Optional[str] = None
+        self._preview_overrides: Dict[str, Any] = {}
+        self._preview_page = 0
+        self._preview_after: Optional[str] = None
+        if self.store.get("store_schema", 1) < STORE_SCHEMA_VERSION:
+            self._migrate_employee_state()
+        set_store_merge_listener(self._on_store_merged)
+
         self._build_top_frame()
         self._build_mid_frame()
         self._build_bottom_frame()
         self.update_employee_tree()
 
+    def _migrate_employee_state(self):
+        """Converte o estado indexado por nome (store antigo) para a chave estável e persiste."""
+        for section in EMP_STATE_SECTIONS:
+            self.store[section] = getattr(self, section)
+        moved = migrate_employee_state(self.store, self.emp_index)
+        self.store["funcionarios"] = self.funcionarios
+        self._save_store()
+        if moved:
+            print(f"[{now_str()}] STORE MIGRADO: {moved} ENTRADAS CONVERTIDAS PARA CHAVE ESTÁVEL")
+
+    def _save_store(self, parent=None) -> bool:
+        """
+        save_store com aviso: se nada foi gravado (lock de outra estação, arquivo
+        ilegível, disco), mostra o motivo e oferece tentar de novo.
+        Retorna False se o operador desistir; o chamador não deve dizer "SALVO".
+        """
+        while not save_store(self.store):
+            if not messagebox.askretrycancel(
+                    "ERRO AO SALVAR",
+                    f"AS ALTERAÇÕES NÃO FORAM GRAVADAS EM {DATA_STORE}:\n{store_last_error()}\n\n"
+                    "TENTAR DE NOVO? (CANCELAR MANTÉM AS ALTERAÇÕES SÓ NESTA TELA, SEM GRAVAR)",
+                    parent=parent or self.root):
+                return False
+        return True
+
+    def _on_store_merged(self, store: dict, conflicts: List[Tuple[str, ...]]):
+        """Outra estação gravou o store: sincroniza o que não é dicionário e avisa conflitos."""
+        for attr in ("global_holidays", "holiday_type", "holiday_postos", "cidades", "holiday_cidades") + EMP_STATE_SECTIONS:
+            setattr(self, attr, store.setdefault(attr, {}))
+        self.all_postos_historico = set(store.get("all_postos_historico", []))
+        self._revisados_count = None  # emp_revisado pode ter vindo da outra estação
+        if store.get("funcionarios") is self.funcionarios:
+            for emp in self.funcionarios:
+                coerce_employee_record(emp)
+            self.emp_index.rebuild(self.funcionarios)
+            self._roster_changed()
+        self.update_employee_tree()
+        if conflicts:
+            linhas = "\n".join(" / ".join(str(p) for p in c) for c in conflicts[:15])
+            if len(conflicts) > 15:
+                linhas += f"\n... E MAIS {len(conflicts) - 15}"
+            messagebox.showwarning(
+                "ALTERAÇÕES SIMULTÂNEAS",
+                "OUTRA ESTAÇÃO ALTEROU OS MESMOS DADOS AO MESMO TEMPO.\n"
+                "FOI MANTIDA A VERSÃO DESTA ESTAÇÃO PARA:\n\n" + linhas
+            )
+
+    def _set_roster(self, funcionarios: List[Dict[str, Any]]):
+        """Troca o quadro de funcionários e reconstrói o índice por chave."""
+        self.funcionarios = funcionarios
+        self.emp_index.rebuild(self.funcionarios)
+        self._roster_changed()
+        # Estado antigo por nome que agora encontrou dono é migrado
+        for section in EMP_STATE_SECTIONS:
+            self.store[section] = getattr(self, section)
+        migrate_employee_state(self.store, self.emp_index)
+
+    def _roster_changed(self):
+        """O quadro mudou: índices derivados (busca e ordenação) são refeitos sob demanda."""
+        self._search_index = None
+        self._emp_sort_keys.clear()
+        self._revisados_count = None
+
+    def _compact_store(self) -> Dict[str, int]:
+        """Recupera do arquivo morto quem voltou ao quadro e arquiva os órfãos."""
+        for section in EMP_STATE_SECTIONS:
+            self.store[section] = getattr(self, section)
+        restore_archived_state(self.store, self.emp_index.by_key)
+        return compact_store(self.store, self.emp_index.by_key)
+
+    def _emp_label(self, key: str) -> str:
+        emp = self.emp_index.get(key)
+        return (emp or {}).get("nome", "") or key
+
     def _is_cpf_format(self, text: str) -> bool:
         """Verifica se o texto parece ser um CPF (contém principalmente números, pontos e traços)."""
         if not text:
@@ -1044,21 +3468,24 @@ class PontoApp:
         Button(top, text="💾 SALVAR", command=self.save_config, 
                bg="#27ae60", **btn_style).grid(row=0, column=6, sticky="ew", padx=4, pady=4)
         
+        Button(top, text="🧰 FERRAMENTAS", command=self.show_tools_menu, 
+               bg="#7f8c8d", **btn_style).grid(row=0, column=7, sticky="ew", padx=4, pady=4)
+        
         # Botão destaque para gerar PDFs
         Button(top, text="📄 GERAR PDFs", command=self.generate_all_pdfs, 
                bg="#e74c3c", fg="white", font=("Segoe UI", 10, "bold"),
                relief="flat", bd=0, cursor="hand2", padx=18, pady=12
-              ).grid(row=0, column=7, sticky="ew", padx=4, pady=4)
+              ).grid(row=0, column=8, sticky="ew", padx=4, pady=4)
 
         # Barra de pesquisa moderna
         search_frame = Frame(top, bg="white", relief="groove", bd=2)
-        search_frame.grid(row=1, column=0, columnspan=8, sticky="ew", pady=(8, 0))
+        search_frame.grid(row=1, column=0, columnspan=9, sticky="ew", pady=(8, 0))
         
         Label(search_frame, text="🔍", font=("Segoe UI", 13), bg="white"
              ).grid(row=0, column=0, padx=(12, 5), pady=10)
         
         self.search_var = StringVar()
-        self.search_var.trace_add("write", lambda *_: self.update_employee_tree())
+        self.search_var.trace_add("write", lambda *_: self._schedule_search())
         search_entry = Entry(search_frame, textvariable=self.search_var, 
                             width=65, font=("Segoe UI", 10), 
                             relief="flat", bd=0, bg="white",
@@ -1075,7 +3502,7 @@ class PontoApp:
               ).grid(row=0, column=2, padx=(5, 12), pady=10)
         
         search_frame.columnconfigure(1, weight=1)
-        for i in range(8):
+        for i in range(9):
             top.columnconfigure(i, weight=1)
         top.columnconfigure(0, weight=2)
 
@@ -1107,6 +3534,11 @@ class PontoApp:
                                          padx=18, pady=8, relief="flat", bd=0)
         self.label_nao_revisados.pack(side="left", padx=8, pady=5)
         
+        # Prévia da escala do funcionário selecionado (à direita da tabela)
+        preview = Frame(mid_container, bg="white", relief="groove", bd=2)
+        preview.pack(side=RIGHT, fill=Y, padx=(8, 2), pady=2)
+        self._build_preview_pane(preview)
+
         # Frame da tabela
         mid = Frame(mid_container, bg="white")
         mid.pack(fill=BOTH, expand=True, padx=2, pady=2)
@@ -1134,10 +3566,9 @@ class PontoApp:
                  background=[("selected", "#3498db")],
                  foreground=[("selected", "white")])
         
-        # Criação da Treeview com cores alternadas
-        self.emp_tree = ttk.Treeview(mid, columns=("mat", "cpf", "scale", "posto", "revisado"), show="tree headings", height=16)
-        self.emp_tree.tag_configure('oddrow', background='#f8f9fa')
-        self.emp_tree.tag_configure('evenrow', background='#ffffff')
+        # Tabela virtual (só as linhas visíveis existem na Treeview), cores alternadas
+        self.emp_table = VirtualEmployeeTable(mid, ("mat", "cpf", "scale", "posto", "revisado"), self._emp_row)
+        self.emp_tree = self.emp_table.tree
         
         self.emp_tree.heading("#0", text="FUNCIONÁRIO", command=lambda: self.sort_emp_tree("#0"))
         self.emp_tree.column("#0", width=400, anchor="w")
@@ -1150,17 +3581,203 @@ class PontoApp:
         self.emp_tree.pack(side=LEFT, fill=BOTH, expand=True)
         self.emp_tree.bind("<Double-1>", self.on_tree_double)
         self.emp_tree.bind("<Button-1>", self.on_tree_click)
+        self.emp_tree.bind("<<TreeviewSelect>>", self._on_emp_select, add="+")
+
+        self.emp_table.scrollbar.pack(side=LEFT, fill=Y)
+
+        # Prévia acompanha o período digitado
+        self.start_date_var.trace_add("write", lambda *_: self._schedule_preview(300))
+        self.end_date_var.trace_add("write", lambda *_: self._schedule_preview(300))
+
+    def _build_preview_pane(self, parent):
+        """Calendário colorido com a agenda calculada do funcionário selecionado (sem gerar PDF)."""
+        Label(parent, text="🗓️ PRÉVIA DA ESCALA", font=("Segoe UI", 11, "bold"),
+              bg="#2c3e50", fg="white", pady=8).pack(fill=X)
+        self.preview_name = Label(parent, text="SELECIONE UM FUNCIONÁRIO", font=("Segoe UI", 9, "bold"),
+                                  bg="white", fg="#2c3e50", wraplength=260, pady=6)
+        self.preview_name.pack(fill=X)
+
+        nav = Frame(parent, bg="white")
+        nav.pack(fill=X, padx=6)
+        nav_btn = dict(bg="#34495e", fg="white", font=("Segoe UI", 9, "bold"), relief="flat",
+                       bd=0, cursor="hand2", padx=8)
+        Button(nav, text="◀", command=lambda: self._preview_turn(-1), **nav_btn).pack(side=LEFT)
+        Button(nav, text="▶", command=lambda: self._preview_turn(1), **nav_btn).pack(side=RIGHT)
+        self.preview_month = Label(nav, text="", font=("Segoe UI", 10, "bold"), bg="white", fg="#2c3e50")
+        self.preview_month.pack(side=LEFT, expand=True)
+
+        grid = Frame(parent, bg="#bdc3c7")
+        grid.pack(padx=6, pady=6)
+        for col, wd in enumerate((6, 0, 1, 2, 3, 4, 5)):
+            Label(grid, text=WEEKDAY_PT_SHORT[wd][0], font=("Segoe UI", 8, "bold"), bg="#2c3e50",
+                  fg="white", width=4).grid(row=0, column=col, padx=1, pady=1, sticky="nsew")
+        self._preview_cells: List[Label] = []
+        for i in range(42):
+            cell = Label(grid, text="", font=("Segoe UI", 8, "bold"), width=4, height=2, bd=0, bg="#ecf0f1")
+            cell.grid(row=1 + i // 7, column=i % 7, padx=1, pady=1, sticky="nsew")
+            self._preview_cells.append(cell)
+
+        self.preview_summary = Label(parent, text="", font=("Segoe UI", 8), bg="white", fg="#2c3e50",
+                                     justify=LEFT, anchor="w", wraplength=260)
+        self.preview_summary.pack(fill=X, padx=8)
+
+        legend = Frame(parent, bg="white")
+        legend.pack(fill=X, padx=8, pady=(6, 8))
+        for i, (etype, texto) in enumerate(SCHEDULE_LEGEND):
+            Label(legend, text="  ", bg=SCHEDULE_COLORS[etype], relief="solid", bd=1).grid(row=i // 2, column=(i % 2) * 2, padx=(0, 4), pady=1)
+            Label(legend, text=texto, font=("Segoe UI", 7), bg="white", fg="#2c3e50").grid(row=i // 2, column=(i % 2) * 2 + 1, sticky="w", padx=(0, 8))
+
+        # Folha do mês exibido, gerada em memória (sem passar pela geração em lote)
+        actions = Frame(parent, bg="white")
+        actions.pack(fill=X, padx=6, pady=(0, 8))
+        act_btn = dict(fg="white", font=("Segoe UI", 8, "bold"), relief="flat", bd=0, cursor="hand2", pady=4)
+        Button(actions, text="💾 SALVAR PDF…", bg="#27ae60", command=self.save_preview_pdf,
+               **act_btn).pack(side=LEFT, fill=X, expand=True, padx=(0, 3))
+        Button(actions, text="👁 ABRIR PDF", bg="#2980b9", command=self.open_preview_pdf,
+               **act_btn).pack(side=LEFT, fill=X, expand=True, padx=(3, 0))
+
+    def _on_emp_select(self, event=None):
+        key = self.emp_table.selected_key()
+        if key != self._preview_key:
+            self._preview_key = key
+            self._preview_overrides = {}
+            self._schedule_preview()
+
+    def _schedule_preview(self, delay_ms: int = 50):
+        """Agrupa pedidos seguidos (rolar com as setas, digitar o período) num redesenho só."""
+        if self._preview_after is not None:
+            self.root.after_cancel(self._preview_after)
+        self._preview_after = self.root.after(delay_ms, self.refresh_preview)
+
+    def _preview_turn(self, delta: int):
+        self._preview_page += delta
+        self.refresh_preview()
+
+    def preview_with(self, key: str, **overrides):
+        """Mostra a prévia com escala/1ª folga ainda não salvas (tela de configuração aberta)."""
+        self._preview_key = key
+        self._preview_overrides = {k: v for k, v in overrides.items() if v is not None}
+        self.refresh_preview()
+
+    def refresh_preview(self):
+        self._preview_after = None
+        if not hasattr(self, "preview_name"):
+            return
+        emp = self.emp_index.get(self._preview_key) if self._preview_key else None
+        start = self._parse_date_str(self.start_date_var.get())
+        end = self._parse_date_str(self.end_date_var.get())
+        if not emp or not start or not end or end < start:
+            self.preview_name.config(text="SELECIONE UM FUNCIONÁRIO" if not emp else "PERÍODO INVÁLIDO")
+            self.preview_month.config(text="")
+            self.preview_summary.config(text="")
+            for cell in self._preview_cells:
+                cell.config(text="", bg="#ecf0f1")
+            return
+
+        months = month_starts(start, end)
+        self._preview_page = max(0, min(self._preview_page, len(months) - 1))
+        first = months[self._preview_page]
+        schedule = self._build_employee_schedule(emp, start, end, **self._preview_overrides)
+
+        escala = self._preview_overrides.get("scale_type") or self.emp_scale_choice.get(emp["id"], "6X1 (FIXO)")
+        pendente = " (NÃO SALVO)" if self._preview_overrides else ""
+        self.preview_name.config(text=f"{emp.get('nome', '')}\n{escala}{pendente}")
+        self.preview_month.config(text=f"{MONTH_NAMES_PT[first.month]} / {first.year}")
+        counts: Dict[str, int] = {}
+        for cell, d in zip(self._preview_cells, month_grid_dates(first.year, first.month)):
+            if d.month != first.month:
+                cell.config(text="", bg="#ecf0f1")
+                continue
+            entry = schedule.get(d.strftime("%Y-%m-%d"))
+            if entry is None:  # fora do período
+                cell.config(text=str(d.day), bg="#ecf0f1", fg="#bdc3c7")
+                continue
+            etype = (entry.get("type") or "").upper()
+            counts[etype] = counts.get(etype, 0) + 1
+            bg = SCHEDULE_COLORS.get(etype, "#ffffff")
+            cell.config(text=str(d.day), bg=bg, fg="#2c3e50" if bg in ("#ffffff", "#bdc3c7") else "white")
+        self.preview_summary.config(text="  •  ".join(
+            f"{texto}: {counts[etype]}" for etype, texto in SCHEDULE_LEGEND if counts.get(etype)))
+
+    def render_employee_month_pdf(self, key: str, year: int, month: int) -> bytes:
+        """
+        Folha de ponto de um funcionário em um mês, em memória (b"" se o mês não tem dias a registrar).
+        Dias fechados saem da escala congelada; os demais são calculados.
+        """
+        first = date(year, month, 1)
+        last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        frozen = PeriodSnapshotStore().load_range(first, last, key).get(key, [])
+        emp = self.emp_index.get(key)
+        if not emp and not frozen:
+            return b""
+        schedule = self._build_employee_schedule(emp, first, last) if emp else {}
+        # Um mês só: overlay_frozen_days devolve um único cabeçalho
+        for header, month_schedule in overlay_frozen_days(schedule, frozen, emp):
+            return render_timesheet_pdf(header, month_schedule, load_logo_image(header.get("filial")))
+        return b""
+
+    def _preview_pdf(self) -> Optional[Tuple[bytes, str]]:
+        """(bytes, nome de arquivo sugerido) da folha exibida na prévia; avisa e devolve None se não houver."""
+        emp = self.emp_index.get(self._preview_key) if self._preview_key else None
+        start = self._parse_date_str(self.start_date_var.get())
+        end = self._parse_date_str(self.end_date_var.get())
+        if not emp or not start or not end or end < start:
+            messagebox.showwarning("AVISO", "SELECIONE UM FUNCIONÁRIO E UM PERÍODO VÁLIDO")
+            return None
+        months = month_starts(start, end)
+        first = months[max(0, min(self._preview_page, len(months) - 1))]
+        try:
+            data = self.render_employee_month_pdf(self._preview_key, first.year, first.month)
+        except Exception as e:
+            print(f"[{now_str()}] ERRO AO GERAR PDF PARA {emp.get('nome', '')}: {e}\n{traceback.format_exc()}")
+            messagebox.showerror("ERRO", f"FALHA AO GERAR O PDF:\n{e}")
+            return None
+        if not data:
+            messagebox.showinfo("PDF", "SEM DIAS ÚTEIS NESTE MÊS — NENHUMA FOLHA A GERAR.")
+            return None
+        nome_base = "".join(ch for ch in (emp.get("nome") or "").rstrip(".").strip().upper() if ch not in "\\/:*?\"<>|")
+        return data, f"{first.month:02d}.{first.year}_{nome_base}.pdf"
+
+    def save_preview_pdf(self):
+        result = self._preview_pdf()
+        if not result:
+            return
+        data, fname = result
+        path = filedialog.asksaveasfilename(defaultextension=".pdf", initialfile=fname,
+                                            filetypes=[("PDF", "*.pdf")])
+        if not path:
+            return
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        except PermissionError:
+            messagebox.showerror("ERRO", f"NÃO FOI POSSÍVEL SOBRESCREVER:\n{path}\n\nO ARQUIVO PODE ESTAR ABERTO EM OUTRO PROGRAMA.")
+            return
+        except Exception as e:
+            messagebox.showerror("ERRO", f"FALHA AO SALVAR O PDF:\n{e}")
+            return
+        messagebox.showinfo("PDF", f"PDF SALVO EM:\n{path}")
 
-        sb = ttk.Scrollbar(mid, orient="vertical", command=self.emp_tree.yview)
-        self.emp_tree.configure(yscroll=sb.set)
-        sb.pack(side=LEFT, fill=Y)
+    def open_preview_pdf(self):
+        """Grava num arquivo temporário novo (nunca conflita com um PDF aberto) e abre no visualizador."""
+        result = self._preview_pdf()
+        if not result:
+            return
+        data, fname = result
+        import tempfile
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, prefix=fname[:-4] + "_", suffix=".pdf") as f:
+                f.write(data)
+            open_with_default_app(f.name)
+        except Exception as e:
+            messagebox.showerror("ERRO", f"FALHA AO ABRIR O PDF:\n{e}")
 
     def _build_bottom_frame(self):
         # Rodapé moderno com dica
         footer_frame = Frame(self.root, bg="#34495e", relief="flat", bd=0)
         footer_frame.pack(fill=X, padx=0, pady=0)
         
-        Label(footer_frame, text="💡 DICA: DÊ DUPLO-CLIQUE NO FUNCIONÁRIO PARA CONFIGURAR HORÁRIOS POR DIA.", 
+        Label(footer_frame, text="💡 DICA: DÊ DUPLO-CLIQUE NO FUNCIONÁRIO PARA CONFIGURAR. CTRL/SHIFT+CLIQUE SELECIONA VÁRIOS PARA A EDIÇÃO EM LOTE (FERRAMENTAS).", 
               font=("Segoe UI", 9, "italic"), bg="#34495e", fg="#ecf0f1", pady=10).pack()
 
     # ---------------------------
@@ -1176,7 +3793,7 @@ class PontoApp:
             return
         if not messagebox.askyesno("CONFIRMAR", "DESEJA REMOVER TODOS OS FUNCIONÁRIOS DA TELA ATUAL? (ESSA AÇÃO NÃO EXCLUI OS DADOS SALVOS NO ARQUIVO JSON ATÉ VOCÊ SALVAR)"):
             return
-        self.funcionarios = []
+        self._set_roster([])
         self.update_employee_tree()
         messagebox.showinfo("LIMPO", "LISTA DE FUNCIONÁRIOS LIMPA. CARREGUE UMA NOVA PLANILHA PARA ADICIONAR.")
 
@@ -1194,7 +3811,7 @@ class PontoApp:
             self.all_postos_historico.update(postos_atuais)
             # Salva o histórico limpo
             self.store["all_postos_historico"] = sorted(list(self.all_postos_historico))
-            save_store(self.store)
+            self._save_store()
         
         top = Toplevel(self.root)
         top.title("GERENCIAR CIDADES E POSTOS")
@@ -1218,9 +3835,10 @@ class PontoApp:
         left_frame = Frame(main_frame, bg="#ecf0f1")
         left_frame.pack(side=LEFT, fill=BOTH, expand=True, padx=(0, 15))
         
-        Label(left_frame, text="CIDADES CADASTRADAS", 
-              font=("Segoe UI", 11, "bold"), bg="#ecf0f1", 
-              fg="#2c3e50").pack(pady=8)
+        cities_title = Label(left_frame, text="CIDADES CADASTRADAS", 
+                             font=("Segoe UI", 11, "bold"), bg="#ecf0f1", 
+                             fg="#2c3e50")
+        cities_title.pack(pady=8)
         
         # Listbox de cidades com scroll
         list_container = Frame(left_frame)
@@ -1239,10 +3857,15 @@ class PontoApp:
         cities_listbox.pack(side=LEFT, fill=BOTH, expand=True)
         scrollbar.pack(side=RIGHT, fill=Y)
         
+        cities_loader = IncrementalLoader(
+            cities_listbox, lambda row: cities_listbox.insert("", "end", values=row),
+            counter=cities_title, loading_text="CIDADES CADASTRADAS (CARREGANDO {done} DE {total}...)",
+            on_done=lambda: cities_title.config(text=f"CIDADES CADASTRADAS ({len(self.cidades)})"),
+        )
+
         def refresh_cities():
             cities_listbox.delete(*cities_listbox.get_children())
-            for cidade, postos in sorted(self.cidades.items()):
-                cities_listbox.insert("", "end", values=(cidade.upper(), len(postos)))
+            cities_loader.load((cidade.upper(), len(postos)) for cidade, postos in sorted(self.cidades.items()))
         
         refresh_cities()
         
@@ -1404,7 +4027,8 @@ class PontoApp:
             postos_disponiveis = [p for p in postos_unicos if p not in postos_usados_outras_cidades]
             
             # Separa em duas listas: postos livres e postos da cidade
-            postos_livres = sorted([p for p in postos_disponiveis if p not in postos_cidade_atual])
+            na_cidade = set(postos_cidade_atual)
+            postos_livres = sorted([p for p in postos_disponiveis if p not in na_cidade])
             postos_na_cidade = sorted(postos_cidade_atual)
             
             # Frame principal com 3 colunas
@@ -1431,11 +4055,15 @@ class PontoApp:
             left_listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=2, pady=2)
             left_scroll.pack(side=RIGHT, fill=Y)
             
-            for posto in postos_livres:
-                left_listbox.insert(END, posto.upper())
-            
-            Label(left_column, text=f"Total: {len(postos_livres)}", 
-                  font=("Segoe UI", 9, "bold"), bg="#ecf0f1", fg="#7f8c8d").pack(pady=5)
+            left_total = Label(left_column, text=f"Total: {len(postos_livres)}", 
+                               font=("Segoe UI", 9, "bold"), bg="#ecf0f1", fg="#7f8c8d")
+            left_total.pack(pady=5)
+            left_loader = IncrementalLoader(
+                left_listbox, lambda p: left_listbox.insert(END, p),
+                counter=left_total, loading_text="Total: {total} (carregando {done}...)",
+                on_done=lambda: left_total.config(text=f"Total: {left_listbox.size()}"),
+            )
+            left_loader.load(p.upper() for p in postos_livres)
             
             # COLUNA CENTRAL: Botões de Transferência
             center_column = Frame(main_container, bg="#ecf0f1")
@@ -1515,11 +4143,15 @@ class PontoApp:
             right_listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=2, pady=2)
             right_scroll.pack(side=RIGHT, fill=Y)
             
-            for posto in postos_na_cidade:
-                right_listbox.insert(END, posto.upper())
-            
-            Label(right_column, text=f"Total: {len(postos_na_cidade)}", 
-                  font=("Segoe UI", 9, "bold"), bg="#ecf0f1", fg="#7f8c8d").pack(pady=5)
+            right_total = Label(right_column, text=f"Total: {len(postos_na_cidade)}", 
+                                font=("Segoe UI", 9, "bold"), bg="#ecf0f1", fg="#7f8c8d")
+            right_total.pack(pady=5)
+            right_loader = IncrementalLoader(
+                right_listbox, lambda p: right_listbox.insert(END, p),
+                counter=right_total, loading_text="Total: {total} (carregando {done}...)",
+                on_done=lambda: right_total.config(text=f"Total: {right_listbox.size()}"),
+            )
+            right_loader.load(p.upper() for p in postos_na_cidade)
             
             # Botões de ação
             btn_frame_dlg = Frame(dlg, bg="#ecf0f1")
@@ -1527,6 +4159,8 @@ class PontoApp:
             
             def salvar_alteracoes():
                 """Salva os postos da cidade"""
+                # A lista precisa estar completa antes de ser lida
+                right_loader.finish()
                 # Pega todos os postos da listbox direita
                 novos_postos = [right_listbox.get(idx) for idx in range(right_listbox.size())]
                 # Converte de volta para lowercase (como está armazenado)
@@ -1578,8 +4212,9 @@ class PontoApp:
                 Label(dlg, text="✅ TODOS OS POSTOS ESTÃO VINCULADOS A UMA CIDADE!", 
                       font=("Helvetica", 12, "bold"), fg="green").pack(pady=30)
             else:
-                Label(dlg, text=f"POSTOS SEM CIDADE: {len(postos_sem_cidade)}", 
-                      font=("Helvetica", 12, "bold")).pack(pady=10)
+                sem_cidade_title = Label(dlg, text=f"POSTOS SEM CIDADE: {len(postos_sem_cidade)}", 
+                                         font=("Helvetica", 12, "bold"))
+                sem_cidade_title.pack(pady=10)
                 
                 # Frame com lista de postos e scrollbar
                 list_container = Frame(dlg)
@@ -1596,9 +4231,12 @@ class PontoApp:
                 postos_tree.pack(side=LEFT, fill=BOTH, expand=True)
                 scrollbar.pack(side=RIGHT, fill=Y)
                 
-                # Popula lista
-                for posto in postos_sem_cidade:
-                    postos_tree.insert("", "end", values=(posto.upper(),))
+                # Popula lista (em fatias, a janela abre na hora)
+                IncrementalLoader(
+                    postos_tree, lambda posto: postos_tree.insert("", "end", values=(posto.upper(),)),
+                    counter=sem_cidade_title, loading_text="POSTOS SEM CIDADE: {total} (CARREGANDO {done}...)",
+                    on_done=lambda: sem_cidade_title.config(text=f"POSTOS SEM CIDADE: {len(postos_sem_cidade)}"),
+                ).load(postos_sem_cidade)
             
             Button(dlg, text="FECHAR", command=dlg.destroy).pack(pady=10)
         
@@ -1649,6 +4287,7 @@ class PontoApp:
         
         Label(frm_inner, text="📅 DATA:", bg="white", fg="#2c3e50",
               font=("Segoe UI", 10, "bold")).grid(row=0, column=0, sticky="w", padx=8, pady=8)
+        from tkcalendar import DateEntry  # carregado só quando abre um campo de data
         try:
             date_entry = DateEntry(
                 frm_inner,
@@ -1837,6 +4476,7 @@ class PontoApp:
             
             # Data (editável)
             Label(edit_frame, text="DATA:", font=("Helvetica", 10, "bold")).grid(row=0, column=0, sticky="w", pady=5)
+            from tkcalendar import DateEntry  # carregado só quando abre um campo de data
             data_entry = DateEntry(edit_frame, width=37, background='darkblue', foreground='white', 
                                   borderwidth=2, date_pattern='dd/mm/yyyy', locale='pt_BR',
                                   state='normal', cursor='hand2', takefocus=True,
@@ -1966,145 +4606,298 @@ class PontoApp:
         self.store["global_holidays"] = self.global_holidays
         self.store["holiday_type"] = self.holiday_type
         self.store["holiday_postos"] = self.holiday_postos
-        save_store(self.store)
+        if not self._save_store(parent=top_win):
+            return
         top_win.grab_release(); top_win.destroy()
+        self.refresh_preview()
         messagebox.showinfo("SALVO", "FERIADOS SALVOS.")
 
     def load_spreadsheet(self):
+        paths = filedialog.askopenfilenames(filetypes=[("Planilhas", "*.xlsx *.xls *.csv"), ("Todos", "*.*")])
+        if not paths:
+            return
+        aliases = self.store.get("import_aliases")
+        files = []
+        for p in paths:
+            try:
+                files.append((p, read_table_headers(p)))
+            except Exception:
+                pass  # arquivo ilegível: o erro aparece na importação
+        if not self._confirm_inexact_columns(files, aliases):
+            return
+        if len(paths) > 1:
+            self._load_spreadsheets_parallel(list(paths), aliases)
+            return
+        path = paths[0]
+        cache = ImportCache()
+        records = cache.load(path, aliases)
+        if records is None:
+            records = self._read_roster_with_progress(path, aliases)
+            if records is None:
+                return
+            cache.save(path, aliases, records)
+        self._apply_imported_roster(records)
+
+    def _confirm_inexact_columns(self, files: List[Tuple[str, List[str]]], aliases,
+                                 columns_table: Optional[Dict[str, List[str]]] = None) -> bool:
+        """
+        Mostra as colunas associadas por prefixo/semelhança (nome não exato) e
+        pede confirmação antes de importar. files = [(caminho, cabeçalhos)].
+        """
+        linhas = []
+        for path, headers in files:
+            _, inexact = resolve_columns(headers, aliases, columns_table)
+            for field, col in inexact.items():
+                linhas.append(f"{os.path.basename(path)}: {field.upper()} ← \"{col}\"")
+        if not linhas:
+            return True
+        extra = f"\n... E MAIS {len(linhas) - 40}" if len(linhas) > 40 else ""
+        return messagebox.askyesno(
+            "CONFIRMAR COLUNAS",
+            "ESTAS COLUNAS NÃO TÊM O NOME ESPERADO E FORAM ASSOCIADAS POR SEMELHANÇA:\n\n"
+            + "\n".join(linhas[:40]) + extra
+            + "\n\nIMPORTAR COM ESSAS ASSOCIAÇÕES?\n(NÃO = CANCELAR; RENOMEIE AS COLUNAS NA PLANILHA)")
+
+    def _load_spreadsheets_parallel(self, paths: List[str], aliases):
+        """
+        Importa as planilhas de várias filiais de uma vez: cada arquivo fora do
+        cache é lido em um processo separado, então o tempo total é o do maior.
+        """
+        cache = ImportCache()
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        pending = []
+        for path in paths:
+            cached = cache.load(path, aliases)
+            if cached is None:
+                pending.append(path)
+            else:
+                results[path] = cached
+
+        erros = []
+        if pending:
+            progress = self._progress_dialog("IMPORTANDO PLANILHAS", f"{len(paths)} ARQUIVOS")
+            workers = max(1, min(len(pending), os.cpu_count() or 1))
+            cancelled = False
+
+            def guardar(path, loader):
+                try:
+                    results[path] = loader()
+                    cache.save(path, aliases, results[path])
+                except RosterImportCancelled:
+                    raise
+                except Exception as e:
+                    erros.append(f"{os.path.basename(path)}: {e}")
+
+            if workers == 1:
+                # Um núcleo só: processos extras só somariam custo; lê um arquivo por vez
+                try:
+                    for i, path in enumerate(pending):
+                        base = len(paths) - len(pending) + i
+                        guardar(path, lambda p=path, b=base: read_roster_file(
+                            p, aliases,
+                            on_progress=lambda frac, n: progress.update(
+                                (b + frac) / len(paths), f"{b} DE {len(paths)} ARQUIVOS LIDOS")))
+                except RosterImportCancelled:
+                    cancelled = True
+            else:
+                # Sem "with": a saída do with espera os processos terminarem o arquivo
+                # em andamento, o que congelaria a tela depois do CANCELAR
+                pool = ProcessPoolExecutor(max_workers=workers)
+                try:
+                    futures = {pool.submit(read_roster_file_columns, path, aliases): path for path in pending}
+                    not_done = set(futures)
+                    while not_done:
+                        done, not_done = wait_futures(not_done, timeout=0.1, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            guardar(futures[fut], lambda f=fut: records_from_columns(*f.result()))
+                        lidos = len(paths) - len(not_done)
+                        if not progress.update(lidos / len(paths), f"{lidos} DE {len(paths)} ARQUIVOS LIDOS"):
+                            cancelled = True
+                            break
+                finally:
+                    # Cancelado: descarta a fila e volta já; os processos ocupados
+                    # terminam sozinhos em segundo plano e o resultado é ignorado
+                    pool.shutdown(wait=not cancelled, cancel_futures=True)
+            progress.close()
+            if cancelled:
+                messagebox.showinfo("CANCELADO", "IMPORTAÇÃO CANCELADA. NADA FOI ALTERADO.")
+                return
+        if erros:
+            messagebox.showerror("ERRO", "ARQUIVOS NÃO IMPORTADOS (NADA FOI ALTERADO):\n\n" + "\n".join(erros))
+            return
+
+        records, dupes = merge_roster_files([(p, results[p]) for p in paths])
+        notas = []
+        if dupes:
+            notas = ["", f"🔁 REPETIDOS EM MAIS DE UM ARQUIVO: {len(dupes)} (MANTIDA A ADMISSÃO MAIS RECENTE)"]
+            notas += [f"   {d['nome']}: {d['mantido']} (DESCARTADO EM {', '.join(d['descartados'])})"
+                      for d in dupes[:200]]
+        self._apply_imported_roster(records, notas)
+
+    def import_occurrences_action(self):
+        """
+        Importa ocorrências em lote de uma planilha (MATRÍCULA ou CPF, TIPO, INÍCIO, FIM)
+        e grava tudo em emp_faltas_atestados de uma vez.
+        """
+        if not self.funcionarios:
+            messagebox.showwarning("AVISO", "CARREGUE OS FUNCIONÁRIOS ANTES DAS OCORRÊNCIAS.")
+            return
         path = filedialog.askopenfilename(filetypes=[("Planilhas", "*.xlsx *.xls *.csv"), ("Todos", "*.*")])
         if not path:
             return
-        ext = os.path.splitext(path)[1].lower()
         try:
             import pandas as pd
-            if ext in (".xls", ".xlsx", ".xlsm"):
-                df = pd.read_excel(path, dtype=str).fillna("")
-            else:
-                try:
-                    df = pd.read_csv(path, dtype=str, encoding="utf-8", sep=None, engine="python").fillna("")
-                except Exception:
-                    df = pd.read_csv(path, dtype=str, encoding="latin-1", sep=None, engine="python").fillna("")
+            frames = [chunk for chunk, _ in iter_table_chunks(path)]
+            if not frames:
+                messagebox.showerror("ERRO", "ARQUIVO VAZIO.")
+                return
+            df = pd.concat(frames, ignore_index=True)
         except Exception as e:
             messagebox.showerror("ERRO AO ABRIR ARQUIVO", str(e))
             return
 
-        cols = list(df.columns)
-
-        def find(names: List[str]) -> Optional[str]:
-            for n in names:
-                for c in cols:
-                    # Normaliza para comparação (ignora espaços, pontuações e acentos)
-                    # Mantido o lower/strip para retrocompatibilidade
-                    normalized_c = (
-                        str(c).strip().lower()
-                        .replace(' ', '').replace('.', '').replace(',', '')
-                        .replace('ç', 'c').replace('ã', 'a').replace('á', 'a')
-                        .replace('é', 'e').replace('ê', 'e').replace('õ', 'o')
-                        .replace('ó', 'o').replace('ú', 'u')
-                    )
-                    normalized_n = (
-                        n.strip().lower()
-                        .replace(' ', '').replace('.', '').replace(',', '')
-                        .replace('ç', 'c').replace('ã', 'a').replace('á', 'a')
-                        .replace('é', 'e').replace('ê', 'e').replace('õ', 'o')
-                        .replace('ó', 'o').replace('ú', 'u')
-                    )
-                    if normalized_c == normalized_n:
-                        return c
+        aliases = self.store.get("import_aliases")
+        colmap = resolve_roster_columns(df.columns, aliases, OCCURRENCE_COLUMNS)
+        if not (colmap["matricula"] or colmap["cpf"]) or not colmap["tipo"] or not colmap["inicio"]:
+            messagebox.showerror("ERRO", "A PLANILHA PRECISA DAS COLUNAS MATRÍCULA (OU CPF), TIPO E INÍCIO.")
+            return
+        if not colmap["fim"]:
+            # Sem a coluna, todo período viraria um dia só: melhor recusar do que gravar errado
+            messagebox.showerror(
+                "ERRO",
+                "COLUNA DE FIM DO PERÍODO NÃO ENCONTRADA.\n\n"
+                f"COLUNAS DA PLANILHA: {', '.join(str(c) for c in df.columns)}\n\n"
+                "RENOMEIE A COLUNA DA DATA FINAL PARA \"FIM\" (OU \"DATA FIM\", \"TÉRMINO\", \"RETORNO\") "
+                "OU CADASTRE O NOME EM import_aliases → \"fim\". PARA OCORRÊNCIAS DE UM DIA, "
+                "DEIXE A COLUNA FIM EM BRANCO.")
+            return
+        if not self._confirm_inexact_columns([(path, list(df.columns))], aliases, OCCURRENCE_COLUMNS):
+            return
+
+        key_by_mat: Dict[str, str] = {}
+        key_by_cpf: Dict[str, str] = {}
+        for key, emp in self.emp_index.by_key.items():
+            mat = normalize_matricula(emp.get("matricula"))
+            if mat:
+                key_by_mat.setdefault(mat, key)
+            cpf = only_digits(emp.get("cpf"))
+            if cpf:
+                key_by_cpf.setdefault(cpf, key)
+        events, erros = expand_occurrences(df, colmap, key_by_mat, key_by_cpf)
+
+        overwrite = False
+        previa = merge_occurrences(self.emp_faltas_atestados, events, apply=False)
+        if previa["conflitos"]:
+            resp = messagebox.askyesnocancel(
+                "CONFLITOS",
+                f"{len(previa['conflitos'])} DIAS JÁ TÊM OUTRA OCORRÊNCIA GRAVADA.\n\n"
+                "SIM = SUBSTITUIR PELO QUE ESTÁ NA PLANILHA\n"
+                "NÃO = MANTER O QUE JÁ ESTÁ GRAVADO\n"
+                "CANCELAR = NÃO IMPORTAR NADA")
+            if resp is None:
+                return
+            overwrite = resp
+        stats = merge_occurrences(self.emp_faltas_atestados, events, overwrite=overwrite)
+        if stats["aplicados"]:
+            self.store["emp_faltas_atestados"] = self.emp_faltas_atestados
+            saved = self._save_store()
+            self.update_employee_tree()
+            if not saved:
+                return
+
+        limite = 200
+        linhas = [
+            f"LINHAS NA PLANILHA: {len(df)}",
+            f"DIAS GRAVADOS: {stats['aplicados']}",
+            f"DIAS QUE JÁ ESTAVAM IGUAIS: {stats['iguais']}",
+            f"CONFLITOS COM OCORRÊNCIAS GRAVADAS: {len(stats['conflitos'])}"
+            + (" (SUBSTITUÍDAS)" if overwrite else " (MANTIDAS)" if stats["conflitos"] else ""),
+            f"DIAS REPETIDOS NA PLANILHA COM TIPOS DIFERENTES: {stats['internos']} (VALEU A ÚLTIMA LINHA)",
+            f"LINHAS COM ERRO (IGNORADAS): {len(erros)}",
+        ]
+        if stats["conflitos"]:
+            linhas += ["", "⚠️ CONFLITOS:"]
+            for linha, key, ds, atual, novo in stats["conflitos"][:limite]:
+                data_fmt = datetime.strptime(ds, "%Y-%m-%d").strftime("%d/%m/%Y")
+                linhas.append(f"   LINHA {linha}: {self._emp_label(key)} {data_fmt} — "
+                              f"{OCCURRENCE_LABELS.get(atual, atual)} → {OCCURRENCE_LABELS.get(novo, novo)}")
+        if erros:
+            linhas += ["", "❌ ERROS:"] + [f"   LINHA {l}: {motivo}" for l, motivo in erros[:limite]]
+        self._show_scrollable_info("📋 IMPORTAÇÃO DE OCORRÊNCIAS", "\n".join(linhas))
+
+    def _read_roster_with_progress(self, path: str, aliases) -> Optional[List[Dict[str, Any]]]:
+        """Lê a planilha em blocos mostrando o progresso; None se falhou ou foi cancelada."""
+        progress = self._progress_dialog("IMPORTANDO PLANILHA", os.path.basename(path))
+        try:
+            records = read_roster_file(
+                path, aliases,
+                on_progress=lambda frac, n: progress.update(frac, f"{n} FUNCIONÁRIOS LIDOS"),
+            )
+        except RosterImportCancelled:
+            progress.close()
+            messagebox.showinfo("CANCELADO", "IMPORTAÇÃO CANCELADA. NADA FOI ALTERADO.")
+            return None
+        except RosterImportError as e:
+            progress.close()
+            messagebox.showerror("ERRO", str(e))
             return None
+        except Exception as e:
+            progress.close()
+            messagebox.showerror("ERRO AO ABRIR ARQUIVO", str(e))
+            return None
+        progress.close()
+        return records
+
+    def _progress_dialog(self, title: str, subtitle: str = ""):
+        """
+        Janela simples de progresso para tarefas longas executadas no thread da GUI.
+        update(fração, texto) devolve False se o usuário cancelou.
+        """
+        top = Toplevel(self.root)
+        top.title(title)
+        top.configure(bg="#ecf0f1")
+        top.transient(self.root)
+        top.resizable(False, False)
+        Label(top, text=title, font=("Segoe UI", 11, "bold"), bg="#2c3e50", fg="white",
+              pady=10).pack(fill=X)
+        if subtitle:
+            Label(top, text=subtitle, font=("Segoe UI", 9), bg="#ecf0f1").pack(padx=15, pady=(8, 0))
+        bar = ttk.Progressbar(top, orient="horizontal", length=360, mode="determinate", maximum=1000)
+        bar.pack(padx=15, pady=10)
+        status = Label(top, text="", font=("Segoe UI", 9), bg="#ecf0f1")
+        status.pack(padx=15)
+        cancelled = {"flag": False}
+        Button(top, text="CANCELAR", command=lambda: cancelled.update(flag=True),
+               bg="#e74c3c", fg="white", font=("Helvetica", 9, "bold"),
+               relief="raised", bd=2, cursor="hand2", padx=10).pack(pady=10)
+        top.protocol("WM_DELETE_WINDOW", lambda: cancelled.update(flag=True))
+        top.grab_set()
+
+        class _Progress:
+            def update(self, fraction: float, text: str = "") -> bool:
+                bar["value"] = int(max(0.0, min(fraction, 1.0)) * 1000)
+                status.config(text=text)
+                top.update()
+                return not cancelled["flag"]
 
-        # Nomes de colunas ajustados para lidar com a formatação do usuário
-        col_nome = find(["NOME", "name"])
-        col_mat = find(["MATRICULA", "matricula"])
-        col_adm = find(["ADMISSAO", "ADMISSÃO"])
-        col_cpf = find(["CPF"])
-        col_filial = find(["FILIAL", "Empresa"])
-        col_cnpj = find(["CNPJ"])
-        col_func = find(["FUNCAO", "FUNÇÃO", "cargo"])
-        col_posto = find(["POSTO", "posto"])
-        # Busca por "ENDEREÇO" e "CIDADE"
-        col_end = find(["ENDERECO", "ENDEREÇO"]) 
-        col_cidade = find(["CIDADE", "city"])
-        # Busca por "TIPO DE JORNADA" e "PRIMEIRO DIA DE FOLGA" (colunas K e L)
-        col_tipo_jornada = find(["JORNADA (5X1 / 5X2 / 6X1 FIXO / 6X1 INTERCALADA / 12X36)", "TIPO DE JORNADA", "JORNADA", "ESCALA"])
-        col_primeira_folga = find(["PRIMEIRO DIA DE FOLGA", "PRIMEIRODIADEFOLGA", "1 FOLGA", "PRIMEIRA FOLGA"])
-
-        if not col_nome:
-            messagebox.showerror("ERRO", "Coluna 'NOME' não encontrada.")
-            return
+            def close(self):
+                try:
+                    top.grab_release()
+                    top.destroy()
+                except Exception:
+                    pass
 
-        new_list = []
-        for _, row in df.iterrows():
-            nome = str(row.get(col_nome, "")).strip().upper()
-            if not nome:
-                continue
-            matric = str(row.get(col_mat, "")) if col_mat else ""
-            adm_val = row.get(col_adm, "") if col_adm else ""
-            adm_date = None
-            if str(adm_val).strip():
-                for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
-                    try:
-                        adm_date = datetime.strptime(str(adm_val).strip(), fmt).date()
-                        break
-                    except Exception:
-                        pass
-            func = str(row.get(col_func, "")).strip().upper() if col_func else ""
-            filial = str(row.get(col_filial, "")).strip().upper() if col_filial else ""
-            cnpj = str(row.get(col_cnpj, "")).strip() if col_cnpj else ""
-            cpf = str(row.get(col_cpf, "")).strip() if col_cpf else ""
-            posto = str(row.get(col_posto, "")).strip().upper() if col_posto else ""
-            endereco = str(row.get(col_end, "")).strip().upper() if col_end else ""
-            cidade = str(row.get(col_cidade, "")).strip().upper() if col_cidade else ""
-            
-            # Lê TIPO DE JORNADA e PRIMEIRO DIA DE FOLGA da planilha (colunas K e L)
-            tipo_jornada = str(row.get(col_tipo_jornada, "")).strip().upper() if col_tipo_jornada else ""
-            primeira_folga_str = str(row.get(col_primeira_folga, "")).strip() if col_primeira_folga else ""
-            
-            # Normaliza tipo de jornada para corresponder às chaves de SCALE_TYPES
-            # Aceita variações como "6x1 fica", "6x1 fixo", "6x1 intercalada", etc.
-            if tipo_jornada:
-                tipo_normalizado = None
-                tj_lower = tipo_jornada.lower().replace("(", "").replace(")", "").strip()
-                
-                if "5x2" in tj_lower or "5 x 2" in tj_lower:
-                    tipo_normalizado = "5X2"
-                elif "5x1" in tj_lower or "5 x 1" in tj_lower:
-                    tipo_normalizado = "5X1"
-                elif "12x36" in tj_lower or "12 x 36" in tj_lower:
-                    tipo_normalizado = "12X36"
-                elif "6x1" in tj_lower or "6 x 1" in tj_lower:
-                    if "intercalad" in tj_lower:
-                        tipo_normalizado = "6X1 (INTERCALADA)"
-                    else:
-                        tipo_normalizado = "6X1 (FIXO)"
-                
-                if tipo_normalizado:
-                    self.emp_scale_choice[nome] = tipo_normalizado
-            
-            # Se primeira folga veio da planilha, tenta converter para data
-            if primeira_folga_str:
-                primeira_folga_date = None
-                for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"):
-                    try:
-                        primeira_folga_date = datetime.strptime(primeira_folga_str, fmt).date()
-                        break
-                    except Exception:
-                        pass
-                if primeira_folga_date:
-                    self.emp_first_off[nome] = primeira_folga_date.strftime("%Y-%m-%d")
+        return _Progress()
 
-            new_list.append({
-                "nome": nome,
-                "matricula": matric,
-                "admissao": adm_date,
-                "funcao": func,
-                "filial": filial,
-                "cnpj": cnpj,
-                "endereco": endereco, 
-                "cidade": cidade, 
-                "cpf": cpf,
-                "posto": posto
-            })
+    def _apply_imported_roster(self, new_list: List[Dict[str, Any]], notas: Optional[List[str]] = None):
+        """
+        Atualiza o quadro com a planilha importada (upsert pela chave estável):
+        só entram os novos, só mudam os campos alterados e saem os que não vieram.
+        """
+        # Escala/1ª folga lidas da planilha; aplicadas pela chave
+        sheet_scale = [emp.pop("escala", "") for emp in new_list]
+        sheet_first_off = [emp.pop("primeira_folga", "") for emp in new_list]
+        keys = assign_employee_keys(new_list)
 
         # Adiciona novos postos ao histórico (preserva os antigos)
         # FILTRO: Ignora valores que parecem CPF (contém apenas números, pontos e traços)
@@ -2114,18 +4907,65 @@ class PontoApp:
             if emp.get("posto", "").strip() and not self._is_cpf_format(emp.get("posto", "").strip())
         )
         self.all_postos_historico.update(novos_postos)
-        
-        self.funcionarios = new_list
+
+        diff = diff_roster(self.emp_index, new_list)
+        # Nomes de quem sai, antes de sumirem do índice
+        departed_names = [self._emp_label(k) for k in diff["departed"]]
+        apply_roster_diff(self.funcionarios, self.emp_index, diff)
+        self._roster_changed()
+        if diff["new"]:
+            # Estado antigo por nome que agora encontrou dono é migrado
+            migrate_employee_state(self.store, self.emp_index)
+        for key, escala, folga in zip(keys, sheet_scale, sheet_first_off):
+            if escala:
+                self.emp_scale_choice[key] = escala
+            if folga:
+                self.emp_first_off[key] = folga
         self.store["funcionarios"] = self.funcionarios
         self.store["all_postos_historico"] = sorted(list(self.all_postos_historico))
-        save_store(self.store)
+        stats = {"entries": 0, "bytes_reclaimed": 0}
+        if diff["new"] or diff["departed"]:
+            # Arquiva o estado de quem saiu do quadro (mantém o store do tamanho do quadro atual)
+            stats = self._compact_store()
+        saved = self._save_store()
         self.update_employee_tree()
-        messagebox.showinfo("OK", f"{len(new_list)} FUNCIONÁRIOS CARREGADOS.")
+        if not saved:
+            return
+        self._show_import_summary(diff, departed_names, stats, notas or [])
+        issues = validate_roster(self.funcionarios)
+        if issues:
+            self.show_validation_report(issues)
+
+    def _show_import_summary(self, diff: Dict[str, Any], departed_names: List[str], stats: Dict[str, int],
+                             notas: List[str]):
+        limite = 200  # nomes listados por categoria
+        linhas = [
+            f"NOVOS: {len(diff['new'])}",
+            f"ALTERADOS: {len(diff['changed'])}",
+            f"SEM ALTERAÇÃO: {diff['unchanged']}",
+            f"SAÍRAM DO QUADRO: {len(diff['departed'])}",
+        ]
+        if stats["entries"]:
+            linhas.append(f"\n{stats['entries']} REGISTROS DE FUNCIONÁRIOS FORA DO QUADRO ARQUIVADOS "
+                          f"({format_bytes(stats['bytes_reclaimed'])} LIBERADOS).")
+        if not (diff["new"] or diff["changed"] or diff["departed"] or notas):
+            messagebox.showinfo("OK", "\n".join(linhas))
+            return
+        linhas += notas
+        if diff["new"]:
+            linhas += ["", "➕ NOVOS:"] + [f"   {e.get('nome', '')}" for e in diff["new"][:limite]]
+        if diff["changed"]:
+            linhas += ["", "✏️ ALTERADOS:"]
+            for key, delta in diff["changed"][:limite]:
+                linhas.append(f"   {self._emp_label(key)}: {', '.join(f.upper() for f in delta)}")
+        if diff["departed"]:
+            linhas += ["", "➖ SAÍRAM DO QUADRO:"] + [f"   {n}" for n in departed_names[:limite]]
+        self._show_scrollable_info("📊 RESUMO DA IMPORTAÇÃO", "\n".join(linhas))
 
     def select_logo_image(self):
         """Abre janela para gerenciar logos por filial."""
         # Obter lista de filiais únicas dos funcionários
-        filiais = sorted(set(emp.get("filial", "").strip().upper() for emp in self.funcionarios if emp.get("filial", "").strip()))
+        filiais = self.emp_index.filiais()
         
         if not filiais:
             messagebox.showwarning("AVISO", "NENHUMA FILIAL ENCONTRADA.\nCarregue funcionários primeiro para definir filiais.")
@@ -2303,11 +5143,12 @@ class PontoApp:
                 if "logos_filiais" not in self.store:
                     self.store["logos_filiais"] = {}
                 self.store["logos_filiais"][filial] = b64_str
-                save_store(self.store)
+                saved = self._save_store(parent=logo_win)
                 
                 atualizar_lista()
                 mostrar_preview()
-                messagebox.showinfo("SUCESSO", f"LOGO SALVO PARA:\n{filial}")
+                if saved:
+                    messagebox.showinfo("SUCESSO", f"LOGO SALVO PARA:\n{filial}")
             
             except Exception as e:
                 messagebox.showerror("ERRO", f"ERRO AO CARREGAR LOGO:\n{str(e)}")
@@ -2326,10 +5167,11 @@ class PontoApp:
             if messagebox.askyesno("CONFIRMAR", f"REMOVER LOGO DA FILIAL:\n{filial}?"):
                 if "logos_filiais" in self.store and filial in self.store["logos_filiais"]:
                     del self.store["logos_filiais"][filial]
-                    save_store(self.store)
+                    saved = self._save_store(parent=logo_win)
                     atualizar_lista()
                     mostrar_preview()
-                    messagebox.showinfo("SUCESSO", f"LOGO REMOVIDO DA FILIAL:\n{filial}")
+                    if saved:
+                        messagebox.showinfo("SUCESSO", f"LOGO REMOVIDO DA FILIAL:\n{filial}")
         
         remove_btn.config(command=remover_logo)
 
@@ -2337,7 +5179,7 @@ class PontoApp:
         """Abre menu com opções: Carregar Arquivo ou Baixar Modelo Excel."""
         menu_win = Toplevel(self.root)
         menu_win.title("CARREGAR FUNCIONÁRIOS")
-        menu_win.geometry("480x280")
+        menu_win.geometry("520x500")
         menu_win.resizable(False, False)
         menu_win.configure(bg="#ecf0f1")
         menu_win.transient(self.root)
@@ -2361,6 +5203,20 @@ class PontoApp:
                relief="flat", bd=0, cursor="hand2", padx=25, pady=15
               ).pack(pady=10, fill=X)
         
+        # Botão Importar Ocorrências
+        Button(btn_container, text="📋 IMPORTAR OCORRÊNCIAS (FÉRIAS/ATESTADOS/FOLGAS)", 
+               command=lambda: [menu_win.destroy(), self.import_occurrences_action()],
+               bg="#e67e22", fg="white", font=("Segoe UI", 11, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=15
+              ).pack(pady=10, fill=X)
+        
+        # Botão Exportar Quadro
+        Button(btn_container, text="📤 EXPORTAR QUADRO ATUAL (EXCEL/CSV)", 
+               command=lambda: [menu_win.destroy(), self.export_roster_action()],
+               bg="#9b59b6", fg="white", font=("Segoe UI", 11, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=15
+              ).pack(pady=10, fill=X)
+        
         # Botão Baixar Modelo
         Button(btn_container, text="📥 BAIXAR MODELO EXCEL", 
                command=lambda: [menu_win.destroy(), self.download_excel_template()],
@@ -2374,6 +5230,326 @@ class PontoApp:
                relief="flat", bd=0, cursor="hand2", padx=25, pady=12
               ).pack(pady=10, fill=X)
 
+    def show_tools_menu(self):
+        """Abre menu de ferramentas de manutenção."""
+        menu_win = Toplevel(self.root)
+        menu_win.title("FERRAMENTAS")
+        menu_win.geometry("520x500")
+        menu_win.resizable(False, False)
+        menu_win.configure(bg="#ecf0f1")
+        menu_win.transient(self.root)
+        menu_win.grab_set()
+        
+        # Título moderno
+        title_frame = Frame(menu_win, bg="#2c3e50")
+        title_frame.pack(fill=X)
+        Label(title_frame, text="🧰 FERRAMENTAS", 
+              font=("Segoe UI", 13, "bold"), bg="#2c3e50", fg="white", 
+              pady=18).pack()
+        
+        # Container de botões
+        btn_container = Frame(menu_win, bg="#ecf0f1")
+        btn_container.pack(fill=BOTH, expand=True, padx=25, pady=20)
+        
+        # Botão Compactar Store
+        Button(btn_container, text="🧹 COMPACTAR DADOS SALVOS", 
+               command=lambda: [menu_win.destroy(), self.compact_store_action()],
+               bg="#16a085", fg="white", font=("Segoe UI", 11, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=15
+              ).pack(pady=10, fill=X)
+        
+        # Botão Fechar Período
+        Button(btn_container, text="🔒 FECHAR PERÍODO (CONGELAR ESCALAS)", 
+               command=lambda: [menu_win.destroy(), self.close_period_action()],
+               bg="#2980b9", fg="white", font=("Segoe UI", 11, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=15
+              ).pack(pady=10, fill=X)
+        
+        # Botão Validar Cadastro
+        Button(btn_container, text="✅ VALIDAR CADASTRO", 
+               command=lambda: [menu_win.destroy(), self.validate_roster_action()],
+               bg="#8e44ad", fg="white", font=("Segoe UI", 11, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=15
+              ).pack(pady=10, fill=X)
+        
+        # Botão Edição em Lote
+        Button(btn_container, text="✏️ EDITAR EM LOTE (ESCALA / 1ª FOLGA / OCORRÊNCIAS)", 
+               command=lambda: [menu_win.destroy(), self.bulk_edit_action()],
+               bg="#d35400", fg="white", font=("Segoe UI", 11, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=15
+              ).pack(pady=10, fill=X)
+        
+        # Botão Fechar
+        Button(btn_container, text="❌ FECHAR", command=menu_win.destroy,
+               bg="#95a5a6", fg="white", font=("Segoe UI", 10, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=25, pady=12
+              ).pack(pady=10, fill=X)
+
+    def bulk_edit_action(self):
+        """Aplica escala, 1ª folga e/ou uma ocorrência aos selecionados ou ao filtro, com uma só gravação."""
+        if not self.funcionarios:
+            messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO CARREGADO.")
+            return
+        selecionados = self.emp_table.selected_keys()
+        filtrados = list(self.emp_table.rows)
+
+        top = Toplevel(self.root)
+        top.title("EDIÇÃO EM LOTE")
+        top.geometry("600x560")
+        top.configure(bg="#ecf0f1")
+        top.transient(self.root)
+        top.grab_set()
+
+        title_frame = Frame(top, bg="#2c3e50")
+        title_frame.pack(fill=X)
+        Label(title_frame, text="✏️ EDIÇÃO EM LOTE", font=("Segoe UI", 13, "bold"),
+              bg="#2c3e50", fg="white", pady=15).pack()
+
+        frm = Frame(top, bg="#ffffff", relief="groove", bd=2)
+        frm.pack(fill=BOTH, expand=True, padx=15, pady=15)
+
+        # Quem recebe a alteração
+        Label(frm, text="APLICAR EM:", font=("Helvetica", 10, "bold"), bg="#ffffff").grid(row=0, column=0, sticky="w", padx=10, pady=(10, 0))
+        alvo_var = StringVar(value="selecionados" if len(selecionados) > 1 else "filtro")
+        ttk.Radiobutton(frm, text=f"SELECIONADOS NA TABELA ({len(selecionados)})", variable=alvo_var,
+                        value="selecionados", state=NORMAL if selecionados else DISABLED
+                        ).grid(row=1, column=0, columnspan=4, sticky="w", padx=20)
+        ttk.Radiobutton(frm, text=f"TODOS DO FILTRO ATUAL ({len(filtrados)})", variable=alvo_var,
+                        value="filtro").grid(row=2, column=0, columnspan=4, sticky="w", padx=20, pady=(0, 10))
+
+        from tkcalendar import DateEntry  # carregado só quando abre um campo de data
+
+        def date_field(parent):
+            try:
+                return DateEntry(parent, date_pattern="dd/mm/yyyy", locale="pt_BR", width=14,
+                                 font=("Helvetica", 10), showweeknumbers=False,
+                                 firstweekday="sunday", state='normal')
+            except TypeError:
+                return DateEntry(parent, date_pattern="dd/mm/yyyy", width=14, state='normal')
+
+        # Escala
+        escala_on = BooleanVar(value=False)
+        ttk.Checkbutton(frm, text="ALTERAR ESCALA:", variable=escala_on).grid(row=3, column=0, sticky="w", padx=10, pady=8)
+        escala_var = StringVar(value="6X1 (FIXO)")
+        ttk.Combobox(frm, textvariable=escala_var, values=list(SCALE_TYPES.keys()), state="readonly",
+                     width=20, font=("Helvetica", 10)).grid(row=3, column=1, columnspan=2, sticky="w", pady=8)
+
+        # 1ª folga
+        folga_on = BooleanVar(value=False)
+        ttk.Checkbutton(frm, text="ALTERAR DATA 1ª FOLGA:", variable=folga_on).grid(row=4, column=0, sticky="w", padx=10, pady=8)
+        folga_entry = date_field(frm)
+        folga_entry.grid(row=4, column=1, sticky="w", pady=8)
+        folga_limpar = BooleanVar(value=False)
+        ttk.Checkbutton(frm, text="LIMPAR", variable=folga_limpar).grid(row=4, column=2, sticky="w", padx=10)
+
+        # Modelo de ocorrência: tipo a partir de uma data por N dias
+        occ_on = BooleanVar(value=False)
+        ttk.Checkbutton(frm, text="APLICAR OCORRÊNCIA:", variable=occ_on).grid(row=5, column=0, sticky="w", padx=10, pady=8)
+        tipos = [OCCURRENCE_LABELS[t] for t in OCCURRENCE_TYPES] + ["(LIMPAR DIAS)"]
+        tipo_var = StringVar(value=tipos[0])
+        ttk.Combobox(frm, textvariable=tipo_var, values=tipos, state="readonly", width=16,
+                     font=("Helvetica", 10)).grid(row=5, column=1, sticky="w", pady=8)
+        Label(frm, text="A PARTIR DE:", bg="#ffffff", font=("Helvetica", 9)).grid(row=6, column=0, sticky="e", padx=10)
+        occ_entry = date_field(frm)
+        occ_entry.grid(row=6, column=1, sticky="w", pady=4)
+        Label(frm, text="DIAS:", bg="#ffffff", font=("Helvetica", 9)).grid(row=6, column=2, sticky="e", padx=5)
+        dias_var = StringVar(value="1")
+        Spinbox(frm, from_=1, to=OCCURRENCE_MAX_DAYS, textvariable=dias_var, width=6,
+                font=("Helvetica", 10)).grid(row=6, column=3, sticky="w", pady=4)
+        inicio_periodo = self._parse_date_str(self.start_date_var.get()) if hasattr(self, 'start_date_var') else None
+        if inicio_periodo:
+            try:
+                occ_entry.set_date(inicio_periodo)
+            except Exception:
+                pass
+
+        def aplicar():
+            keys = selecionados if alvo_var.get() == "selecionados" else filtrados
+            if not keys:
+                messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO NO ALVO ESCOLHIDO.", parent=top)
+                return
+            escala = escala_var.get() if escala_on.get() else None
+            primeira_folga = None
+            if folga_on.get():
+                if folga_limpar.get():
+                    primeira_folga = ""
+                else:
+                    try:
+                        primeira_folga = folga_entry.get_date().strftime("%Y-%m-%d")
+                    except Exception:
+                        messagebox.showerror("ERRO", "DATA DA 1ª FOLGA INVÁLIDA.", parent=top)
+                        return
+            ocorrencia = None
+            if occ_on.get():
+                try:
+                    inicio = occ_entry.get_date()
+                    qnt = int(dias_var.get())
+                except Exception:
+                    messagebox.showerror("ERRO", "DATA OU QUANTIDADE DE DIAS INVÁLIDA.", parent=top)
+                    return
+                if not 1 <= qnt <= OCCURRENCE_MAX_DAYS:
+                    messagebox.showerror("ERRO", f"QUANTIDADE DE DIAS DEVE SER DE 1 A {OCCURRENCE_MAX_DAYS}.", parent=top)
+                    return
+                label_to_type = {lbl: t for t, lbl in OCCURRENCE_LABELS.items()}
+                ocorrencia = (label_to_type.get(tipo_var.get(), ""), inicio, qnt)
+            if escala is None and primeira_folga is None and ocorrencia is None:
+                messagebox.showwarning("AVISO", "MARQUE PELO MENOS UMA ALTERAÇÃO.", parent=top)
+                return
+            if not messagebox.askyesno("CONFIRMAR", f"APLICAR AS ALTERAÇÕES EM {len(keys)} FUNCIONÁRIO(S)?", parent=top):
+                return
+
+            stats = bulk_edit_employees(keys, self.emp_scale_choice, self.emp_first_off,
+                                        self.emp_faltas_atestados, escala=escala,
+                                        primeira_folga=primeira_folga, ocorrencia=ocorrencia)
+            if any(stats.values()):
+                # Uma gravação só para o lote inteiro
+                self.store["emp_scale_choice"] = self.emp_scale_choice
+                self.store["emp_first_off"] = self.emp_first_off
+                self.store["emp_faltas_atestados"] = self.emp_faltas_atestados
+                saved = self._save_store(parent=top)
+                self.emp_table.refresh_keys(keys)
+                self.refresh_preview()
+                if not saved:
+                    return  # janela fica aberta para tentar de novo
+            top.grab_release()
+            top.destroy()
+            messagebox.showinfo(
+                "EDIÇÃO EM LOTE",
+                f"FUNCIONÁRIOS NO LOTE: {len(keys)}\n"
+                f"ESCALAS ALTERADAS: {stats['escala']}\n"
+                f"1ª FOLGA ALTERADA: {stats['primeira_folga']}\n"
+                f"DIAS DE OCORRÊNCIA ALTERADOS: {stats['ocorrencias']}"
+            )
+
+        btns = Frame(top, bg="#ecf0f1")
+        btns.pack(pady=(0, 15))
+        Button(btns, text="✓ APLICAR", command=aplicar, bg="#27ae60", fg="white",
+               font=("Helvetica", 10, "bold"), relief="raised", bd=3, cursor="hand2",
+               padx=30, pady=10).pack(side=LEFT, padx=5)
+        Button(btns, text="✗ CANCELAR", command=lambda: (top.grab_release(), top.destroy()),
+               bg="#95a5a6", fg="white", font=("Helvetica", 10, "bold"), relief="raised", bd=3,
+               cursor="hand2", padx=30, pady=10).pack(side=LEFT, padx=5)
+
+    def validate_roster_action(self):
+        if not self.funcionarios:
+            messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO CARREGADO.")
+            return
+        issues = validate_roster(self.funcionarios)
+        if not issues:
+            messagebox.showinfo("OK", f"NENHUM PROBLEMA ENCONTRADO EM {len(self.funcionarios)} FUNCIONÁRIOS.")
+            return
+        self.show_validation_report(issues)
+
+    def show_validation_report(self, issues: List[Dict[str, Any]]):
+        """Relatório de problemas do cadastro; clique no cabeçalho para ordenar."""
+        top = Toplevel(self.root)
+        top.title("VALIDAÇÃO DO CADASTRO")
+        top.geometry("980x560")
+        top.configure(bg="#ecf0f1")
+        top.transient(self.root)
+
+        erros = sum(1 for i in issues if i["gravidade"] == "ERRO")
+        title_frame = Frame(top, bg="#2c3e50")
+        title_frame.pack(fill=X)
+        Label(title_frame, text=f"✅ VALIDAÇÃO DO CADASTRO — {erros} ERROS, {len(issues) - erros} AVISOS",
+              font=("Segoe UI", 12, "bold"), bg="#2c3e50", fg="white", pady=12).pack()
+
+        list_frame = Frame(top, bg="#ecf0f1")
+        list_frame.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        cols = ("gravidade", "nome", "matricula", "campo", "problema", "valor")
+        titulos = {"gravidade": "GRAVIDADE", "nome": "FUNCIONÁRIO", "matricula": "MATRÍCULA",
+                   "campo": "CAMPO", "problema": "PROBLEMA", "valor": "VALOR"}
+        larguras = {"gravidade": 80, "nome": 230, "matricula": 90, "campo": 90, "problema": 280, "valor": 160}
+        tree = ttk.Treeview(list_frame, columns=cols, show="headings")
+        vsb = ttk.Scrollbar(list_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=vsb.set)
+        tree.pack(side=LEFT, fill=BOTH, expand=True)
+        vsb.pack(side=RIGHT, fill=Y)
+        tree.tag_configure("ERRO", foreground="#c0392b")
+        tree.tag_configure("AVISO", foreground="#d35400")
+
+        rows = list(issues)
+        order = {"col": "gravidade", "desc": False}
+
+        def fill():
+            tree.delete(*tree.get_children())
+            for r in rows:
+                tree.insert("", "end", values=[r[c] for c in cols], tags=(r["gravidade"],))
+
+        def sort_by(col):
+            order["desc"] = not order["desc"] if order["col"] == col else False
+            order["col"] = col
+            rows.sort(key=lambda r: (r[col], r["nome"]), reverse=order["desc"])
+            fill()
+
+        for c in cols:
+            tree.heading(c, text=titulos[c], command=lambda c=c: sort_by(c))
+            tree.column(c, width=larguras[c], anchor="w")
+        rows.sort(key=lambda r: (r["gravidade"], r["nome"]))
+        fill()
+
+        def exportar():
+            path = filedialog.asksaveasfilename(defaultextension=".csv", initialfile="validacao_cadastro.csv",
+                                                filetypes=[("CSV", "*.csv")])
+            if not path:
+                return
+            with open(path, "w", encoding="utf-8-sig", newline="") as f:
+                w = csv.writer(f, delimiter=";")
+                w.writerow([titulos[c] for c in cols])
+                for r in rows:
+                    w.writerow([r[c] for c in cols])
+            messagebox.showinfo("SALVO", f"RELATÓRIO SALVO EM:\n{path}")
+
+        btn_frame = Frame(top, bg="#ecf0f1")
+        btn_frame.pack(fill=X, padx=10, pady=(0, 10))
+        Button(btn_frame, text="❌ FECHAR", command=top.destroy,
+               bg="#95a5a6", fg="white", font=("Segoe UI", 10, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=20, pady=8).pack(side=RIGHT, padx=5)
+        Button(btn_frame, text="💾 EXPORTAR CSV", command=exportar,
+               bg="#3498db", fg="white", font=("Segoe UI", 10, "bold"),
+               relief="flat", bd=0, cursor="hand2", padx=20, pady=8).pack(side=RIGHT, padx=5)
+
+    def compact_store_action(self):
+        """Compactação sob demanda: arquiva estado de funcionários fora do quadro atual."""
+        if not self.funcionarios:
+            messagebox.showwarning("AVISO", "CARREGUE A PLANILHA PRIMEIRO.\n\nSem funcionários no quadro, todos os dados seriam arquivados.")
+            return
+        if not messagebox.askyesno("CONFIRMAR", 
+            "ARQUIVAR ESCALAS, FOLGAS, OCORRÊNCIAS E REVISÕES DE FUNCIONÁRIOS QUE NÃO ESTÃO NO QUADRO ATUAL?\n\n"
+            f"Os dados vão para o arquivo '{STORE_ARCHIVE}' e voltam automaticamente se o funcionário reaparecer em uma planilha."):
+            return
+        stats = self._compact_store()
+        if not self._save_store():
+            return
+        messagebox.showinfo(
+            "COMPACTAÇÃO CONCLUÍDA",
+            f"REGISTROS ARQUIVADOS: {stats['entries']}\n\n"
+            f"TAMANHO ANTES: {format_bytes(stats['bytes_before'])}\n"
+            f"TAMANHO DEPOIS: {format_bytes(stats['bytes_after'])}\n"
+            f"ESPAÇO LIBERADO: {format_bytes(stats['bytes_reclaimed'])}"
+        )
+
+    def export_roster_action(self):
+        """Exporta o quadro atual (com escala e 1ª folga) no layout do modelo, para editar e reimportar."""
+        if not self.funcionarios:
+            messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO CARREGADO.")
+            return
+        path = filedialog.asksaveasfilename(
+            title="EXPORTAR QUADRO",
+            defaultextension=".xlsx",
+            filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv")],
+            initialfile=f"QUADRO_FUNCIONARIOS_{datetime.now().strftime('%Y%m%d')}.xlsx"
+        )
+        if not path:
+            return
+        try:
+            total = export_roster(path, iter_roster_export_rows(
+                self.funcionarios, self.emp_scale_choice, self.emp_first_off))
+        except Exception as e:
+            messagebox.showerror("ERRO", f"ERRO AO EXPORTAR:\n{e}")
+            return
+        messagebox.showinfo("EXPORTADO", f"{total} FUNCIONÁRIOS EXPORTADOS EM:\n{os.path.basename(path)}")
+
     def download_excel_template(self):
         """Cria e salva arquivo Excel modelo com as colunas necessárias e exemplos."""
         try:
@@ -2493,47 +5669,56 @@ class PontoApp:
         except Exception as e:
             messagebox.showerror("ERRO", f"ERRO AO CRIAR MODELO:\n{str(e)}")
 
-    def update_employee_tree(self):
-        for i in self.emp_tree.get_children():
-            self.emp_tree.delete(i)
-        # Filtro de busca (por nome e matrícula)
-        query = normalize_text(self.search_var.get()) if hasattr(self, 'search_var') else ""
+    def _emp_row(self, key: str):
+        """Texto, valores e estado de revisão de uma linha da tabela principal."""
+        emp = self.emp_index.get(key) or {}
+        nome = emp.get("nome", "")
+        funcao = emp.get("funcao", "")
+        # Monta o texto com nome e função em linhas separadas
+        nome_completo = f"{nome}\n{funcao}" if funcao else nome
+        revisado = self.emp_revisado.get(key, False)
+        values = (
+            emp.get("matricula", ""),
+            emp.get("cpf", ""),
+            self.emp_scale_choice.get(key, "6X1 (FIXO)"),
+            emp.get("posto", "") or "",
+            "✓" if revisado else "",
+        )
+        return nome_completo, values, revisado
 
-        row_count = 0
-        for emp in self.funcionarios:
-            nome = emp.get("nome", "")
-            funcao = emp.get("funcao", "")
-            # Monta o texto com nome e função em linhas separadas
-            nome_completo = f"{nome}\n{funcao}" if funcao else nome
-            mat = emp.get("matricula", "")
-            cpf = emp.get("cpf", "")
-            escala = self.emp_scale_choice.get(nome, "6X1 (FIXO)")
-            posto = emp.get("posto", "") or ""
-            revisado = "✓" if self.emp_revisado.get(nome, False) else ""
-            if not query:
-                pass_filter = True
-            else:
-                nome_norm = normalize_text(nome)
-                mat_norm = normalize_text(mat)
-                pass_filter = (query in nome_norm) or (query in mat_norm)
-            if pass_filter:
-                # Cores alternadas nas linhas
-                tag = 'evenrow' if row_count % 2 == 0 else 'oddrow'
-                iid = self.emp_tree.insert("", "end", values=(mat, cpf, escala, posto, revisado), 
-                                          text=nome_completo, tags=(tag,))
-                # Marca fundo verde na coluna revisado se estiver OK
-                if revisado == "✓":
-                    self.emp_tree.tag_configure(f"rev_{iid}", background="#27ae60", foreground="white")
-                    self.emp_tree.item(iid, tags=(f"rev_{iid}",))
-                row_count += 1
+    def _schedule_search(self, delay_ms: int = 150):
+        """Agrupa a digitação: filtra só quando o usuário para de digitar."""
+        if self._search_after is not None:
+            self.root.after_cancel(self._search_after)
+        self._search_after = self.root.after(delay_ms, self._run_search)
+
+    def _run_search(self):
+        self._search_after = None
+        self.update_employee_tree()
+
+    def update_employee_tree(self):
+        # Filtro de busca (nome, matrícula, CPF, posto e função; vários termos)
+        query = self.search_var.get() if hasattr(self, 'search_var') else ""
+        keys = None
+        if query.strip():
+            if self._search_index is None:
+                self._search_index = EmployeeSearchIndex(self.funcionarios)
+            keys = self._search_index.search(query)
+        if keys is None:
+            keys = [emp["id"] for emp in self.funcionarios]
+        if self._emp_sort:
+            keys = self._sorted_emp_keys(keys, *self._emp_sort)
+        self.emp_table.set_rows(keys)
         
         # Atualiza contadores de revisão
         self.update_revision_stats()
     
     def update_revision_stats(self):
         """Atualiza os contadores de funcionários revisados e não revisados"""
+        if self._revisados_count is None:
+            self._revisados_count = sum(1 for key in self.emp_index.by_key if self.emp_revisado.get(key, False))
         total = len(self.funcionarios)
-        revisados = sum(1 for nome in self.funcionarios if self.emp_revisado.get(nome.get("nome", ""), False))
+        revisados = self._revisados_count
         nao_revisados = total - revisados
         
         if hasattr(self, 'label_revisados'):
@@ -2541,40 +5726,54 @@ class PontoApp:
         if hasattr(self, 'label_nao_revisados'):
             self.label_nao_revisados.config(text=f"⚠ NÃO REVISADOS: {nao_revisados}")
 
+    def _emp_sort_table(self, col: str) -> Dict[str, tuple]:
+        """
+        Chave de ordenação de cada funcionário para a coluna.
+        Nome, matrícula, CPF e posto vêm do quadro e ficam em cache até ele mudar;
+        escala e revisado mudam a cada edição e são montados na hora (só leitura de dicionário).
+        """
+        table = self._emp_sort_keys.get(col)
+        if table is not None:
+            return table
+        table = {}
+        if col == "scale":
+            scales = self.emp_scale_choice
+            for emp in self.funcionarios:
+                table[emp["id"]] = (scales.get(emp["id"], "6X1 (FIXO)").casefold(),)
+            return table
+        if col == "revisado":
+            revisado = self.emp_revisado
+            for emp in self.funcionarios:
+                table[emp["id"]] = (bool(revisado.get(emp["id"], False)),)
+            return table
+        for emp in self.funcionarios:
+            if col == "mat":
+                mat = str(emp.get("matricula", "") or "").strip()
+                # Numéricas em ordem de número; as demais depois, em ordem alfabética
+                table[emp["id"]] = (0, int(mat), "") if mat.isdigit() else (1, 0, mat.casefold())
+            elif col == "cpf":
+                table[emp["id"]] = (only_digits(emp.get("cpf")),)
+            elif col == "posto":
+                table[emp["id"]] = (str(emp.get("posto", "") or "").casefold(),)
+            else:  # "#0": nome, sem a função
+                table[emp["id"]] = (str(emp.get("nome", "") or "").casefold(),)
+        self._emp_sort_keys[col] = table
+        return table
+
+    def _sorted_emp_keys(self, keys: List[str], col: str, reverse: bool) -> List[str]:
+        table = self._emp_sort_table(col)
+        return sorted(keys, key=lambda k: table.get(k, ()), reverse=reverse)
+
     def sort_emp_tree(self, col: str):
         """Ordena a tabela principal por qualquer coluna ao clicar no cabeçalho.
         col pode ser "#0" (nome) ou uma das colunas definidas em columns().
-        Alterna entre ascendente/descendente a cada clique.
+        Alterna entre ascendente/descendente a cada clique; a ordem vale
+        também para as próximas buscas.
         """
         # Direção atual (False = asc, True = desc). Primeiro clique = asc.
         reverse = self._emp_sort_dir.get(col, False)
-
-        # Captura itens visíveis e valor de ordenação para cada um
-        items = list(self.emp_tree.get_children(""))
-
-        def coerce(val: str) -> Any:
-            # Normaliza valor de comparação
-            if col == "mat":
-                try:
-                    return int(str(val).strip())
-                except Exception:
-                    return 0
-            return str(val).casefold()
-
-        def get_val(item_id: str):
-            if col == "#0":
-                v = self.emp_tree.item(item_id, "text")
-                # Extrai apenas o nome (primeira linha) para ordenação
-                v = v.split("\n")[0] if "\n" in v else v
-            else:
-                v = self.emp_tree.set(item_id, col)
-            return coerce(v)
-
-        items_sorted = sorted(items, key=get_val, reverse=reverse)
-
-        # Reordena visualmente os itens
-        for idx, iid in enumerate(items_sorted):
-            self.emp_tree.move(iid, "", idx)
+        self._emp_sort = (col, reverse)
+        self.emp_table.set_rows(self._sorted_emp_keys(self.emp_table.rows, col, reverse))
 
         # Alterna direção para o próximo clique
         self._emp_sort_dir[col] = not reverse
@@ -2585,33 +5784,38 @@ class PontoApp:
         if region != "cell":
             return
         col = self.emp_tree.identify_column(event.x)
-        # col retorna "#6" para a 6ª coluna (revisado)
-        if col != "#6":
+        # col retorna "#5" para a 5ª coluna de valores (revisado)
+        if col != "#5":
             return
-        iid = self.emp_tree.identify_row(event.y)
-        if not iid:
+        key = self.emp_table.key_at(event.y)
+        if not key:
             return
-        nome_completo = self.emp_tree.item(iid, "text")
-        # Extrai apenas o nome (primeira linha, antes do \n)
-        nome = nome_completo.split("\n")[0] if "\n" in nome_completo else nome_completo
-        # Alterna estado
-        current = self.emp_revisado.get(nome, False)
-        self.emp_revisado[nome] = not current
-        # Atualiza visualmente
-        self.update_employee_tree()
+        self.set_revisado(key, not self.emp_revisado.get(key, False))
+
+    def set_revisado(self, key: str, revisado: bool):
+        """Marca/desmarca a revisão: ajusta o contador e redesenha só a linha."""
+        before = bool(self.emp_revisado.get(key, False))
+        self.emp_revisado[key] = revisado
+        if self._revisados_count is not None and before != revisado and key in self.emp_index.by_key:
+            self._revisados_count += 1 if revisado else -1
+        self._employee_changed(key)
+
+    def _employee_changed(self, key: str):
+        """Um funcionário foi editado: só a linha dele é redesenhada (sem refazer a tabela)."""
+        self.emp_table.refresh_keys([key])
+        self.update_revision_stats()
+        if key == self._preview_key:
+            self._preview_overrides = {}
+            self.refresh_preview()
 
     # ---------------------------
     # POPUP DE EDIÇÃO DE FUNCIONÁRIO (MODAL)
     # ---------------------------
     def on_tree_double(self, event=None):
-        sel = self.emp_tree.selection()
-        if not sel:
+        key = self.emp_table.selected_key()
+        if not key:
             return
-        item = sel[0]
-        nome_completo = self.emp_tree.item(item, "text")
-        # Extrai apenas o nome (primeira linha, antes do \n)
-        nome = nome_completo.split("\n")[0] if "\n" in nome_completo else nome_completo
-        emp = next((e for e in self.funcionarios if e.get("nome") == nome), None)
+        emp = self.emp_index.get(key)
         if not emp:
             messagebox.showerror("ERRO", "FUNCIONÁRIO NÃO ENCONTRADO")
             return
@@ -2648,6 +5852,7 @@ class PontoApp:
         # Nome do funcionário
         Label(info_container, text="👤 ", font=("Segoe UI", 12), 
               fg="#ecf0f1", bg="#34495e").pack(side=LEFT)
+        nome = emp.get("nome", "")
         Label(info_container, text=nome, font=("Segoe UI", 12, "bold"), 
               fg="white", bg="#34495e").pack(side=LEFT, padx=(0, 20))
         
@@ -2667,11 +5872,12 @@ class PontoApp:
         config_frame.columnconfigure(3, weight=1)
         
         Label(config_frame, text="ESCALA:", font=("Helvetica", 10, "bold"), bg="#ffffff").grid(row=0, column=0, sticky="w", padx=10, pady=10)
-        escala_var = StringVar(value=self.emp_scale_choice.get(nome, "6X1 (FIXO)"))
+        escala_var = StringVar(value=self.emp_scale_choice.get(key, "6X1 (FIXO)"))
         escala_cb = ttk.Combobox(config_frame, textvariable=escala_var, values=list(SCALE_TYPES.keys()), state="readonly", width=20, font=("Helvetica", 10))
         escala_cb.grid(row=0, column=1, sticky="w", padx=5, pady=10)
 
         Label(config_frame, text="DATA 1ª FOLGA:", font=("Helvetica", 10, "bold"), bg="#ffffff").grid(row=0, column=2, sticky="w", padx=(30, 10), pady=10)
+        from tkcalendar import DateEntry  # carregado só quando abre um campo de data
         try:
             first_entry = DateEntry(
                 config_frame,
@@ -2698,18 +5904,36 @@ class PontoApp:
             )
         except TypeError:
             first_entry = DateEntry(config_frame, date_pattern="dd/mm/yyyy", width=16, font=("Helvetica", 10), state='normal')
-        if self.emp_first_off.get(nome):
+        if self.emp_first_off.get(key):
             try:
-                first_entry.set_date(datetime.strptime(self.emp_first_off[nome], "%Y-%m-%d").date())
+                first_entry.set_date(datetime.strptime(self.emp_first_off[key], "%Y-%m-%d").date())
             except Exception:
                 pass
         first_entry.grid(row=0, column=3, sticky="w", padx=5, pady=10)
 
+        # Prévia da escala acompanha a escolha antes de salvar
+        def preview_unsaved(event=None):
+            try:
+                folga = first_entry.get_date().strftime("%Y-%m-%d")
+            except Exception:
+                folga = None
+            self.preview_with(key, scale_type=escala_var.get(), first_off=folga)
+
+        def end_preview(event):
+            # Fechou sem salvar: a prévia volta ao que está gravado
+            if event.widget is top and self._preview_key == key and self._preview_overrides:
+                self._preview_overrides = {}
+                self.refresh_preview()
+
+        escala_cb.bind("<<ComboboxSelected>>", preview_unsaved)
+        first_entry.bind("<<DateEntrySelected>>", preview_unsaved)
+        top.bind("<Destroy>", end_preview, add="+")
+
         # Checkboxes
         checkbox_frame = Frame(frm, bg="#ffffff", relief="groove", bd=2)
         checkbox_frame.grid(row=2, column=0, columnspan=6, sticky="ew", pady=(0, 15), padx=2)
         
-        trava_var = BooleanVar(value=self.emp_trabalha_feriado.get(nome, False))
+        trava_var = BooleanVar(value=self.emp_trabalha_feriado.get(key, False))
         chk = ttk.Checkbutton(checkbox_frame, text="TRABALHA EM FERIADOS (PADRÃO: NÃO)", variable=trava_var)
         chk.grid(row=0, column=0, sticky="w", padx=15, pady=10)
 
@@ -2722,11 +5946,18 @@ class PontoApp:
 
         Button(
             btn_frame, text="⚙ GERENCIADOR DE OCORRÊNCIAS", 
-            command=lambda n=nome: self.popup_manage_absences(n),
+            command=lambda k=key: self.popup_manage_absences(k),
             bg="#3498db", fg="white", font=("Helvetica", 10, "bold"),
             relief="raised", bd=2, cursor="hand2", padx=10, pady=8
         ).grid(row=0, column=0, sticky="ew", padx=5, pady=4)
 
+        Button(
+            btn_frame, text="📜 HISTÓRICO DE ALTERAÇÕES",
+            command=lambda k=key: self.show_employee_history(k),
+            bg="#7f8c8d", fg="white", font=("Helvetica", 10, "bold"),
+            relief="raised", bd=2, cursor="hand2", padx=10, pady=8
+        ).grid(row=1, column=0, sticky="ew", padx=5, pady=4)
+
         current_row = 4
         
         # Botões de controle inferior com estilo
@@ -2734,20 +5965,21 @@ class PontoApp:
         sc_frame.grid(row=current_row, column=0, columnspan=6, sticky="ew", pady=(10, 5))
 
         def salvar():
-            self.emp_scale_choice[nome] = escala_var.get()
+            self.emp_scale_choice[key] = escala_var.get()
             try:
-                self.emp_first_off[nome] = first_entry.get_date().strftime("%Y-%m-%d")
+                self.emp_first_off[key] = first_entry.get_date().strftime("%Y-%m-%d")
             except Exception:
-                self.emp_first_off[nome] = ""
-            self.emp_trabalha_feriado[nome] = trava_var.get()
+                self.emp_first_off[key] = ""
+            self.emp_trabalha_feriado[key] = trava_var.get()
             
             # Horários e período noturno removidos - não são mais configuráveis
-            self.update_employee_tree()
+            self._employee_changed(key)
             self.store["emp_scale_choice"] = self.emp_scale_choice
             self.store["emp_first_off"] = self.emp_first_off
             self.store["emp_trabalha_feriado"] = self.emp_trabalha_feriado
             self.store["emp_faltas_atestados"] = self.emp_faltas_atestados # Garante que está no save
-            save_store(self.store)
+            if not self._save_store(parent=top):
+                return
             messagebox.showinfo("SALVO", f"CONFIGURAÇÕES DE {nome} SALVAS.")
             top.grab_release()
             top.destroy()
@@ -2767,7 +5999,39 @@ class PontoApp:
 
         self.root.wait_window(top)
 
-    def popup_manage_absences(self, nome: str):
+    def show_employee_history(self, key: str, start: Optional[str] = None, end: Optional[str] = None):
+        """Mostra o histórico de alterações (log de auditoria) de um funcionário."""
+        try:
+            records = AuditLog().history(key, start, end)
+        except Exception as e:
+            messagebox.showerror("ERRO", f"NÃO FOI POSSÍVEL LER A AUDITORIA:\n{e}")
+            return
+        nome = self._emp_label(key)
+        if not records:
+            messagebox.showinfo("HISTÓRICO", f"NENHUMA ALTERAÇÃO REGISTRADA PARA {nome}.")
+            return
+
+        def fmt(v):
+            txt = json.dumps(v, ensure_ascii=False) if v is not None else "-"
+            return txt if len(txt) <= 120 else txt[:117] + "..."
+
+        secoes = {
+            "emp_scale_choice": "ESCALA",
+            "emp_first_off": "1ª FOLGA",
+            "emp_faltas_atestados": "OCORRÊNCIAS",
+            "emp_revisado": "REVISADO",
+            "emp_trabalha_feriado": "TRABALHA FERIADO",
+            "emp_personal_hols": "FERIADOS PESSOAIS",
+        }
+        linhas = [f"FUNCIONÁRIO: {nome}", f"ALTERAÇÕES: {len(records)}", ""]
+        for rec in records:
+            linhas.append(f"{rec['t']}  {rec['u']}  {secoes.get(rec['s'], rec['s'].upper())}")
+            linhas.append(f"    ANTES:  {fmt(rec['o'])}")
+            linhas.append(f"    DEPOIS: {fmt(rec['n'])}")
+        self._show_scrollable_info("📜 HISTÓRICO DE ALTERAÇÕES", "\n".join(linhas))
+
+    def popup_manage_absences(self, key: str):
+        nome = self._emp_label(key)
         period = self._get_period_dates()
         if not period:
             return
@@ -2778,16 +6042,16 @@ class PontoApp:
 
         top = Toplevel(self.root)
         top.title(f"GERENCIADOR DE OCORRÊNCIAS - {nome}")
-        top.geometry("650x600")
+        top.geometry("720x680")
         top.transient(self.root)
         top.grab_set()
         top.configure(bg="#ecf0f1")
         
         # Centralizar na tela
         top.update_idletasks()
-        x = (top.winfo_screenwidth() // 2) - (650 // 2)
-        y = (top.winfo_screenheight() // 2) - (600 // 2)
-        top.geometry(f"650x600+{x}+{y}")
+        x = (top.winfo_screenwidth() // 2) - (720 // 2)
+        y = (top.winfo_screenheight() // 2) - (680 // 2)
+        top.geometry(f"720x680+{x}+{y}")
 
         # Cabeçalho
         header_frame = Frame(top, bg="#34495e", relief=RIDGE, bd=2)
@@ -2796,68 +6060,166 @@ class PontoApp:
         Label(header_frame, text=f"PERÍODO: {start.strftime('%d/%m/%Y')} - {end.strftime('%d/%m/%Y')}", 
               font=("Helvetica", 12, "bold"), bg="#34495e", fg="white", pady=10).pack()
 
-        # Container para a Treeview + Scrollbar
-        list_frame = Frame(top, bg="#ecf0f1")
-        list_frame.pack(fill=BOTH, expand=True, padx=10, pady=5)
-        
-        # Estilo para a Treeview
-        style = ttk.Style()
-        style.theme_use("clam")
-        style.configure("Custom.Treeview", 
-                       background="white",
-                       foreground="black",
-                       rowheight=25,
-                       fieldbackground="white",
-                       font=("Helvetica", 9))
-        style.map("Custom.Treeview", background=[("selected", "#3498db")])
-        style.configure("Custom.Treeview.Heading",
-                       background="#2c3e50",
-                       foreground="white",
-                       font=("Helvetica", 10, "bold"),
-                       relief=FLAT)
-
-        tree = ttk.Treeview(list_frame, columns=("data", "dia", "situacao"), show="headings", 
-                           height=15, style="Custom.Treeview")
-        tree.heading("data", text="DATA")
-        tree.heading("dia", text="DIA")
-        tree.heading("situacao", text="SITUAÇÃO (CLIQUE)")
-        tree.column("data", width=150, anchor="center")
-        tree.column("dia", width=100, anchor="center")
-        tree.column("situacao", width=280, anchor="center")
-        tree.pack(side=LEFT, fill=BOTH, expand=True)
-
-        # Scrollbar vertical
-        sb = ttk.Scrollbar(list_frame, orient="vertical", command=tree.yview)
-        tree.configure(yscrollcommand=sb.set)
-        sb.pack(side=LEFT, fill=Y)
-
-        emp_events = self.emp_faltas_atestados.get(nome, {})
-        # Mapa de data (dd/mm/YYYY) -> item id da Treeview, para aplicar períodos rapidamente
-        date_to_iid: Dict[str, str] = {}
-
-        for d in daterange(start, end):
+        # Rascunho das ocorrências (data ISO -> tipo); só vai para o store ao SALVAR.
+        # A tela mostra um mês por vez: abrir custa o mesmo para 1 mês ou 1 ano.
+        draft: Dict[str, str] = dict(self.emp_faltas_atestados.get(key, {}))
+        months = month_starts(start, end)
+        month_page = {(m.year, m.month): i for i, m in enumerate(months)}
+        state = {"page": 0, "anchor": start, "cursor": start, "dragging": False, "moved": False}
+
+        nav = Frame(top, bg="#ecf0f1")
+        nav.pack(fill=X, padx=10)
+        nav_btn = dict(bg="#34495e", fg="white", font=("Helvetica", 10, "bold"),
+                       relief="raised", bd=2, cursor="hand2", padx=10)
+        Button(nav, text="◀", command=lambda: go_page(state["page"] - 1), **nav_btn).pack(side=LEFT)
+        Button(nav, text="▶", command=lambda: go_page(state["page"] + 1), **nav_btn).pack(side=RIGHT)
+        month_label = Label(nav, font=("Helvetica", 12, "bold"), bg="#ecf0f1", fg="#2c3e50")
+        month_label.pack(side=LEFT, expand=True)
+
+        # Folha do mês: 6 semanas x 7 dias, células reaproveitadas a cada página
+        grid = Frame(top, bg="#bdc3c7")
+        grid.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        for col, wd in enumerate((6, 0, 1, 2, 3, 4, 5)):
+            Label(grid, text=WEEKDAY_PT_SHORT[wd], bg="#2c3e50", fg="white",
+                  font=("Helvetica", 10, "bold")).grid(row=0, column=col, sticky="nsew", padx=1, pady=1)
+            grid.columnconfigure(col, weight=1)
+        cells: List[Label] = []
+        cell_index: Dict[str, int] = {}
+        for i in range(42):
+            lbl = Label(grid, font=("Helvetica", 9, "bold"), width=10, height=3, bd=0,
+                        highlightthickness=2, cursor="hand2")
+            lbl.grid(row=1 + i // 7, column=i % 7, sticky="nsew", padx=1, pady=1)
+            cell_index[str(lbl)] = i
+            cells.append(lbl)
+        for row in range(1, 7):
+            grid.rowconfigure(row, weight=1)
+        cell_dates: List[date] = []
+
+        summary_label = Label(top, font=("Helvetica", 9), bg="#ecf0f1", fg="#2c3e50")
+        summary_label.pack(fill=X, padx=10)
+
+        def selection() -> Tuple[date, date]:
+            a, b = sorted((state["anchor"], state["cursor"]))
+            return max(a, start), min(b, end)
+
+        def render():
+            first = months[state["page"]]
+            month_label.config(text=f"{MONTH_NAMES_PT[first.month]} / {first.year}")
+            cell_dates[:] = month_grid_dates(first.year, first.month)
+            sel_a, sel_b = selection()
+            for lbl, d in zip(cells, cell_dates):
+                tipo = draft.get(d.strftime("%Y-%m-%d"), "")
+                if not (start <= d <= end):
+                    bg, fg = "#ecf0f1", "#bdc3c7"
+                elif tipo:
+                    bg, fg = OCCURRENCE_COLORS.get(tipo, "#7f8c8d"), "white"
+                else:
+                    bg, fg = "white", "#2c3e50" if d.month == first.month else "#95a5a6"
+                text = f"{d.day}\n{OCCURRENCE_LABELS.get(tipo, tipo)}" if tipo else str(d.day)
+                outline = "#2c3e50" if sel_a <= d <= sel_b else bg
+                lbl.config(text=text, bg=bg, fg=fg, highlightbackground=outline, highlightcolor=outline)
+            iso_a, iso_b = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+            counts: Dict[str, int] = {}
+            for ds, tipo in draft.items():
+                if iso_a <= ds <= iso_b:
+                    counts[tipo] = counts.get(tipo, 0) + 1
+            resumo = " | ".join(f"{OCCURRENCE_LABELS.get(t, t)}: {counts[t]}" for t in OCCURRENCE_TYPES if counts.get(t))
+            dias = (sel_b - sel_a).days + 1
+            summary_label.config(text=f"SELEÇÃO: {sel_a.strftime('%d/%m')} - {sel_b.strftime('%d/%m')} ({dias} DIA(S))"
+                                 + (f"   •   {resumo}" if resumo else ""))
+
+        def set_day(d: date, tipo: str):
             ds = d.strftime("%Y-%m-%d")
-            display = d.strftime("%d/%m/%Y")
-            day_name = WEEKDAY_PT_SHORT[d.weekday()]
-            status = emp_events.get(ds, "")
-            iid = tree.insert("", "end", values=(display, day_name, status.upper() if isinstance(status, str) else status))
-            date_to_iid[display] = iid
-
-        def cycle_status(e):
-            iid = tree.identify_row(e.y)
-            if not iid:
+            if tipo:
+                draft[ds] = tipo
+            else:
+                draft.pop(ds, None)
+
+        def apply_selection(tipo: str):
+            sel_a, sel_b = selection()
+            for d in daterange(sel_a, sel_b):
+                set_day(d, tipo)
+            render()
+
+        def cycle_status(d: date):
+            seq = [""] + list(OCCURRENCE_TYPES)
+            cur = draft.get(d.strftime("%Y-%m-%d"), "")
+            set_day(d, seq[(seq.index(cur) + 1) % len(seq)] if cur in seq else "FOLGA")
+            render()
+
+        def go_page(page: int):
+            if not 0 <= page < len(months):
                 return
-            v = list(tree.item(iid, "values"))
-            cur = v[2]
-            seq = ["", "FOLGA", "FERIADO"]
-            try:
-                idx = seq.index(cur)
-                v[2] = seq[(idx + 1) % len(seq)]
-            except Exception:
-                v[2] = "FOLGA"
-            tree.item(iid, values=v)
+            state["page"] = page
+            first = max(months[page], start)
+            state["anchor"] = state["cursor"] = first
+            render()
+
+        def move_cursor(days: int, extend: bool = False):
+            d = min(max(state["cursor"] + timedelta(days=days), start), end)
+            state["cursor"] = d
+            if not extend:
+                state["anchor"] = d
+            state["page"] = month_page[(d.year, d.month)]
+            render()
+
+        # Mouse: clique alterna o tipo do dia; arrastar seleciona um intervalo
+        def cell_at(e) -> Optional[date]:
+            w = top.winfo_containing(e.x_root, e.y_root)
+            i = cell_index.get(str(w)) if w is not None else None
+            if i is None or i >= len(cell_dates):
+                return None
+            d = cell_dates[i]
+            return d if start <= d <= end else None
+
+        def on_press(e):
+            d = cell_at(e)
+            if d is None:
+                return
+            state.update(anchor=d, cursor=d, dragging=True, moved=False)
+            render()
+
+        def on_motion(e):
+            if not state["dragging"]:
+                return
+            d = cell_at(e)
+            if d is None or d == state["cursor"]:
+                return
+            state["cursor"] = d
+            state["moved"] = True
+            render()
 
-        tree.bind("<Button-1>", cycle_status)
+        def on_release(e):
+            if not state["dragging"]:
+                return
+            state["dragging"] = False
+            if not state["moved"]:
+                cycle_status(state["cursor"])
+
+        for lbl in cells:
+            lbl.bind("<ButtonPress-1>", on_press)
+            lbl.bind("<B1-Motion>", on_motion)
+            lbl.bind("<ButtonRelease-1>", on_release)
+
+        # Aplicar à seleção: botões coloridos e teclas 1-4 / Del
+        brush = Frame(top, bg="#ecf0f1")
+        brush.pack(pady=(5, 0))
+        for n, tipo in enumerate(OCCURRENCE_TYPES, 1):
+            Button(brush, text=f"{n} {OCCURRENCE_LABELS[tipo]}", command=lambda t=tipo: apply_selection(t),
+                   bg=OCCURRENCE_COLORS[tipo], fg="white", font=("Helvetica", 9, "bold"),
+                   relief="raised", bd=2, cursor="hand2", padx=8).pack(side=LEFT, padx=3)
+            top.bind(str(n), lambda e, t=tipo: apply_selection(t))
+        Button(brush, text="DEL LIMPAR", command=lambda: apply_selection(""),
+               bg="#95a5a6", fg="white", font=("Helvetica", 9, "bold"),
+               relief="raised", bd=2, cursor="hand2", padx=8).pack(side=LEFT, padx=3)
+        for seq_key in ("<Delete>", "<BackSpace>", "0"):
+            top.bind(seq_key, lambda e: apply_selection(""))
+        top.bind("<space>", lambda e: cycle_status(state["cursor"]))
+        for seq_key, days in (("Left", -1), ("Right", 1), ("Up", -7), ("Down", 7)):
+            top.bind(f"<{seq_key}>", lambda e, n=days: move_cursor(n))
+            top.bind(f"<Shift-{seq_key}>", lambda e, n=days: move_cursor(n, extend=True))
+        top.bind("<Prior>", lambda e: go_page(state["page"] - 1))
+        top.bind("<Next>", lambda e: go_page(state["page"] + 1))
 
         def open_apply_period_dialog():
             # Janela simples para escolher tipo, data inicial e quantidade de dias
@@ -2887,7 +6249,7 @@ class PontoApp:
 
             Label(main_frame, text="Tipo de ocorrência:", bg="#ecf0f1", 
                   font=("Helvetica", 10)).grid(row=0, column=0, sticky="w", padx=10, pady=10)
-            tipos = ["FOLGA", "FERIADO"]
+            tipos = [OCCURRENCE_LABELS[t] for t in OCCURRENCE_TYPES]
             tipo_var = StringVar(value=tipos[0])
             tipo_cb = ttk.Combobox(main_frame, values=tipos, textvariable=tipo_var, 
                                   state="readonly", width=18, font=("Helvetica", 10))
@@ -2895,6 +6257,7 @@ class PontoApp:
 
             Label(main_frame, text="Data de início:", bg="#ecf0f1", 
                   font=("Helvetica", 10)).grid(row=1, column=0, sticky="w", padx=10, pady=10)
+            from tkcalendar import DateEntry  # carregado só quando abre um campo de data
             try:
                 de = DateEntry(main_frame, date_pattern="dd/mm/yyyy", locale="pt_BR", width=18,
                               state='normal', cursor='hand2', takefocus=True,
@@ -2933,19 +6296,17 @@ class PontoApp:
                     messagebox.showerror("ERRO", "Selecione um tipo de ocorrência.")
                     return
 
-                # Aplica na árvore apenas dentro do período da tela
+                label_to_type = {lbl: t for t, lbl in OCCURRENCE_LABELS.items()}
+                # Aplica no rascunho apenas dentro do período da tela
                 for i in range(max(1, qnt)):
                     cur_day = first_day + timedelta(days=i)
                     if cur_day < start or cur_day > end:
                         continue
-                    disp = cur_day.strftime("%d/%m/%Y")
-                    iid2 = date_to_iid.get(disp)
-                    if not iid2:
-                        continue
-                    vals = list(tree.item(iid2, "values"))
-                    if len(vals) >= 3:
-                        vals[2] = sel_tipo
-                        tree.item(iid2, values=vals)
+                    set_day(cur_day, label_to_type[sel_tipo])
+                if start <= first_day <= end:
+                    state["anchor"] = state["cursor"] = first_day
+                    state["page"] = month_page[(first_day.year, first_day.month)]
+                render()
 
                 dlg.grab_release()
                 dlg.destroy()
@@ -2966,20 +6327,10 @@ class PontoApp:
             dlg.wait_window(dlg)
 
         def save():
-            new_events = {}
-            for iid in tree.get_children():
-                v = tree.item(iid, "values")
-                # v[0] = "dd/mm/YYYY"
-                if v[2] in ("FOLGA", "FERIADO"):
-                    try:
-                        dt = datetime.strptime(v[0], "%d/%m/%Y").date()
-                        key = dt.strftime("%Y-%m-%d")
-                    except Exception:
-                        key = v[0]
-                    new_events[key] = v[2]
-
-            self.emp_faltas_atestados[nome] = new_events
-            self.update_employee_tree()
+            # O rascunho partiu de todas as ocorrências do funcionário, então as
+            # de fora do período da tela (ex.: importadas em lote) são mantidas
+            self.emp_faltas_atestados[key] = dict(draft)
+            self._employee_changed(key)
             messagebox.showinfo("SALVO", "OCORRÊNCIAS SALVAS.")
             top.grab_release()
             top.destroy()
@@ -2989,7 +6340,8 @@ class PontoApp:
         info_frame.pack(fill=X, padx=10, pady=5)
         
         info_label = Label(info_frame, 
-                          text="💡 Clique na coluna SITUAÇÃO para alternar entre os tipos de ocorrência",
+                          text="💡 Clique no dia para alternar o tipo • arraste para selecionar vários dias\n"
+                               "Teclas: 1-4 aplicam o tipo, Del limpa, espaço alterna, setas movem (Shift estende), PgUp/PgDn trocam o mês",
                           font=("Helvetica", 9, "italic"),
                           bg="#ecf0f1", fg="#7f8c8d")
         info_label.pack()
@@ -3013,6 +6365,9 @@ class PontoApp:
                relief="raised", bd=3, cursor="hand2",
                padx=20, pady=10, width=15).pack(side=LEFT, padx=5)
 
+        top.bind("<Escape>", lambda e: (top.grab_release(), top.destroy()))
+        render()
+        top.focus_set()
         self.root.wait_window(top)
 
     def save_config(self):
@@ -3029,7 +6384,8 @@ class PontoApp:
         self.store["emp_revisado"] = self.emp_revisado
         self.store["funcionarios"] = self.funcionarios
         self.store["all_postos_historico"] = sorted(list(self.all_postos_historico))
-        save_store(self.store)
+        if not self._save_store():
+            return
         messagebox.showinfo("SALVO", "CONFIGURAÇÕES SALVAS LOCALMENTE.")
 
     def show_pdf_generation_dialog(self):
@@ -3102,8 +6458,9 @@ class PontoApp:
         selection_frame.pack(fill=X, pady=(15, 0))
         selection_frame.pack_propagate(False)  # Mantém altura fixa
         
-        Label(selection_frame, text="SELECIONE OS ITENS:", 
-              font=("Helvetica", 10, "bold"), bg="#f0f0f0").pack(pady=5)
+        selection_title = Label(selection_frame, text="SELECIONE OS ITENS:", 
+                                font=("Helvetica", 10, "bold"), bg="#f0f0f0")
+        selection_title.pack(pady=5)
         
         # Listbox com scrollbar (altura limitada)
         list_container = Frame(selection_frame, bg="#f0f0f0")
@@ -3116,12 +6473,18 @@ class PontoApp:
                          yscrollcommand=scrollbar.set, font=("Helvetica", 9))
         listbox.pack(side=LEFT, fill=BOTH, expand=True)
         scrollbar.config(command=listbox.yview)
+        list_loader = IncrementalLoader(
+            listbox, lambda text: listbox.insert("end", text),
+            counter=selection_title, loading_text="SELECIONE OS ITENS: (CARREGANDO {done} DE {total}...)",
+            on_done=lambda: selection_title.config(text=f"SELECIONE OS ITENS ({listbox.size()}):"),
+        )
         
         # Botões de seleção rápida
         btn_frame = Frame(selection_frame, bg="#f0f0f0")
         btn_frame.pack(pady=5)
         
         def select_all():
+            list_loader.finish()
             listbox.select_set(0, "end")
         
         def deselect_all():
@@ -3135,24 +6498,29 @@ class PontoApp:
                bg="#e74c3c", fg="white", font=("Helvetica", 8, "bold"),
                padx=8, pady=3).pack(side=LEFT, padx=3)
         
+        # Chaves dos funcionários na mesma ordem da listbox (modo "funcionarios")
+        listed_keys: List[str] = []
+
         # Função para atualizar a lista baseado na seleção
         def update_list(*args):
+            list_loader.cancel()
             listbox.delete(0, "end")
+            listed_keys.clear()
             mode = mode_var.get()
             
             if mode == "postos":
-                # Lista postos únicos
-                postos = sorted(set(emp.get("posto", "SEM POSTO") for emp in self.funcionarios))
-                for posto in postos:
-                    listbox.insert("end", posto)
+                # Lista postos únicos (índice secundário por posto)
+                list_loader.load(sorted(self.emp_index.by_posto))
                 selection_frame.pack(fill=X, pady=(15, 0))
             elif mode == "funcionarios":
-                # Lista funcionários
-                for emp in sorted(self.funcionarios, key=lambda x: x.get("nome", "")):
+                # Lista funcionários; as chaves saem já na ordem em que as linhas vão entrar
+                textos = []
+                for emp in sorted(self.funcionarios, key=lambda x: (x.get("nome", ""), x["id"])):
                     nome = emp.get("nome", "")
                     funcao = emp.get("funcao", "")
-                    display_text = f"{nome} - {funcao}" if funcao else nome
-                    listbox.insert("end", display_text)
+                    textos.append(f"{nome} - {funcao}" if funcao else nome)
+                    listed_keys.append(emp["id"])
+                list_loader.load(textos)
                 selection_frame.pack(fill=X, pady=(15, 0))
             else:
                 # Esconde a lista para "todos" e "revisados"
@@ -3180,17 +6548,9 @@ class PontoApp:
                     messagebox.showwarning("AVISO", "SELECIONE PELO MENOS UM POSTO", parent=dlg)
                     return
             elif mode == "funcionarios":
-                # Pega funcionários selecionados (extrai nome antes do hífen)
+                # Pega as chaves dos funcionários selecionados
                 selected_indices = listbox.curselection()
-                result["selection"] = []
-                for i in selected_indices:
-                    text = listbox.get(i)
-                    # Formato: "NOME - FUNÇÃO" - extrai o nome
-                    if " - " in text:
-                        nome = text.split(" - ")[0]
-                        result["selection"].append(nome)
-                    else:
-                        result["selection"].append(text)
+                result["selection"] = [listed_keys[i] for i in selected_indices]
                 if not result["selection"]:
                     messagebox.showwarning("AVISO", "SELECIONE PELO MENOS UM FUNCIONÁRIO", parent=dlg)
                     return
@@ -3214,40 +6574,14 @@ class PontoApp:
         dlg.wait_window()
         return result if result["mode"] else None
 
-    def _show_professional_report(self, funcionarios_to_process, generated_files, nao_gerados_motivo):
+    def _show_professional_report(self, funcionarios_to_process, generated_files, nao_gerados_motivo, generated_keys):
         """Mostra relatório simples de geração de PDFs."""
         print(f"[DEBUG] Total de arquivos gerados: {len(generated_files)}")
         print(f"[DEBUG] Arquivos: {generated_files[:3] if generated_files else 'Nenhum'}")
         
-        # Identifica quem teve PDF gerado - simplificado
-        nomes_gerados = set()
-        if generated_files:
-            # Extrai nomes únicos dos funcionários que tiveram PDFs gerados
-            for f in generated_files:
-                try:
-                    # Formato do arquivo: 11.2025_NOME COMPLETO.pdf
-                    basename = os.path.basename(f).replace('.pdf', '')
-                    
-                    # Remove a parte da data (MM.YYYY_)
-                    if '_' in basename:
-                        nome_from_file = basename.split('_', 1)[1]  # Pega tudo depois do primeiro _
-                    else:
-                        nome_from_file = basename
-                    
-                    # Compara com os funcionários processados (case insensitive)
-                    nome_from_file_upper = nome_from_file.upper().strip()
-                    
-                    for emp in funcionarios_to_process:
-                        nome_emp = emp.get("nome", "").strip().upper()
-                        
-                        # Match exato ou contém
-                        if nome_emp == nome_from_file_upper or nome_emp in nome_from_file_upper:
-                            nomes_gerados.add(emp.get("nome", "").strip())
-                            print(f"[DEBUG] Match encontrado: {emp.get('nome', '')} -> {basename}")
-                            break
-                except Exception as e:
-                    print(f"[DEBUG] Erro ao processar arquivo {f}: {e}")
-                    continue
+        # Quem teve PDF gerado vem direto pela chave (sem casar nomes de arquivo)
+        nomes_gerados = [emp.get("nome", "").strip() for emp in funcionarios_to_process
+                         if emp["id"] in generated_keys]
         
         total_gerados = len(nomes_gerados)
         print(f"[DEBUG] Total de funcionários com PDFs: {total_gerados}")
@@ -3403,8 +6737,8 @@ class PontoApp:
             if nao_gerados > 0:
                 def show_not_generated():
                     # Identifica quem não teve PDF gerado
-                    nomes_nao_gerados = [emp.get("nome", "") for emp in funcionarios_to_process 
-                                        if emp.get("nome", "").strip() not in nomes_gerados]
+                    nao_gerados_emps = [emp for emp in funcionarios_to_process
+                                        if emp["id"] not in generated_keys]
                     
                     list_dlg = Toplevel(dlg)
                     list_dlg.title("FUNCIONÁRIOS NÃO GERADOS")
@@ -3443,7 +6777,8 @@ class PontoApp:
                     canvas.configure(yscrollcommand=scrollbar.set)
                     
                     # Preencher lista com motivos
-                    for idx, nome in enumerate(sorted(nomes_nao_gerados), 1):
+                    for idx, emp in enumerate(sorted(nao_gerados_emps, key=lambda e: e.get("nome", "")), 1):
+                        nome = emp.get("nome", "")
                         item_frame = Frame(scrollable_frame, bg="#f8f9fa" if idx % 2 == 0 else "white", 
                                           relief="groove", bd=1)
                         item_frame.pack(fill=X, pady=2, padx=5)
@@ -3457,7 +6792,7 @@ class PontoApp:
                         Label(name_motivo_frame, text=nome, font=("Segoe UI", 10, "bold"), 
                               bg=item_frame["bg"], fg="#2c3e50").pack(anchor="w")
                         
-                        motivo = nao_gerados_motivo.get(nome, "Motivo não especificado")
+                        motivo = nao_gerados_motivo.get(emp["id"], "Motivo não especificado")
                         Label(name_motivo_frame, text=f"Motivo: {motivo}", font=("Segoe UI", 8), 
                               bg=item_frame["bg"], fg="#7f8c8d", wraplength=550, justify=LEFT).pack(anchor="w")
                     
@@ -3554,6 +6889,68 @@ class PontoApp:
         
         dlg.wait_window()
 
+    def _build_employee_schedule(self, emp: Dict[str, Any], start: date, end: date,
+                                 scale_type: Optional[str] = None, first_off: Optional[str] = None) -> Dict[str, dict]:
+        """
+        Agenda calculada (AAAA-MM-DD -> entrada) de um funcionário no intervalo, via cache.
+        scale_type/first_off substituem os valores gravados (prévia de edição ainda não salva).
+        """
+        key = emp["id"]
+        conf = {
+            "start_date": start,
+            "end_date": end,
+            "holidays": self.global_holidays,
+            "holiday_type": self.holiday_type,
+            "holiday_postos": self.holiday_postos,
+            # Passando a escala e 1ª folga para a função de agendamento
+            "scale_type": scale_type if scale_type is not None else self.emp_scale_choice.get(key, "6X1 (FIXO)"),
+            "first_off": first_off if first_off is not None else self.emp_first_off.get(key)
+        }
+        return self._schedule_cache.get(emp, conf, self.emp_faltas_atestados)
+
+    def close_period_action(self):
+        """Congela a escala calculada de todos os funcionários nos meses do período atual."""
+        if not self.funcionarios:
+            messagebox.showwarning("AVISO", "CARREGUE PLANILHA PRIMEIRO")
+            return
+        period = self._get_period_dates()
+        if not period:
+            return
+        start, end = period
+        periodos = months_in_range(start, end)
+        snapshots = PeriodSnapshotStore()
+        try:
+            already = snapshots.load_range(start, end)
+        except Exception as e:
+            messagebox.showerror("ERRO", f"ERRO AO LER FECHAMENTOS:\n{e}")
+            return
+
+        meses_txt = ", ".join(f"{MONTH_NAMES_PT[int(p[5:7])]}/{p[:4]}" for p in periodos)
+        msg = (f"FECHAR O PERÍODO {start.strftime('%d/%m/%Y')} A {end.strftime('%d/%m/%Y')}?\n\n"
+               f"MESES: {meses_txt}\n\n"
+               "A escala de cada funcionário nesses meses será congelada. Reimpressões usarão "
+               "a escala congelada, mesmo que feriados, escalas ou folgas mudem depois.")
+        if already:
+            msg += (f"\n\n⚠ {len(already)} FUNCIONÁRIOS JÁ TÊM DIAS FECHADOS NESTE PERÍODO: ESSES DIAS SERÃO "
+                    "SUBSTITUÍDOS. DIAS FECHADOS FORA DO PERÍODO NÃO MUDAM.")
+        if not messagebox.askyesno("FECHAR PERÍODO", msg):
+            return
+
+        rows = []
+        for emp in self.funcionarios:
+            sch = self._build_employee_schedule(emp, start, end)
+            by_month: Dict[str, Dict[str, dict]] = {}
+            for ds, entry in sch.items():
+                by_month.setdefault(ds[:7], {})[ds] = entry
+            for periodo, month_schedule in by_month.items():
+                rows.append((periodo, emp["id"], month_schedule, emp))
+        try:
+            total = snapshots.close_period(rows)
+        except Exception as e:
+            messagebox.showerror("ERRO", f"ERRO AO FECHAR PERÍODO:\n{e}")
+            return
+        messagebox.showinfo("PERÍODO FECHADO", f"{total} ESCALAS MENSAIS CONGELADAS ({len(self.funcionarios)} FUNCIONÁRIOS).")
+
     def generate_all_pdfs(self):
         # Verificação inicial
         if not self.funcionarios:
@@ -3576,21 +6973,20 @@ class PontoApp:
         elif mode == "revisados":
             # Filtra apenas funcionários marcados como revisados (OK)
             funcionarios_to_process = [emp for emp in self.funcionarios 
-                                      if self.emp_revisado.get(emp.get("nome", ""), False)]
+                                      if self.emp_revisado.get(emp["id"], False)]
             if not funcionarios_to_process:
                 messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO MARCADO COMO OK (REVISADO)")
                 return
         elif mode == "postos":
-            # Filtra por postos selecionados
-            funcionarios_to_process = [emp for emp in self.funcionarios 
-                                      if emp.get("posto", "SEM POSTO") in selection]
+            # Filtra por postos selecionados (índice secundário por posto)
+            funcionarios_to_process = [self.emp_index.get(k) for posto in selection
+                                       for k in self.emp_index.keys_for_posto(posto)]
             if not funcionarios_to_process:
                 messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO ENCONTRADO NOS POSTOS SELECIONADOS")
                 return
         elif mode == "funcionarios":
-            # Filtra por nomes selecionados
-            funcionarios_to_process = [emp for emp in self.funcionarios 
-                                      if emp.get("nome", "") in selection]
+            # Filtra pelas chaves selecionadas
+            funcionarios_to_process = [self.emp_index.get(k) for k in selection if k in self.emp_index]
             if not funcionarios_to_process:
                 messagebox.showwarning("AVISO", "NENHUM FUNCIONÁRIO SELECIONADO FOI ENCONTRADO")
                 return
@@ -3605,56 +7001,47 @@ class PontoApp:
         adm_started = []  # (nome, admissao) -> quando gerou parcialmente a partir do mês de admissão
         generated_files = []
 
-        # Mapeia duplicidades por posto considerando nome com e sem ponto final
-        # Chave do grupo: (posto, nome_sem_ponto). Valor: lista de nomes originais desse posto
-        dup_index_map: Dict[Tuple[str, str, str], int] = {}
+        # Funcionários que caem na mesma pasta (mesmo posto e nome com/sem ponto final)
+        # recebem subpasta "Opcao N". Grupo: (posto, nome_sem_ponto) -> chaves.
+        dup_index_map: Dict[str, int] = {}
         from collections import defaultdict
         grupos = defaultdict(list)
         for emp in funcionarios_to_process:
             posto_emp = emp.get("posto", "SEM POSTO") or "SEM POSTO"
-            nome_emp = emp.get("nome", "") or ""
-            nome_base = nome_emp.rstrip(".").strip()
-            grupos[(posto_emp, nome_base)].append(nome_emp)
+            nome_base = (emp.get("nome", "") or "").rstrip(".").strip()
+            grupos[(posto_emp, nome_base)].append(emp)
         # Atribui índices (1,2,...) quando houver mais de um no mesmo grupo
-        for (posto_emp, nome_base), nomes_lista in grupos.items():
-            if len(nomes_lista) > 1:
-                # Ordena para deixar o sem ponto primeiro
-                nomes_ordenados = sorted(nomes_lista, key=lambda n: (n.endswith("."), n))
-                for idx, nome_original in enumerate(nomes_ordenados, start=1):
-                    dup_index_map[(posto_emp, nome_base, nome_original)] = idx
-        nao_gerados_motivo = {}  # Dict[nome, motivo] - rastreia motivo de cada não gerado
+        for emps_grupo in grupos.values():
+            if len(emps_grupo) > 1:
+                # Ordena para deixar o sem ponto primeiro; chave desempata homônimos
+                ordenados = sorted(emps_grupo, key=lambda e: (e.get("nome", "").endswith("."), e.get("nome", ""), e["id"]))
+                for idx, emp in enumerate(ordenados, start=1):
+                    dup_index_map[emp["id"]] = idx
+        nao_gerados_motivo = {}  # Dict[chave, motivo] - rastreia motivo de cada não gerado
+        generated_keys = set()
+
+        # Dias já fechados (assinados) são reimpressos a partir da escala congelada
+        try:
+            frozen = PeriodSnapshotStore().load_range(start, end)
+        except Exception as e:
+            print(f"[{now_str()}] ERRO AO LER FECHAMENTOS: {e}")
+            frozen = {}
 
         # Primeira passada: preparar agendas e coletar relatórios
-        prepared = []  # cada item: {nome, emp, conf, filtered_schedule, version_index}
+        prepared = []  # cada item: {key, nome, emp, filtered_schedule, frozen_jobs, version_index}
 
         for emp in funcionarios_to_process:
+            key = emp["id"]
             nome = emp.get("nome", "")
-            posto_do_emp = emp.get("posto", "SEM POSTO") or "SEM POSTO"
-            nome_base = nome.rstrip(".").strip()
-            version_index = dup_index_map.get((posto_do_emp, nome_base, nome))
+            version_index = dup_index_map.get(key)
             admissao = emp.get("admissao", None)
-            
-            # Passando a escala e 1ª folga para a função de agendamento
-            scale_type = self.emp_scale_choice.get(nome, "6X1 (FIXO)")
-            first_off_str = self.emp_first_off.get(nome)
-            
-            conf = {
-                "start_date": start,
-                "end_date": end,
-                "holidays": self.global_holidays,
-                "holiday_type": self.holiday_type,
-                "holiday_postos": self.holiday_postos,
-                "scale_type": scale_type,
-                "first_off": first_off_str
-            }
+
+            # Trechos congelados deste funcionário dentro do período: (dias, cabeçalho da época)
+            frozen_jobs = frozen.get(key, [])
+            frozen_days = {ds for days, _ in frozen_jobs for ds in days}
 
             # build schedule and detect admission month constraints
-            sch = {}
-            
-            # A função generate_employee_schedule agora usa os novos parâmetros de escala
-            for ds, entry in generate_employee_schedule(emp, conf, self.emp_faltas_atestados):
-                # record schedule
-                sch[ds] = entry
+            sch = self._build_employee_schedule(emp, start, end)
 
             # If admission after start: we need to skip months before admissao.
             # Build list of months that would be generated; skip months entirely before admission
@@ -3673,6 +7060,7 @@ class PontoApp:
                 months_to_generate.append((yr, mo))
 
             # generate a filtered schedule that only includes days of months_to_generate
+            # (dias fechados saem da escala congelada, não do cálculo)
             filtered_schedule = {}
             months_set = set(months_to_generate)
             for ds, e in sch.items():
@@ -3680,18 +7068,17 @@ class PontoApp:
                     dt = datetime.strptime(ds, "%Y-%m-%d").date()
                 except Exception:
                     continue
-                key = (dt.year, dt.month)
-                if key in months_set:
-                    filtered_schedule[ds] = e
+                if (dt.year, dt.month) in months_set and ds not in frozen_days:
+                    filtered_schedule[ds] = dict(e)  # cópia: a agenda vem do cache compartilhado
 
             # if filtered_schedule empty (e.g., admissão após o fim do período ou sem dias no months_to_generate)
-            if not filtered_schedule:
+            if not filtered_schedule and not frozen_jobs:
                 # report admission issue if any months were skipped by admission
                 if months_skipped_by_adm:
                     adm_issues.append((nome, emp.get("admissao")))
-                    nao_gerados_motivo[nome] = f"Admitido após o período ({emp.get('admissao').strftime('%d/%m/%Y') if emp.get('admissao') else 'data não informada'})"
+                    nao_gerados_motivo[key] = f"Admitido após o período ({emp.get('admissao').strftime('%d/%m/%Y') if emp.get('admissao') else 'data não informada'})"
                 else:
-                    nao_gerados_motivo[nome] = "Sem dias no período selecionado (agenda vazia)"
+                    nao_gerados_motivo[key] = "Sem dias no período selecionado (agenda vazia)"
                 # nothing to generate for this employee
                 continue
 
@@ -3708,55 +7095,86 @@ class PontoApp:
                     e["posto"] = emp.get("posto", "") or ""
 
             prepared.append({
+                "key": key,
                 "nome": nome,
                 "emp": emp,
-                "conf": conf,
                 "filtered_schedule": filtered_schedule,
+                "frozen_jobs": frozen_jobs,
                 "version_index": version_index,
             })
 
         # Segunda passada: gerar PDFs
         print(f"[DEBUG] Iniciando geração de PDFs para {len(prepared)} funcionários")
         for item in prepared:
+            key = item["key"]
             nome = item["nome"]
-            emp = item["emp"]
-            filtered_schedule = item["filtered_schedule"]
+            # Dias calculados agora + dias congelados; mês com dia fechado sai com o cabeçalho da época
+            jobs = overlay_frozen_days(item["filtered_schedule"], item["frozen_jobs"], item["emp"])
             
-            print(f"[DEBUG] Gerando PDF para {nome}, dias no schedule: {len(filtered_schedule)}")
+            print(f"[DEBUG] Gerando PDF para {nome}, dias no schedule: {sum(len(j[1]) for j in jobs)}")
 
             try:
-                saved = generate_pdf_for_employee(
-                    nome=emp.get("nome", ""),
-                    cpf=emp.get("cpf", ""),
-                    matricula=emp.get("matricula", ""),
-                    funcao=emp.get("funcao", ""),
-                    posto_global=emp.get("posto", ""),
-                    filial=emp.get("filial", ""),
-                    cnpj=emp.get("cnpj", ""),
-                    endereco=emp.get("endereco", ""),
-                    cidade=emp.get("cidade", ""), 
-                    schedule_map=filtered_schedule,
-
-                    out_folder=OUTPUT_FOLDER,
-                    version_index=item.get("version_index")
-                )
+                saved = []
+                for emp, schedule_map in jobs:
+                    saved += generate_pdf_for_employee(
+                        nome=emp.get("nome", ""),
+                        cpf=emp.get("cpf", ""),
+                        matricula=emp.get("matricula", ""),
+                        funcao=emp.get("funcao", ""),
+                        posto_global=emp.get("posto", ""),
+                        filial=emp.get("filial", ""),
+                        cnpj=emp.get("cnpj", ""),
+                        endereco=emp.get("endereco", ""),
+                        cidade=emp.get("cidade", ""), 
+                        schedule_map=schedule_map,
+
+                        out_folder=OUTPUT_FOLDER,
+                        version_index=item.get("version_index")
+                    ) or []
                 print(f"[DEBUG] {nome}: saved={len(saved) if saved else 0} arquivos")
                 if saved:
                     generated_files.extend(saved)
+                    generated_keys.add(key)
                 else:
                     # Se não salvou nenhum arquivo
-                    if nome not in nao_gerados_motivo:
-                        nao_gerados_motivo[nome] = "Nenhum mês com dias úteis para gerar PDF"
+                    if key not in nao_gerados_motivo:
+                        nao_gerados_motivo[key] = "Nenhum mês com dias úteis para gerar PDF"
             except Exception as e:
                 print(f"[{now_str()}] ERRO AO GERAR PDF PARA {nome}: {e}\n{traceback.format_exc()}")
-                nao_gerados_motivo[nome] = f"Erro durante a geração: {str(e)[:50]}"
+                nao_gerados_motivo[key] = f"Erro durante a geração: {str(e)[:50]}"
 
         # Criar relatório visual profissional
-        self._show_professional_report(funcionarios_to_process, generated_files, nao_gerados_motivo)
-        
+        self._show_professional_report(funcionarios_to_process, generated_files, nao_gerados_motivo, generated_keys)
+        
+def print_startup_report():
+    """Tempo de cada etapa da abertura e custo dos módulos adiados (--profile-startup)."""
+    import importlib
+    print("\n[PERFIL DE INICIALIZAÇÃO]")
+    prev = _STARTUP_T0
+    for label, t in _STARTUP_MARKS:
+        print(f"  {label:<32} {t - prev:8.3f} s")
+        prev = t
+    print(f"  {'TOTAL ATÉ A JANELA':<32} {prev - _STARTUP_T0:8.3f} s")
+    print("  MÓDULOS CARREGADOS SOB DEMANDA (fora do total):")
+    for name in DEFERRED_MODULES:
+        if name in sys.modules:
+            # Alguém voltou a importar na abertura: regressão
+            print(f"    {name:<30} JÁ CARREGADO NA ABERTURA!")
+            continue
+        t = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"    {name:<30} INDISPONÍVEL ({e})")
+            continue
+        print(f"    {name:<30} {time.perf_counter() - t:8.3f} s")
+
 def main():
+    profile_startup = "--profile-startup" in sys.argv[1:]
+    startup_mark("definições do módulo")
     safe_mkdir(OUTPUT_FOLDER)
     root = Tk()
+    startup_mark("janela Tk")
     root.title("GERADOR DE FOLHA DE PONTO - V.5.39")
     root.geometry("1280x800")
     root.configure(bg="#ecf0f1")
@@ -3790,7 +7208,14 @@ def main():
     root.bind('<Visibility>', check_window_state)
 
     app = PontoApp(root)
+    startup_mark("PontoApp (store + tela)")
+    root.update_idletasks()
+    startup_mark("primeiro desenho")
+    if profile_startup:
+        root.after_idle(print_startup_report)
     root.mainloop()
 
 if __name__ == "__main__":
+    # Necessário para a importação paralela no executável empacotado (Windows)
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file